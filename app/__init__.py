@@ -1,13 +1,21 @@
 # 顶部导入区域
 import os
-from flask import Flask, jsonify
+import time
+from flask import Flask, jsonify, request, g, Response
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
-from app.routes.llm import llm_bp
+from app.routes.llm import llm_bp, novel_tasks
 from app.routes.db import db_bp
 from app.routes.websocket import websocket_bp, socketio
 from app.models import db
 from app.config import Config
+from app.db_profiler import init_query_profiler
+from app.database import configure_database, configure_engine
+from app.stats import rebuild_stats_command
+from app.content_jobs import train_content_dict_command, migrate_content_command
+from app.archive import archive_chapters_command, thaw_chapter_command
+from app.partitions import partition_messages_command, extend_message_partitions_command
+from app.metrics import registry, instrument_engine, HTTP_REQUEST_DURATION, NOVEL_QUEUE_DEPTH
 
 def create_app() -> Flask:
     static_folder = os.path.join(os.path.dirname(__file__), "..", "frontend")
@@ -15,6 +23,7 @@ def create_app() -> Flask:
     CORS(app)  # 允许跨域请求
 
     app.config.from_object(Config)
+    configure_database(app)
     db.init_app(app)
     
     # 初始化SocketIO
@@ -25,6 +34,42 @@ def create_app() -> Flask:
     app.register_blueprint(db_bp)
     app.register_blueprint(websocket_bp)
 
+    # 统计表全量重建：flask --app run rebuild-stats
+    app.cli.add_command(rebuild_stats_command)
+    # 正文存储：训练 zstd 字典、迁移已有数据
+    app.cli.add_command(train_content_dict_command)
+    app.cli.add_command(migrate_content_command)
+    # 消息冷归档与分区
+    app.cli.add_command(archive_chapters_command)
+    app.cli.add_command(thaw_chapter_command)
+    app.cli.add_command(partition_messages_command)
+    app.cli.add_command(extend_message_partitions_command)
+
+    # 请求耗时指标
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request_duration(response):
+        started = g.pop('request_started', None)
+        if started is not None and request.endpoint != 'metrics':
+            HTTP_REQUEST_DURATION.observe(
+                time.perf_counter() - started,
+                endpoint=request.url_rule.rule if request.url_rule else 'unmatched',
+                method=request.method,
+                status=response.status_code
+            )
+        return response
+
+    NOVEL_QUEUE_DEPTH.set_function(
+        lambda: sum(1 for task in list(novel_tasks.values()) if task.get("status") == "processing")
+    )
+
+    @app.route("/metrics")
+    def metrics():
+        return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
     @app.route("/api/status")
     def status():
         return jsonify({"status": "ok", "message": "Backend API is running"})
@@ -35,6 +80,11 @@ def create_app() -> Flask:
     
     # 创建数据库表（生产环境建议使用迁移工具）
     with app.app_context():
+        for engine in db.engines.values():
+            configure_engine(engine, app.config)
         db.create_all()
+        for engine in db.engines.values():
+            instrument_engine(engine)
+        init_query_profiler(app, db.engines.values())
 
     return app
\ No newline at end of file
@@ -0,0 +1,213 @@
+from flask import current_app
+from sqlalchemy import select
+from app.config import Config
+from app.llm_client import create_client
+from app.routing import hedged_completion
+from app.rate_limit import bind_identity
+from app.models import db, ChapterStats, ChapterAnalysis
+from app.forks import chapter_history, latest_message_id, message_visible
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import json
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+client = create_client()
+
+# 剧情分析：提示词构造，以及按章节在后台自动分析
+#
+# AI 回复落库后检查章节自上次分析以来新增的消息数与正文量（chapter_stats 与 chapter_analyses 对比），
+# 达到 ANALYSIS_EVERY_MESSAGES 条或约 ANALYSIS_EVERY_TOKENS 个 token（中文按一字一个估算）时，
+# 提交到独立的小线程池生成分析并写入 chapter_analyses（每个章节只保留最新一次）。
+# handle_chat_stream 在前端未传 story_analysis 时直接读取已完成的最新结果，从不等待进行中的分析。
+
+# 分析请求（user 消息）
+ANALYSIS_REQUEST = "请根据提供的对话历史和上下文信息，分析当前剧情情况，提取关键事件并整理长期记忆。"
+
+# 后台分析需要保留的上下文字段（来自触发时的聊天请求）
+CONTEXT_FIELDS = ("worldview", "master_sitting", "background", "main_characters")
+
+
+def build_analysis_messages(data, history):
+    """根据上下文设定与历史对话构造剧情分析的提示词"""
+    worldview = data.get("worldview") or ""
+    master_sitting = data.get("master_sitting") or ""
+    background = data.get("background") or ""
+
+    # 统一处理 main_characters
+    main_characters = data.get("main_characters")
+    if isinstance(main_characters, (list, tuple)):
+        mc_text = ", ".join(map(str, main_characters))
+    elif isinstance(main_characters, dict):
+        mc_text = json.dumps(main_characters, ensure_ascii=False)
+    else:
+        mc_text = str(main_characters) if main_characters else "无明确角色"
+
+    # 构造结构化提示词，用于剧情分析
+    structured_prompt = f"""[Role]
+你是专业剧情分析师，从对话历史提取关键信息，结合世界观、角色与玩家设定，生成简短文本报告，助力后续创作。
+
+[Core Context]
+# 世界观
+{worldview or '无特殊设定'}
+
+# 核心人物
+{master_sitting}
+
+# 其余关系人物
+{mc_text or '无特定人物关系'}
+
+# 玩家背景设定
+{background or '无特定玩家背景'}
+
+[Current Conversation History]
+{json.dumps(history, ensure_ascii=False) if history else '无历史对话'}
+
+[Output Requirements]
+用流畅中文段落输出，每部分空行隔开，总字数控制在 300 字内：
+1. 剧情概览：用80字总结当前剧情走向。
+2. 关键事件：按时间顺序列出1-3个最重要的事件，每条20字以内，用"·"开头。
+3. 角色与玩家状态：40 字内说明核心角色与玩家的情感 / 立场。
+4. 关键伏笔：提 1-2 个影响后续剧情的重要信息。
+5. 当前悬念：30 字内点明主要矛盾或待解问题。
+
+无需任何标题或前缀，直接输出正文即可。
+"""
+
+    return [
+        {"role": "system", "content": structured_prompt},
+        {"role": "user", "content": ANALYSIS_REQUEST}
+    ]
+
+
+def _progress(chapter_id):
+    """(自上次分析以来新增的消息数, 新增的正文字符数)；章节尚无统计时返回 None
+
+    回溯删除了分析覆盖的消息时，分析记录随之删除（见 app/forks.truncate_history），按从头计算。
+    """
+    row = db.session.execute(
+        select(ChapterStats.message_count, ChapterStats.total_chars,
+               ChapterAnalysis.message_count, ChapterAnalysis.total_chars)
+        .outerjoin(ChapterAnalysis, ChapterAnalysis.chapter_id == ChapterStats.chapter_id)
+        .where(ChapterStats.chapter_id == chapter_id)
+    ).first()
+    if row is None:
+        return None
+    count, chars, analyzed_count, analyzed_chars = row
+    if analyzed_count is None or count < analyzed_count:
+        analyzed_count = analyzed_chars = 0
+    return count - analyzed_count, chars - analyzed_chars
+
+
+def latest_analysis(chapter_id):
+    """章节已完成的最新分析（回溯删除了分析覆盖的消息时已随之删除）"""
+    return db.session.execute(
+        select(ChapterAnalysis.content).where(ChapterAnalysis.chapter_id == chapter_id)
+    ).scalar()
+
+
+def save_analysis(chapter_id, content, message_id, message_count, total_chars):
+    analysis = db.session.get(ChapterAnalysis, chapter_id)
+    if analysis is None:
+        analysis = ChapterAnalysis(chapter_id=chapter_id)
+        db.session.add(analysis)
+    analysis.content = content
+    analysis.message_id = message_id
+    analysis.message_count = message_count
+    analysis.total_chars = total_chars
+    analysis.update_time = datetime.utcnow()
+
+
+class AnalysisScheduler:
+    """按章节自动触发的后台剧情分析
+
+    - 使用独立的小线程池（默认 1 个线程），不占用聊天主流程的工作线程
+    - 每个章节同时最多一个进行中的分析，进行中时不重复提交
+    """
+
+    def __init__(self, max_workers=1, every_messages=10, every_tokens=3000, window=20):
+        self.every_messages = every_messages
+        self.every_tokens = every_tokens
+        self.window = window
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='story-analysis')
+        self._lock = threading.Lock()
+        self._running = set()
+
+    def due(self, chapter_id):
+        progress = _progress(chapter_id)
+        if progress is None:
+            return False
+        messages, chars = progress
+        return messages >= self.every_messages or (self.every_tokens > 0 and chars >= self.every_tokens)
+
+    def maybe_schedule(self, chapter_id, data):
+        """AI 回复落库后调用：达到触发条件时提交后台分析，返回是否已提交"""
+        with self._lock:
+            if chapter_id in self._running:
+                return False
+        if not self.due(chapter_id):
+            return False
+        with self._lock:
+            if chapter_id in self._running:
+                return False
+            self._running.add(chapter_id)
+        context = {field: data.get(field) for field in CONTEXT_FIELDS}
+        app = current_app._get_current_object()
+        # 分析代用户调用大模型，token 用量计入触发请求的限流身份
+        self._executor.submit(bind_identity(self._run), app, chapter_id, context)
+        return True
+
+    def _run(self, app, chapter_id, context):
+        try:
+            with app.app_context():
+                stats = db.session.get(ChapterStats, chapter_id)
+                if stats is None:
+                    return
+                # 先记下本次分析覆盖到的位置，分析期间新增的消息计入下一次
+                message_id = latest_message_id(chapter_id)
+                message_count, total_chars = stats.message_count, stats.total_chars
+                history = chapter_history(chapter_id, self.window)
+                db.session.rollback()  # 调用大模型期间不占用数据库连接
+
+                response = hedged_completion(
+                    client, "chat_analyze_auto",
+                    messages=build_analysis_messages(context, history),
+                    temperature=0.3,
+                    max_tokens=700
+                )
+                content = response.choices[0].message.content
+                if not content:
+                    return
+                # 分析期间章节被回溯、覆盖的消息已删除时，结果描述的是已不存在的剧情，丢弃
+                if message_id is not None and not message_visible(chapter_id, message_id):
+                    logger.info(f"自动剧情分析已过期，丢弃 - chapter_id: {chapter_id}, message_id: {message_id}")
+                    return
+                save_analysis(chapter_id, content, message_id, message_count, total_chars)
+                db.session.commit()
+                logger.info(f"自动剧情分析完成 - chapter_id: {chapter_id}, message_id: {message_id}")
+        except Exception as e:
+            logger.error(f"自动剧情分析失败 - chapter_id: {chapter_id}: {str(e)}")
+        finally:
+            with self._lock:
+                self._running.discard(chapter_id)
+
+
+scheduler = AnalysisScheduler(
+    max_workers=Config.ANALYSIS_WORKERS,
+    every_messages=Config.ANALYSIS_EVERY_MESSAGES,
+    every_tokens=Config.ANALYSIS_EVERY_TOKENS,
+    window=Config.ANALYSIS_HISTORY_WINDOW,
+)
+
+
+def schedule_analysis(chapter_id, data):
+    """聊天流程中调用：未开启或出错时不影响主流程"""
+    if not Config.ANALYSIS_AUTO_ENABLED:
+        return False
+    try:
+        return scheduler.maybe_schedule(chapter_id, data)
+    except Exception as e:
+        logger.error(f"提交自动剧情分析失败: {str(e)}")
+        return False
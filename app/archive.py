@@ -0,0 +1,238 @@
+from datetime import datetime, timedelta
+from flask.cli import with_appcontext
+from sqlalchemy import select, insert, delete, exists, text
+from sqlalchemy.orm import aliased
+from app.models import db, Chapter, ConversationMessage, ChapterStats, ArchivedChapter
+import click
+import json
+import logging
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # 未安装时用 zlib 压缩
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# 冷归档：长期不活跃章节的消息整体打包为 archived_chapters 中的一行（压缩的 NDJSON），
+# 从 conversation_messages 删除，热表及其索引只保留活跃章节，规模不随历史数据增长。
+#
+# 读取时透明回退：可见消息的查询（app/forks.py）在祖先链中有已归档章节时，把冷数据与热表结果归并；
+# 归档后章节仍可继续追加新消息（写入热表），回溯、分支物化等需要改写历史的操作会先把章节解冻回热表。
+
+RECORD_FIELDS = ('id', 'user_id', 'role', 'content', 'flags', 'create_time')
+
+
+def _pack(records, level):
+    """消息列字典列表 -> (编码, 压缩后的 NDJSON)"""
+    lines = []
+    for record in records:
+        item = {name: record[name] for name in RECORD_FIELDS}
+        item['create_time'] = record['create_time'].isoformat() if record['create_time'] else None
+        lines.append(json.dumps(item, ensure_ascii=False, separators=(',', ':')))
+    data = '\n'.join(lines).encode('utf-8')
+    if zstandard is not None:
+        return 'zstd', zstandard.ZstdCompressor(level=level).compress(data)
+    return 'zlib', zlib.compress(data, min(level, 9))
+
+
+def _unpack(archive):
+    """归档行 -> 消息列字典列表（按 id 排序，含 chapter_id）"""
+    if archive.codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("读取 zstd 归档需要安装 zstandard")
+        data = zstandard.ZstdDecompressor().decompress(archive.payload)
+    else:
+        data = zlib.decompress(archive.payload)
+    records = []
+    for line in data.decode('utf-8').splitlines():
+        record = json.loads(line)
+        record['chapter_id'] = archive.chapter_id
+        if record['create_time']:
+            record['create_time'] = datetime.fromisoformat(record['create_time'])
+        records.append(record)
+    return records
+
+
+def _sort_key(record):
+    return record['create_time'] or datetime.min, record['id']
+
+
+def archived_ids(chapter_ids):
+    """其中已归档（冷表中有消息）的章节 id"""
+    if not chapter_ids:
+        return set()
+    return set(db.session.scalars(
+        select(ArchivedChapter.chapter_id).where(ArchivedChapter.chapter_id.in_(list(chapter_ids)))
+    ))
+
+
+def cold_records(chain):
+    """祖先链 [(章节 id, 上界)] 中已归档部分的消息，按 (create_time, id) 排序"""
+    bounds = dict(chain)
+    records = []
+    if not bounds:
+        return records
+    for archive in db.session.scalars(select(ArchivedChapter).where(ArchivedChapter.chapter_id.in_(list(bounds)))):
+        bound = bounds[archive.chapter_id]
+        records.extend(record for record in _unpack(archive) if bound is None or record['id'] <= bound)
+    records.sort(key=_sort_key)
+    return records
+
+
+def cold_world_chapters(world_id):
+    """世界内已归档的章节，按章节 id 逐个产出 (章节 id, 消息列字典列表)，每次只解压一个章节"""
+    chapter_ids = db.session.scalars(
+        select(ArchivedChapter.chapter_id).join(Chapter, Chapter.id == ArchivedChapter.chapter_id)
+        .where(Chapter.world_id == world_id).order_by(ArchivedChapter.chapter_id)
+    ).all()
+    for chapter_id in chapter_ids:
+        archive = db.session.get(ArchivedChapter, chapter_id)
+        records = _unpack(archive)
+        db.session.expunge(archive)
+        yield chapter_id, records
+
+
+def archive_chapter(chapter_id, level=9):
+    """把章节当前在热表中的消息移入冷表（已有归档时合并），返回移动的条数"""
+    columns = [getattr(ConversationMessage, name) for name in RECORD_FIELDS]
+    rows = db.session.execute(
+        select(*columns).where(ConversationMessage.chapter_id == chapter_id).order_by(ConversationMessage.id)
+    ).all()
+    if not rows:
+        return 0
+    moved = [dict(zip(RECORD_FIELDS, row)) for row in rows]
+    archive = db.session.get(ArchivedChapter, chapter_id)
+    records = (_unpack(archive) if archive is not None else []) + moved
+
+    codec, payload = _pack(records, level)
+    times = [record['create_time'] for record in records if record['create_time']]
+    if archive is None:
+        archive = ArchivedChapter(chapter_id=chapter_id)
+        db.session.add(archive)
+    archive.message_count = len(records)
+    archive.total_chars = sum(len(record['content']) for record in records)
+    archive.first_message_id = records[0]['id']
+    archive.last_message_id = records[-1]['id']
+    archive.last_message_time = max(times) if times else None
+    archive.codec = codec
+    archive.payload = payload
+    archive.archive_time = datetime.utcnow()
+
+    # 只删除已读出的消息，归档期间新写入的消息留在热表
+    db.session.execute(delete(ConversationMessage).where(
+        ConversationMessage.chapter_id == chapter_id, ConversationMessage.id <= moved[-1]['id']
+    ))
+    return len(moved)
+
+
+def thaw_chapters(chapter_ids, from_message_id=None):
+    """把已归档章节的消息按原 id 写回热表并删除归档，返回写回的条数
+
+    from_message_id 不为空时只解冻含有 id >= from_message_id 的消息的章节（回溯只涉及这部分）。
+    """
+    restored = 0
+    if not chapter_ids:
+        return restored
+    statement = select(ArchivedChapter).where(ArchivedChapter.chapter_id.in_(list(chapter_ids)))
+    if from_message_id is not None:
+        statement = statement.where(ArchivedChapter.last_message_id >= from_message_id)
+    archives = db.session.scalars(statement).all()
+    for archive in archives:
+        records = _unpack(archive)
+        db.session.execute(insert(ConversationMessage), [
+            {name: record[name] for name in ('chapter_id',) + RECORD_FIELDS} for record in records
+        ])
+        db.session.delete(archive)
+        restored += len(records)
+        logger.info(f"章节 {archive.chapter_id} 已解冻，写回消息 {len(records)} 条")
+    db.session.flush()
+    return restored
+
+
+def forget_archives(chapter_ids):
+    """删除章节前调用：删除其归档，返回归档中的消息数"""
+    if not chapter_ids:
+        return 0
+    archives = db.session.execute(
+        select(ArchivedChapter.chapter_id, ArchivedChapter.message_count)
+        .where(ArchivedChapter.chapter_id.in_(list(chapter_ids)))
+    ).all()
+    if archives:
+        db.session.execute(delete(ArchivedChapter).where(ArchivedChapter.chapter_id.in_([row[0] for row in archives])))
+    return sum(row[1] for row in archives)
+
+
+def archive_candidates(inactive_days, limit):
+    """最近一条消息早于 inactive_days 天、热表中仍有消息的章节；被分支共享消息的章节不归档"""
+    cutoff = datetime.utcnow() - timedelta(days=inactive_days)
+    child = aliased(Chapter)
+    return db.session.scalars(
+        select(ChapterStats.chapter_id)
+        .where(
+            ChapterStats.last_message_time < cutoff,
+            exists().where(ConversationMessage.chapter_id == ChapterStats.chapter_id),
+            ~exists().where(child.origin_chapter_id == ChapterStats.chapter_id, child.fork_message_id.is_not(None)),
+        )
+        .order_by(ChapterStats.last_message_time)
+        .limit(limit)
+    ).all()
+
+
+def ids_reusable():
+    """消息 id 是否可能被重用：SQLite 的非 AUTOINCREMENT 表会把新 id 分配为当前最大 id + 1"""
+    if db.engine.dialect.name != 'sqlite':
+        return False
+    sql = db.session.execute(
+        text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {'name': ConversationMessage.__tablename__}
+    ).scalar()
+    return 'AUTOINCREMENT' not in (sql or '').upper()
+
+
+def archive_inactive(inactive_days, limit=1000, level=9, pause=0.0):
+    """归档不活跃章节，每个章节单独提交；返回 (章节数, 消息数)"""
+    if ids_reusable():
+        raise RuntimeError('SQLite 的 conversation_messages 不是 AUTOINCREMENT 表，归档后消息 id 可能被重用')
+    chapters = messages = 0
+    for chapter_id in archive_candidates(inactive_days, limit):
+        try:
+            moved = archive_chapter(chapter_id, level)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"归档章节 {chapter_id} 失败: {e}")
+            continue
+        chapters += 1
+        messages += moved
+        if pause:
+            time.sleep(pause)
+    logger.info(f"归档完成: 章节 {chapters} 个，消息 {messages} 条")
+    return chapters, messages
+
+
+@click.command('archive-chapters')
+@click.option('--inactive-days', default=180, show_default=True, help='最近一条消息早于该天数的章节')
+@click.option('--limit', default=1000, show_default=True, help='本次最多归档的章节数')
+@click.option('--level', default=9, show_default=True, help='压缩级别')
+@click.option('--pause', default=0.0, show_default=True, help='每个章节之间暂停的秒数')
+@with_appcontext
+def archive_chapters_command(inactive_days, limit, level, pause):
+    """把不活跃章节的消息移入冷表 archived_chapters（依赖 chapter_stats，需先 rebuild-stats）"""
+    try:
+        chapters, messages = archive_inactive(inactive_days, limit, level, pause)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"归档章节 {chapters} 个，消息 {messages} 条")
+
+
+@click.command('thaw-chapter')
+@click.argument('chapter_ids', nargs=-1, type=int, required=True)
+@with_appcontext
+def thaw_chapter_command(chapter_ids):
+    """把指定章节的归档消息写回热表"""
+    restored = thaw_chapters(chapter_ids)
+    db.session.commit()
+    click.echo(f"写回消息 {restored} 条")
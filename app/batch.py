@@ -0,0 +1,84 @@
+from flask import current_app, request
+from werkzeug.exceptions import HTTPException
+from app.database import route_reads_to_replica
+from app.models import db
+from app.serializers import dumps
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 批量请求：在一个 HTTP 请求内依次执行多个 /api/db 的 GET 子请求
+# 子请求在嵌套的请求上下文中直接调用视图函数，与外层请求共用应用上下文，
+# 因而共用同一个数据库会话与只读副本选择；相同的子请求只执行一次。
+# 结果按提交顺序流式返回：{"responses": [{"index", "path", "status", "body"}, ...]}
+
+PREFIX = '/api/db'
+
+
+class BatchError(ValueError):
+    """批量请求格式错误"""
+
+
+def parse_batch(data, max_requests):
+    """校验请求体，返回子请求路径列表（可省略 /api/db 前缀）"""
+    items = data.get('requests') if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        raise BatchError('requests 必须为非空数组')
+    if len(items) > max_requests:
+        raise BatchError(f'单次最多 {max_requests} 个子请求')
+
+    paths = []
+    for index, item in enumerate(items):
+        if isinstance(item, str):
+            item = {'path': item}
+        if not isinstance(item, dict) or not isinstance(item.get('path'), str):
+            raise BatchError(f'第 {index} 个子请求缺少 path')
+        if (item.get('method') or 'GET').upper() != 'GET':
+            raise BatchError(f'第 {index} 个子请求只支持 GET')
+        path = item['path']
+        if not path.startswith(PREFIX + '/'):
+            path = PREFIX + ('' if path.startswith('/') else '/') + path
+        paths.append(path)
+    return paths
+
+
+def _dispatch(app, path, environ_base):
+    """在嵌套请求上下文中执行一个子请求，返回 (状态码, JSON 字节串)"""
+    with app.test_request_context(path, method='GET', environ_base=environ_base):
+        try:
+            if request.routing_exception is not None:
+                raise request.routing_exception
+            endpoint = request.url_rule.endpoint
+            if not endpoint.startswith('db.') or endpoint == 'db.batch':
+                return 400, dumps({'error': '不支持的子请求路径'})
+            route_reads_to_replica(app)
+            response = app.make_response(app.ensure_sync(app.view_functions[endpoint])(**request.view_args))
+        except HTTPException as e:
+            response = e.get_response()
+        except Exception as e:
+            # 子请求共用外层的数据库会话，失败的语句（如语句超时）会使事务进入中止状态，回滚后后续子请求才能继续查询
+            db.session.rollback()
+            logger.error(f"批量子请求失败 {path}: {e}")
+            return 500, dumps({'error': str(e)})
+
+        if response.status_code >= 500:
+            # 视图自行捕获异常返回 500 时同样回滚
+            db.session.rollback()
+        if response.is_streamed or not response.is_json:
+            return 400, dumps({'error': '子请求返回的不是 JSON（导出类接口请单独调用）'})
+        return response.status_code, response.get_data()
+
+
+def run_batch(paths):
+    """逐个执行子请求并产出响应体片段（在外层请求的上下文中迭代）"""
+    app = current_app._get_current_object()
+    environ_base = {'REMOTE_ADDR': request.remote_addr}
+    results = {}
+    yield b'{"responses":['
+    for index, path in enumerate(paths):
+        if path not in results:
+            results[path] = _dispatch(app, path, environ_base)
+        status, body = results[path]
+        yield (b',' if index else b'') + dumps({'index': index, 'path': path, 'status': status})[:-1] \
+            + b',"body":' + body + b'}'
+    yield b']}'
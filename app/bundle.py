@@ -0,0 +1,385 @@
+from datetime import datetime
+from sqlalchemy import insert, select, union, update, or_
+from app.models import (
+    db, User, World, WorldCharacter, Chapter, ConversationMessage, NovelRecord, UserWorld, CompressedText
+)
+from app.serializers import dumps, WORLD, WORLD_CHARACTER, CHAPTER, MESSAGE, NOVEL, USER_WORLD
+from app.export import stream_rows, with_archived
+from app.archive import cold_world_chapters
+from app.content import split_body
+from app.stats import refresh_chapters, refresh_worlds
+import io
+import json
+import zipfile
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 世界包：一个 zip，内含 manifest.json 与各表的 NDJSON 文件，用于克隆或跨实例迁移整个世界
+#   world.ndjson        世界本身（一行）
+#   characters.ndjson   角色
+#   chapters.ndjson     章节（保留源 id，导入时重新分配）
+#   user_worlds.ndjson  世界成员
+#   messages.ndjson     对话消息
+#   novels.ndjson       小说
+#   users.ndjson        涉及的用户 {id, username}，导入时按用户名对应到目标库的用户
+#   manifest.json       格式版本与各文件行数，最后写入，导入时用于校验完整性
+#
+# 导出边读边压缩边发送；导入逐行读取，按批多行插入（PostgreSQL + psycopg 时消息与小说使用 COPY），
+# 整个导入在一个事务中完成，内存占用只与章节数、用户数有关
+
+BUNDLE_FORMAT = 'world-bundle'
+BUNDLE_VERSION = 1
+
+_FLUSH_BYTES = 64 * 1024
+
+
+class BundleError(ValueError):
+    """世界包格式错误或内容不完整"""
+
+
+class _ChunkSink:
+    """zipfile 的只写输出：收集压缩后的字节，由生成器分块取走（不可 seek，zipfile 会使用数据描述符）"""
+
+    def __init__(self):
+        self._chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        self.size = 0
+        return data
+
+
+def _bundle_users(world_id):
+    """世界包涉及的全部用户：世界创建者、章节创建者、消息与小说作者（含已归档的消息）、世界成员"""
+    chapter_ids = select(Chapter.id).where(Chapter.world_id == world_id)
+    archived_users = {row['user_id'] for _, rows in cold_world_chapters(world_id) for row in rows}
+    user_ids = union(
+        select(World.user_id).where(World.id == world_id),
+        select(Chapter.creator_user_id).where(Chapter.world_id == world_id),
+        select(ConversationMessage.user_id).where(ConversationMessage.chapter_id.in_(chapter_ids)),
+        select(NovelRecord.user_id).where(NovelRecord.chapter_id.in_(chapter_ids)),
+        select(UserWorld.user_id).where(UserWorld.world_id == world_id),
+    ).subquery()
+    rows = db.session.execute(
+        select(User.id, User.username)
+        .where(or_(User.id.in_(select(user_ids.c[0])), User.id.in_(sorted(archived_users)))).order_by(User.id)
+    )
+    for user_id, username in rows:
+        yield {'id': user_id, 'username': username}
+
+
+def _bundle_sections(world, batch_size):
+    world_id = world['id']
+    chapters_in_world = Chapter.world_id == world_id
+    yield 'world.ndjson', iter([world])
+    yield 'characters.ndjson', stream_rows(
+        WORLD_CHARACTER.select().where(WorldCharacter.world_id == world_id).order_by(WorldCharacter.id),
+        WORLD_CHARACTER, None, batch_size
+    )
+    yield 'chapters.ndjson', stream_rows(
+        CHAPTER.select().where(chapters_in_world).order_by(Chapter.id), CHAPTER, None, batch_size
+    )
+    yield 'user_worlds.ndjson', stream_rows(
+        USER_WORLD.select().where(UserWorld.world_id == world_id).order_by(UserWorld.id), USER_WORLD, None, batch_size
+    )
+    yield 'messages.ndjson', with_archived(stream_rows(
+        MESSAGE.select().join(Chapter, Chapter.id == ConversationMessage.chapter_id).where(chapters_in_world)
+        # 按章节、id 顺序写出：导入后新 id 保持章节内的相对顺序，分支点可据此换算；
+        # 父章节 id 总小于分支章节，祖先的消息先于后代写入，跨章节比较分支点上界时顺序也不变
+        .order_by(ConversationMessage.chapter_id, ConversationMessage.id),
+        MESSAGE, None, batch_size
+    ), world_id, None, key=lambda item: (item['chapter_id'], item['id']))
+    yield 'novels.ndjson', stream_rows(
+        NOVEL.select().join(Chapter, Chapter.id == NovelRecord.chapter_id).where(chapters_in_world)
+        .order_by(NovelRecord.id),
+        NOVEL, None, batch_size
+    )
+    yield 'users.ndjson', _bundle_users(world_id)
+
+
+def export_bundle(world, batch_size, level=6):
+    """世界包导出生成器：逐块产出 zip 字节；world 为 WORLD 序列化后的世界字典"""
+    sink = _ChunkSink()
+    counts = {}
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=level) as bundle:
+        for name, records in _bundle_sections(world, batch_size):
+            count = 0
+            with bundle.open(name, 'w', force_zip64=True) as member:
+                for record in records:
+                    member.write(dumps(record) + b'\n')
+                    count += 1
+                    if sink.size >= _FLUSH_BYTES:
+                        yield sink.drain()
+            counts[name] = count
+        manifest = {
+            'format': BUNDLE_FORMAT,
+            'version': BUNDLE_VERSION,
+            'source_world_id': world['id'],
+            'exported_at': datetime.utcnow().isoformat(),
+            'counts': counts,
+        }
+        bundle.writestr('manifest.json', json.dumps(manifest, ensure_ascii=False, indent=2))
+    yield sink.drain()
+
+
+def _read_lines(bundle, name):
+    with bundle.open(name) as member:
+        for line in io.TextIOWrapper(member, encoding='utf-8'):
+            if line.strip():
+                yield json.loads(line)
+
+
+def _timestamp(value):
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value or datetime.utcnow()
+
+
+def _batches(rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class BundleImporter:
+    """把世界包导入为一个新世界：重新分配全部 id，用户按用户名对应，找不到的用户归到导入者名下
+
+    owner_id 为导入者，成为新世界的创建者；导入在调用方的事务中进行，由调用方提交或回滚。
+    """
+
+    def __init__(self, bundle, owner_id, batch_size=1000, use_copy=True):
+        self.bundle = bundle
+        self.owner_id = owner_id
+        self.batch_size = batch_size
+        self.use_copy = use_copy
+        self.user_map = {}
+        self.chapter_map = {}
+        self.counts = {}
+        # 源章节 id -> (源父章节 id, 源分支点)，章节全部写入后再关联
+        self.origins = {}
+        # 分支点引用的源消息 id -> (源章节 id, 该消息在章节内按 id 排序的序号)；
+        # 分支点可能是父章节继承自更上层祖先的消息，所在章节不一定是父章节
+        self.fork_targets = {}
+        self._positions = {}
+
+    def _check_manifest(self):
+        try:
+            manifest = json.loads(self.bundle.read('manifest.json'))
+        except KeyError:
+            raise BundleError('世界包缺少 manifest.json')
+        if manifest.get('format') != BUNDLE_FORMAT or manifest.get('version') != BUNDLE_VERSION:
+            raise BundleError(f"不支持的世界包格式: {manifest.get('format')} v{manifest.get('version')}")
+        names = set(self.bundle.namelist())
+        missing = [name for name in manifest.get('counts', {}) if name not in names]
+        if missing:
+            raise BundleError(f"世界包缺少文件: {', '.join(missing)}")
+        return manifest
+
+    def _map_users(self):
+        """源用户 id -> 目标库用户 id（按用户名匹配）"""
+        for batch in _batches(_read_lines(self.bundle, 'users.ndjson'), self.batch_size):
+            by_name = {user['username']: user['id'] for user in batch}
+            rows = db.session.execute(select(User.username, User.id).where(User.username.in_(list(by_name))))
+            for username, target_id in rows:
+                self.user_map[by_name[username]] = target_id
+
+    def _user(self, source_id):
+        return self.user_map.get(source_id, self.owner_id)
+
+    def _chapter(self, source_id):
+        try:
+            return self.chapter_map[source_id]
+        except KeyError:
+            raise BundleError(f"世界包引用了不存在的章节: {source_id}")
+
+    def _insert(self, name, table, rows):
+        count = 0
+        for batch in _batches(rows, self.batch_size):
+            db.session.execute(insert(table), batch)
+            count += len(batch)
+        self.counts[name] = count
+
+    def _copy(self, name, table, columns, rows):
+        """PostgreSQL + psycopg 3：COPY FROM STDIN 批量写入，其余情况退回多行插入"""
+        connection = db.session.connection()
+        if not (self.use_copy and connection.dialect.name == 'postgresql' and connection.dialect.driver == 'psycopg'):
+            self._insert(name, table, rows)
+            return
+        count = 0
+        dbapi_connection = connection.connection.dbapi_connection
+        statement = f"COPY {table.name} ({', '.join(columns)}) FROM STDIN"
+        # COPY 绕过了 SQLAlchemy 的类型处理，压缩存储的正文在这里手动编码
+        compressed = [column for column in columns if isinstance(table.c[column].type, CompressedText)]
+        with dbapi_connection.cursor() as cursor, cursor.copy(statement) as copy:
+            for row in rows:
+                for column in compressed:
+                    row[column] = table.c[column].type.process_bind_param(row[column], connection.dialect)
+                copy.write_row([row[column] for column in columns])
+                count += 1
+        self.counts[name] = count
+
+    def _import_world(self):
+        source = next(_read_lines(self.bundle, 'world.ndjson'))
+        world_id = db.session.execute(
+            insert(World.__table__).returning(World.id),
+            {
+                'user_id': self.owner_id,
+                'name': source['name'],
+                'tags': source.get('tags') or [],
+                'is_public': source.get('is_public', False),
+                'worldview': source.get('worldview'),
+                'master_setting': source.get('master_setting'),
+                # 源世界在目标库中未必存在，导入的世界不保留来源关系
+                'origin_world_id': None,
+                'create_time': _timestamp(source.get('create_time')),
+                'popularity': source.get('popularity') or 0,
+            }
+        ).scalar_one()
+        self.counts['world.ndjson'] = 1
+        return world_id
+
+    def _import_chapters(self, world_id):
+        table = Chapter.__table__
+        statement = insert(table).returning(table.c.id, sort_by_parameter_order=True)
+        count = 0
+        for batch in _batches(_read_lines(self.bundle, 'chapters.ndjson'), self.batch_size):
+            rows = [{
+                'world_id': world_id,
+                'creator_user_id': self._user(chapter['creator_user_id']),
+                'name': chapter['name'],
+                'opening': chapter.get('opening'),
+                'background': chapter.get('background'),
+                'is_default': chapter.get('is_default', False),
+                'create_time': _timestamp(chapter.get('create_time')),
+            } for chapter in batch]
+            new_ids = db.session.execute(statement, rows).scalars().all()
+            for chapter, new_id in zip(batch, new_ids):
+                self.chapter_map[chapter['id']] = new_id
+                if chapter.get('origin_chapter_id') is not None:
+                    self.origins[chapter['id']] = (chapter['origin_chapter_id'], chapter.get('fork_message_id'))
+            count += len(batch)
+        self.counts['chapters.ndjson'] = count
+
+        # 来源章节不在包内（如跨世界的来源）时不保留来源与分支关系
+        for origin_id, fork_message_id in self.origins.values():
+            if origin_id in self.chapter_map and fork_message_id is not None:
+                self.fork_targets[fork_message_id] = None
+
+    def _user_worlds(self, world_id):
+        # 创建者只保留导入者一人；同一用户只保留第一条成员记录
+        seen = {self.owner_id}
+        yield {'user_id': self.owner_id, 'world_id': world_id, 'role': 'creator', 'create_time': datetime.utcnow()}
+        for member in _read_lines(self.bundle, 'user_worlds.ndjson'):
+            user_id = self.user_map.get(member['user_id'])
+            if member['role'] == 'creator' or user_id is None or user_id in seen:
+                continue
+            seen.add(user_id)
+            yield {'user_id': user_id, 'world_id': world_id, 'role': member['role'],
+                   'create_time': _timestamp(member.get('create_time'))}
+
+    def _messages(self):
+        for message in _read_lines(self.bundle, 'messages.ndjson'):
+            position = self._positions[message['chapter_id']] = self._positions.get(message['chapter_id'], 0) + 1
+            if message['id'] in self.fork_targets:
+                self.fork_targets[message['id']] = (message['chapter_id'], position)
+            content, flags = split_body(message['content'], message['role'])
+            yield {
+                'chapter_id': self._chapter(message['chapter_id']),
+                'user_id': self._user(message['user_id']),
+                'role': message['role'],
+                'content': content,
+                'flags': flags,
+                'create_time': _timestamp(message.get('create_time')),
+            }
+
+    def _new_message_id(self, source_id, cache):
+        """源消息 id 对应的新 id：消息所在章节中同一序号的新消息（章节内按 id 顺序写入，相对顺序不变）"""
+        target = self.fork_targets.get(source_id)
+        if target is None:
+            # 分支点不在包内（数据异常），分支不继承任何消息
+            return 0
+        if source_id not in cache:
+            chapter_id, position = target
+            cache[source_id] = db.session.execute(
+                select(ConversationMessage.id).where(ConversationMessage.chapter_id == self._chapter(chapter_id))
+                .order_by(ConversationMessage.id).offset(position - 1).limit(1)
+            ).scalar_one()
+        return cache[source_id]
+
+    def _link_chapters(self):
+        """写入来源章节与分支点（分支点按源消息 id 换算为新 id）"""
+        cache = {}
+        for chapter_id, (origin_id, fork_message_id) in self.origins.items():
+            parent = self.chapter_map.get(origin_id)
+            if parent is None:
+                continue
+            values = {'origin_chapter_id': parent}
+            if fork_message_id is not None:
+                values['fork_message_id'] = self._new_message_id(fork_message_id, cache)
+            db.session.execute(update(Chapter).where(Chapter.id == self.chapter_map[chapter_id]).values(**values))
+
+    def _novels(self):
+        for novel in _read_lines(self.bundle, 'novels.ndjson'):
+            yield {
+                'chapter_id': self._chapter(novel['chapter_id']),
+                'user_id': self._user(novel['user_id']),
+                'title': novel.get('title'),
+                'content': novel['content'],
+                'create_time': _timestamp(novel.get('create_time')),
+                'popularity': novel.get('popularity') or 0,
+            }
+
+    def run(self):
+        """执行导入，返回新世界 id"""
+        manifest = self._check_manifest()
+        self._map_users()
+        world_id = self._import_world()
+        self._insert('characters.ndjson', WorldCharacter.__table__, (
+            {'world_id': world_id, 'name': character['name'], 'background': character.get('background')}
+            for character in _read_lines(self.bundle, 'characters.ndjson')
+        ))
+        self._import_chapters(world_id)
+        self._insert('user_worlds.ndjson', UserWorld.__table__, self._user_worlds(world_id))
+        self._copy('messages.ndjson', ConversationMessage.__table__,
+                   ('chapter_id', 'user_id', 'role', 'content', 'flags', 'create_time'), self._messages())
+        self._link_chapters()
+        self._copy('novels.ndjson', NovelRecord.__table__,
+                   ('chapter_id', 'user_id', 'title', 'content', 'create_time', 'popularity'), self._novels())
+        refresh_chapters(self.chapter_map.values())
+        refresh_worlds([world_id])
+
+        # 成员记录会补上导入者并去重，不参与校验
+        for name, expected in manifest.get('counts', {}).items():
+            if name in ('users.ndjson', 'user_worlds.ndjson'):
+                continue
+            if self.counts.get(name) != expected:
+                raise BundleError(f"世界包内容不完整: {name} 应有 {expected} 行，实际 {self.counts.get(name)} 行")
+        logger.info(f"世界包导入完成: 源世界 {manifest.get('source_world_id')} -> {world_id}, {self.counts}")
+        return world_id
+
+
+def import_bundle(fileobj, owner_id, batch_size=1000, use_copy=True):
+    """从可 seek 的文件对象导入世界包，返回 (新世界 id, 各文件导入行数)；调用方负责提交事务"""
+    try:
+        bundle = zipfile.ZipFile(fileobj)
+    except zipfile.BadZipFile:
+        raise BundleError('不是有效的 zip 文件')
+    with bundle:
+        importer = BundleImporter(bundle, owner_id, batch_size, use_copy)
+        return importer.run(), importer.counts
@@ -0,0 +1,249 @@
+from types import SimpleNamespace
+import hashlib
+import json
+import os
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 大模型调用的录制与回放：把 chat.completions.create 的请求与响应（含流式分片的时间间隔）
+# 记录为 JSON Lines 格式的 cassette 文件，回放时按请求内容匹配，用于无网络的端到端回归测试
+#
+# 每行一次调用：
+#   {"key": 请求摘要, "model": 模型, "stream": 是否流式, "tool": 工具名,
+#    "response": 非流式响应 | "chunks": [[距上一分片的毫秒数, 分片], ...], "ttft_ms": 首分片耗时, "error": 错误信息}
+
+# 参与匹配的请求字段；temperature 等采样参数不影响回放结果
+_KEY_FIELDS = ("model", "messages", "tools", "tool_choice", "stream")
+
+
+class CassetteMiss(Exception):
+    """回放时找不到与请求匹配的录制记录"""
+
+
+class ReplayedError(Exception):
+    """回放录制时发生的调用错误"""
+
+
+def request_key(kwargs):
+    payload = {name: kwargs.get(name) for name in _KEY_FIELDS}
+    payload["stream"] = bool(payload["stream"])
+    encoded = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(encoded.encode("utf-8")).hexdigest()
+
+
+def _tool_name(kwargs):
+    tools = kwargs.get("tools") or []
+    return tools[0].get("function", {}).get("name") if tools else None
+
+
+def _compact(value):
+    """SDK 对象转为去掉空值的普通结构，缩小 cassette 体积"""
+    if hasattr(value, "model_dump"):
+        value = value.model_dump()
+    elif hasattr(value, "__dict__") and not isinstance(value, type):
+        value = vars(value)
+    if isinstance(value, dict):
+        return {k: _compact(v) for k, v in value.items() if v is not None and v != [] and v != {}}
+    if isinstance(value, (list, tuple)):
+        return [_compact(v) for v in value]
+    return value
+
+
+def _to_object(value):
+    if isinstance(value, dict):
+        return _Record(**{k: _to_object(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return [_to_object(v) for v in value]
+    return value
+
+
+class _Record(SimpleNamespace):
+    """回放出的响应对象，未录制的字段返回 None（与 SDK 对象的可选字段一致）"""
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return None
+
+
+class _CassetteWriter:
+    """同一文件的多个录制客户端共用一个写入器，按行追加"""
+
+    _writers = {}
+    _writers_lock = threading.Lock()
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def for_path(cls, path):
+        with cls._writers_lock:
+            writer = cls._writers.get(path)
+            if writer is None:
+                writer = cls._writers[path] = cls(path)
+            return writer
+
+    def write(self, interaction):
+        line = json.dumps(interaction, ensure_ascii=False, separators=(",", ":"), default=str)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+class _RecordingStream:
+    def __init__(self, stream, interaction, writer, started):
+        self._stream = stream
+        self._interaction = interaction
+        self._writer = writer
+        self._last = started
+        self._started = started
+        self._written = False
+
+    def __iter__(self):
+        chunks = self._interaction.setdefault("chunks", [])
+        try:
+            for chunk in self._stream:
+                now = time.perf_counter()
+                if not chunks:
+                    self._interaction["ttft_ms"] = round((now - self._started) * 1000, 1)
+                chunks.append([round((now - self._last) * 1000, 1), _compact(chunk)])
+                self._last = now
+                yield chunk
+        except Exception as e:
+            self._interaction["error"] = str(e)
+            raise
+        finally:
+            self._flush()
+
+    def close(self):
+        self._interaction["closed"] = True
+        self._flush()
+        close = getattr(self._stream, "close", None)
+        if close:
+            close()
+
+    def _flush(self):
+        if not self._written:
+            self._written = True
+            self._writer.write(self._interaction)
+
+
+class _RecordingCompletions:
+    def __init__(self, inner, writer):
+        self._inner = inner
+        self._writer = writer
+
+    def create(self, **kwargs):
+        interaction = {
+            "key": request_key(kwargs),
+            "model": kwargs.get("model"),
+            "stream": bool(kwargs.get("stream")),
+            "tool": _tool_name(kwargs),
+        }
+        started = time.perf_counter()
+        try:
+            response = self._inner.create(**kwargs)
+        except Exception as e:
+            interaction["error"] = str(e)
+            interaction["ttft_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            self._writer.write(interaction)
+            raise
+        if kwargs.get("stream"):
+            return _RecordingStream(response, interaction, self._writer, started)
+        interaction["ttft_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        interaction["response"] = _compact(response)
+        self._writer.write(interaction)
+        return response
+
+
+class RecordingClient:
+    """包装真实客户端，把每次调用追加写入 cassette 文件"""
+
+    def __init__(self, inner, path):
+        self._inner = inner
+        self.chat = SimpleNamespace(completions=_RecordingCompletions(inner.chat.completions, _CassetteWriter.for_path(path)))
+
+
+def load_cassette(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class _ReplayStream:
+    def __init__(self, interaction, speed):
+        self._interaction = interaction
+        self._speed = speed
+        self._closed = False
+
+    def __iter__(self):
+        for delay_ms, chunk in self._interaction.get("chunks") or []:
+            if self._closed:
+                return
+            if self._speed:
+                time.sleep(delay_ms / 1000.0 / self._speed)
+            yield _to_object(chunk)
+        if self._interaction.get("error") and not self._interaction.get("closed"):
+            raise ReplayedError(self._interaction["error"])
+
+    def close(self):
+        self._closed = True
+
+
+class _ReplayCompletions:
+    def __init__(self, client):
+        self._client = client
+
+    def create(self, **kwargs):
+        interaction = self._client.match(kwargs)
+        speed = self._client.speed
+        if interaction.get("stream"):
+            return _ReplayStream(interaction, speed)
+        if speed:
+            time.sleep(interaction.get("ttft_ms", 0) / 1000.0 / speed)
+        if interaction.get("error") or "response" not in interaction:
+            raise ReplayedError(interaction.get("error") or "录制记录缺少响应")
+        return _to_object(interaction["response"])
+
+
+class ReplayClient:
+    """按 cassette 回放大模型调用
+
+    - 先按请求摘要精确匹配；strict=False 时退化为按（模型、是否流式、工具名）顺序匹配，
+      适用于提示词有改动但仍想对比性能的场景
+    - speed 为回放速度倍数，0 表示不等待（只比较内容与体积）
+    - 同一请求录制多次时按录制顺序依次回放，用完后循环使用
+    """
+
+    def __init__(self, path, speed=1.0, strict=True):
+        self.interactions = load_cassette(path)
+        self.speed = speed
+        self.strict = strict
+        self._lock = threading.Lock()
+        self._cursors = {}
+        self.chat = SimpleNamespace(completions=_ReplayCompletions(self))
+
+    def _next(self, group, candidates):
+        with self._lock:
+            cursor = self._cursors.get(group, 0)
+            self._cursors[group] = cursor + 1
+        return candidates[cursor % len(candidates)]
+
+    def match(self, kwargs):
+        key = request_key(kwargs)
+        exact = [i for i in self.interactions if i.get("key") == key]
+        if exact:
+            return self._next(("key", key), exact)
+        if self.strict:
+            raise CassetteMiss(f"cassette 中没有匹配的请求（model={kwargs.get('model')}, key={key}），请重新录制")
+        shape = (kwargs.get("model"), bool(kwargs.get("stream")), _tool_name(kwargs))
+        similar = [i for i in self.interactions if (i.get("model"), i.get("stream"), i.get("tool")) == shape]
+        if not similar:
+            raise CassetteMiss(f"cassette 中没有同类请求（model={shape[0]}, stream={shape[1]}, tool={shape[2]}）")
+        logger.warning(f"cassette 未精确命中，按同类请求回放: model={shape[0]}, stream={shape[1]}, tool={shape[2]}")
+        return self._next(("shape",) + shape, similar)
@@ -1,4 +1,5 @@
 import os
+import json
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -6,4 +7,107 @@ load_dotenv()
 class Config:
     ZHIPU_API_KEY = os.getenv("ZHIPU_API_KEY")
     SQLALCHEMY_DATABASE_URI = os.getenv("DATABASE_URL" )
-    SQLALCHEMY_TRACK_MODIFICATIONS = False
\ No newline at end of file
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # 连接池与语句超时（PostgreSQL）
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+    DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+    DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))  # 等待空闲连接的秒数
+    DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # 连接最长存活秒数
+    DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+    DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))  # 0 表示不限制
+    # 经 pgbouncer（事务池模式）连接时开启：应用侧不保持连接池
+    DB_PGBOUNCER = os.getenv("DB_PGBOUNCER", "false").lower() == "true"
+
+    # 只读副本（逗号分隔），/api/db 的 GET 请求读副本；客户端提交写操作后的若干秒内仍读主库
+    DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+    DB_READ_YOUR_WRITES_SECONDS = float(os.getenv("DB_READ_YOUR_WRITES_SECONDS", "5"))
+
+    # SQLite 单机模式（DATABASE_URL=sqlite:///...）：启用 WAL，读写互不阻塞
+    SQLITE_WAL = os.getenv("SQLITE_WAL", "true").lower() == "true"
+    SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+    # 流式导出（NDJSON）：服务端游标每批读取的行数与 gzip 压缩级别
+    EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+    EXPORT_GZIP_LEVEL = int(os.getenv("EXPORT_GZIP_LEVEL", "6"))
+    # 世界包导入：PostgreSQL（psycopg 3）下消息与小说使用 COPY 写入
+    BUNDLE_USE_COPY = os.getenv("BUNDLE_USE_COPY", "true").lower() == "true"
+
+    # 用户首页聚合接口的按用户缓存（秒，0 表示不缓存）；用户自己的写请求会使其立即失效
+    DASHBOARD_CACHE_TTL = float(os.getenv("DASHBOARD_CACHE_TTL", "30"))
+    DASHBOARD_CACHE_MAX_USERS = int(os.getenv("DASHBOARD_CACHE_MAX_USERS", "1024"))
+
+    # 消息与小说正文压缩存储（zstd，需安装 zstandard；PostgreSQL 需先把 content 列改为 bytea，见 README）
+    CONTENT_COMPRESSION = os.getenv("CONTENT_COMPRESSION", "false").lower() == "true"
+    CONTENT_ZSTD_LEVEL = int(os.getenv("CONTENT_ZSTD_LEVEL", "3"))
+    CONTENT_COMPRESS_MIN_BYTES = int(os.getenv("CONTENT_COMPRESS_MIN_BYTES", "64"))  # 更短的正文不压缩
+    # 训练好的字典文件（逗号分隔），第一个用于压缩，其余仅用于解压旧数据
+    CONTENT_ZSTD_DICTS = [path.strip() for path in os.getenv("CONTENT_ZSTD_DICTS", "").split(",") if path.strip()]
+
+    # /api/db/batch 单次最多的子请求数
+    BATCH_MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS", "20"))
+
+    # 回复建议预取：AI回复落库后后台生成建议并缓存；每轮对话额外调用一次大模型，默认关闭
+    SUGGESTION_PREFETCH_ENABLED = os.getenv("SUGGESTION_PREFETCH_ENABLED", "false").lower() == "true"
+    SUGGESTION_PREFETCH_WORKERS = int(os.getenv("SUGGESTION_PREFETCH_WORKERS", "2"))
+    SUGGESTION_PREFETCH_TTL = int(os.getenv("SUGGESTION_PREFETCH_TTL", "600"))  # 秒
+    # 建议接口在预取进行中时最多等待的秒数
+    SUGGESTION_PREFETCH_WAIT = float(os.getenv("SUGGESTION_PREFETCH_WAIT", "8"))
+
+    # 长期记忆：聊天时按章节 BM25 检索最近窗口之外的相关早期对话，加入提示词
+    MEMORY_ENABLED = os.getenv("MEMORY_ENABLED", "true").lower() == "true"
+    MEMORY_TOP_K = int(os.getenv("MEMORY_TOP_K", "4"))
+    MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "600"))  # 召回内容的估算 token 上限
+    MEMORY_MAX_CHAPTERS = int(os.getenv("MEMORY_MAX_CHAPTERS", "256"))  # 进程内保留索引的章节数
+
+    # 自动剧情分析：章节每新增若干条消息或约若干 token 的正文后，后台生成分析供聊天使用；会额外调用大模型，默认关闭
+    ANALYSIS_AUTO_ENABLED = os.getenv("ANALYSIS_AUTO_ENABLED", "false").lower() == "true"
+    ANALYSIS_EVERY_MESSAGES = int(os.getenv("ANALYSIS_EVERY_MESSAGES", "10"))
+    ANALYSIS_EVERY_TOKENS = int(os.getenv("ANALYSIS_EVERY_TOKENS", "3000"))  # 0 表示只按消息数触发
+    ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "1"))
+    ANALYSIS_HISTORY_WINDOW = int(os.getenv("ANALYSIS_HISTORY_WINDOW", "20"))  # 分析读取的最近消息数
+
+    # 各接口的模型路由与对冲策略（JSON），覆盖 app/routing.py 中的默认值，例如：
+    # {"chat_stream": {"primary": {"model": "glm-4-plus"}, "fallback": {"model": "glm-4-air"}, "hedge_after": 2.5}}
+    LLM_ROUTING = json.loads(os.getenv("LLM_ROUTING", "{}"))
+
+    # 大模型接口限流：按客户端 IP、用户与世界三个维度的令牌桶；开启后超出阈值的请求会被拒绝，默认关闭
+    RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "false").lower() == "true"
+    RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")  # memory / redis
+    RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0")
+    RATE_LIMIT_USER_RPS = float(os.getenv("RATE_LIMIT_USER_RPS", "1"))
+    RATE_LIMIT_USER_BURST = float(os.getenv("RATE_LIMIT_USER_BURST", "5"))
+    # 按客户端 IP 的桶始终生效（userId 由客户端提供，不能单独作为限流依据）
+    RATE_LIMIT_IP_RPS = float(os.getenv("RATE_LIMIT_IP_RPS", "2"))
+    RATE_LIMIT_IP_BURST = float(os.getenv("RATE_LIMIT_IP_BURST", "10"))
+    RATE_LIMIT_WORLD_RPS = float(os.getenv("RATE_LIMIT_WORLD_RPS", "5"))
+    RATE_LIMIT_WORLD_BURST = float(os.getenv("RATE_LIMIT_WORLD_BURST", "20"))
+    RATE_LIMIT_USER_TOKENS_PER_MIN = float(os.getenv("RATE_LIMIT_USER_TOKENS_PER_MIN", "20000"))
+    RATE_LIMIT_WORLD_TOKENS_PER_MIN = float(os.getenv("RATE_LIMIT_WORLD_TOKENS_PER_MIN", "60000"))
+    RATE_LIMIT_IP_TOKENS_PER_MIN = float(os.getenv("RATE_LIMIT_IP_TOKENS_PER_MIN", "40000"))
+
+    # 热路径结构化日志的采样率（0~1），WARNING 及以上级别不采样
+    LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.1"))
+
+    # 按请求的 SQL 统计与 N+1 检测（默认关闭）
+    DB_QUERY_PROFILING = os.getenv("DB_QUERY_PROFILING", "false").lower() == "true"
+    DB_QUERY_HEADERS = os.getenv("DB_QUERY_HEADERS", "false").lower() == "true"  # 非调试模式下也返回 X-DB-* 头
+    DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "200"))
+    DB_N_PLUS_ONE_THRESHOLD = int(os.getenv("DB_N_PLUS_ONE_THRESHOLD", "5"))
+
+    # 大模型提供方：zhipu / fake（离线假实现，用于压测与本地开发）
+    # record（调用真实模型并录制到 LLM_CASSETTE）/ replay（从 LLM_CASSETTE 回放）
+    LLM_PROVIDER = os.getenv("LLM_PROVIDER", "zhipu")
+    FAKE_LLM_TTFT = float(os.getenv("FAKE_LLM_TTFT", "0.3"))  # 首 token 延迟（秒）
+    FAKE_LLM_TOKENS_PER_SEC = float(os.getenv("FAKE_LLM_TOKENS_PER_SEC", "40"))
+    FAKE_LLM_ERROR_RATE = float(os.getenv("FAKE_LLM_ERROR_RATE", "0"))
+    FAKE_LLM_COMPLETION_TOKENS = int(os.getenv("FAKE_LLM_COMPLETION_TOKENS", "120"))
+    FAKE_LLM_TOOL_PAYLOADS = os.getenv("FAKE_LLM_TOOL_PAYLOADS")  # JSON 文件：{函数名: 参数对象}
+    FAKE_LLM_SEED = int(os.getenv("FAKE_LLM_SEED")) if os.getenv("FAKE_LLM_SEED") else None
+
+    # 大模型调用录制/回放
+    LLM_CASSETTE = os.getenv("LLM_CASSETTE", "bench/cassettes/default.jsonl")
+    # record 模式下被录制的客户端：zhipu（真实模型）/ fake（离线假实现，用于在无网络环境生成示例 cassette）
+    LLM_RECORD_UPSTREAM = os.getenv("LLM_RECORD_UPSTREAM", "zhipu")
+    LLM_REPLAY_SPEED = float(os.getenv("LLM_REPLAY_SPEED", "1"))  # 回放速度倍数，0 表示不等待
+    LLM_REPLAY_STRICT = os.getenv("LLM_REPLAY_STRICT", "true").lower() == "true"
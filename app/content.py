@@ -0,0 +1,117 @@
+from app.config import Config
+import threading
+import logging
+
+try:
+    import zstandard
+except ImportError:  # 压缩存储为可选功能
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# 消息与小说正文的存储格式
+#
+# 1. AI 正文标记：handle_chat_stream 保存的 AI 回复以“正文：”开头，改为在 flags 中记一位，
+#    正文只存去掉前缀后的内容，输出时再拼回，接口返回的 content 不变。
+# 2. 压缩存储（CONTENT_COMPRESSION=true）：正文以 zstd 压缩后存为 bytea（SQLite 为 BLOB），
+#    可选用针对中文语料训练的字典（CONTENT_ZSTD_DICTS）；字典 id 写在 zstd 帧头中，更换字典后旧数据仍可解压。
+#    读取时按帧头魔数判断：zstd 帧解压，其余按 UTF-8 原文处理（过短的正文、迁移前的旧数据），
+#    因此新旧格式可以共存，由 flask migrate-content 在后台分批转换。
+
+BODY_PREFIX = '正文：'
+FLAG_BODY = 1
+
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+def split_body(content, role='ai'):
+    """拆出 AI 正文前缀，返回 (存储的正文, flags)"""
+    if role == 'ai' and isinstance(content, str) and content.startswith(BODY_PREFIX):
+        return content[len(BODY_PREFIX):], FLAG_BODY
+    return content, 0
+
+
+def message_text(content, flags):
+    """存储的正文 + flags 还原为完整的消息内容"""
+    if flags and flags & FLAG_BODY and content is not None:
+        return BODY_PREFIX + content
+    return content
+
+
+class ContentCodec:
+    """正文压缩编解码：压缩器与解压器不是线程安全的，按线程各建一份"""
+
+    def __init__(self, enabled=False, level=3, min_bytes=64, dict_paths=()):
+        self.enabled = enabled
+        self.level = level
+        self.min_bytes = min_bytes
+        self.dicts = []
+        self._local = threading.local()
+        if enabled and zstandard is None:
+            logger.warning("已开启 CONTENT_COMPRESSION 但未安装 zstandard，正文将不压缩存储")
+        if zstandard is not None:
+            for path in dict_paths:
+                with open(path, 'rb') as f:
+                    self.dicts.append(zstandard.ZstdCompressionDict(f.read()))
+
+    @property
+    def compressing(self):
+        return self.enabled and zstandard is not None
+
+    def _compressor(self):
+        compressor = getattr(self._local, 'compressor', None)
+        if compressor is None:
+            dict_data = self.dicts[0] if self.dicts else None
+            compressor = zstandard.ZstdCompressor(level=self.level, dict_data=dict_data)
+            self._local.compressor = compressor
+        return compressor
+
+    def _decompressor(self, dict_id):
+        decompressors = getattr(self._local, 'decompressors', None)
+        if decompressors is None:
+            decompressors = self._local.decompressors = {}
+        decompressor = decompressors.get(dict_id)
+        if decompressor is None:
+            dict_data = next((d for d in self.dicts if d.dict_id() == dict_id), None)
+            if dict_id and dict_data is None:
+                raise ValueError(f"缺少解压所需的 zstd 字典: {dict_id}")
+            decompressor = decompressors[dict_id] = zstandard.ZstdDecompressor(dict_data=dict_data)
+        return decompressor
+
+    def compress(self, text):
+        """正文 -> 存储字节：过短或压缩无收益时保留 UTF-8 原文"""
+        data = text.encode('utf-8')
+        if not self.compressing or len(data) < self.min_bytes:
+            return data
+        compressed = self._compressor().compress(data)
+        return compressed if len(compressed) < len(data) else data
+
+    def decompress(self, data):
+        """存储字节 -> 正文"""
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        if data[:4] != ZSTD_MAGIC:
+            return data.decode('utf-8')
+        if zstandard is None:
+            raise RuntimeError("读取压缩正文需要安装 zstandard")
+        dict_id = zstandard.get_frame_parameters(data).dict_id
+        return self._decompressor(dict_id).decompress(data).decode('utf-8')
+
+    def is_compressed(self, data):
+        return isinstance(data, (bytes, memoryview)) and bytes(data[:4]) == ZSTD_MAGIC
+
+
+def train_dictionary(samples, dict_size=112640):
+    """用正文样本训练 zstd 字典，返回字典字节串"""
+    if zstandard is None:
+        raise RuntimeError("训练字典需要安装 zstandard")
+    samples = [sample.encode('utf-8') if isinstance(sample, str) else sample for sample in samples]
+    return zstandard.train_dictionary(dict_size, samples).as_bytes()
+
+
+codec = ContentCodec(
+    enabled=Config.CONTENT_COMPRESSION,
+    level=Config.CONTENT_ZSTD_LEVEL,
+    min_bytes=Config.CONTENT_COMPRESS_MIN_BYTES,
+    dict_paths=Config.CONTENT_ZSTD_DICTS,
+)
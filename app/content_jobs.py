@@ -0,0 +1,99 @@
+from flask.cli import with_appcontext
+from sqlalchemy import select, update, func, type_coerce
+from app.models import db, ConversationMessage, NovelRecord
+from app.content import codec, split_body, train_dictionary, BODY_PREFIX, FLAG_BODY
+import click
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# 正文存储的维护任务：训练 zstd 字典、把已有数据迁移到当前存储格式
+# 迁移按 id 区间分批读取、只改写需要变化的行，每批单独提交，可在服务运行时执行，中断后用 --start-id 继续
+
+MODELS = {'messages': ConversationMessage, 'novels': NovelRecord}
+
+
+def _needs_rewrite(raw):
+    """存储值是否需要按当前设置重新编码：旧的 TEXT 值，或开启压缩后仍未压缩的长正文"""
+    if not codec.enabled:
+        return False
+    if isinstance(raw, str):
+        return True
+    return codec.compressing and not codec.is_compressed(raw) and len(raw) >= codec.min_bytes
+
+
+def migrate_content(model, batch_size=1000, start_id=1, pause=0.0):
+    """迁移一张表的正文：AI 消息去掉“正文：”前缀改为标记位，按当前设置压缩；返回 (扫描行数, 改写行数)"""
+    is_message = model is ConversationMessage
+    # 绕过 CompressedText 的解码，直接取存储值判断格式
+    raw_content = type_coerce(model.content, db.LargeBinary) if codec.enabled else model.content
+    columns = [model.id, raw_content] + ([model.role, model.flags] if is_message else [])
+
+    last_id = db.session.execute(select(func.max(model.id))).scalar() or 0
+    scanned = rewritten = 0
+    for start in range(start_id, last_id + 1, batch_size):
+        rows = db.session.execute(
+            select(*columns).where(model.id.between(start, start + batch_size - 1))
+        ).all()
+        changes = []
+        for row in rows:
+            raw = row[1]
+            text = raw if isinstance(raw, str) else codec.decompress(raw)
+            change = {}
+            if is_message and not row[3] & FLAG_BODY and text.startswith(BODY_PREFIX):
+                change['content'], change['flags'] = split_body(text, row[2])
+            elif _needs_rewrite(raw):
+                change['content'] = text
+            if change:
+                changes.append({'id': row[0], **change})
+        if changes:
+            db.session.execute(update(model), changes)
+        db.session.commit()
+        scanned += len(rows)
+        rewritten += len(changes)
+        logger.info(f"{model.__tablename__}: 已处理到 id {start + batch_size - 1}，改写 {rewritten} 行")
+        if pause:
+            time.sleep(pause)
+    return scanned, rewritten
+
+
+def _samples(limit, chunk_chars):
+    """随机抽取消息与小说正文作为训练样本，长文按 chunk_chars 切段"""
+    for model in (ConversationMessage, NovelRecord):
+        rows = db.session.scalars(select(model.content).order_by(func.random()).limit(limit))
+        for text in rows:
+            for offset in range(0, len(text), chunk_chars):
+                yield text[offset:offset + chunk_chars]
+
+
+@click.command('train-content-dict')
+@click.argument('output', type=click.Path(dir_okay=False))
+@click.option('--samples', default=20000, show_default=True, help='每张表抽取的正文条数')
+@click.option('--dict-size', default=112640, show_default=True, help='字典大小（字节）')
+@click.option('--chunk-chars', default=2000, show_default=True, help='长正文切段的字符数')
+@with_appcontext
+def train_content_dict_command(output, samples, dict_size, chunk_chars):
+    """用库中的消息与小说训练 zstd 字典，写入 OUTPUT（配置到 CONTENT_ZSTD_DICTS 后生效）"""
+    texts = list(_samples(samples, chunk_chars))
+    if not texts:
+        raise click.ClickException('没有可用的训练样本')
+    data = train_dictionary(texts, dict_size)
+    with open(output, 'wb') as f:
+        f.write(data)
+    click.echo(f"字典已写入 {output}（{len(data)} 字节，样本 {len(texts)} 段）")
+
+
+@click.command('migrate-content')
+@click.option('--table', type=click.Choice(['messages', 'novels', 'all']), default='all', show_default=True)
+@click.option('--batch-size', default=1000, show_default=True)
+@click.option('--start-id', default=1, show_default=True, help='从该 id 开始（中断后继续）')
+@click.option('--pause', default=0.0, show_default=True, help='每批之间暂停的秒数，降低对线上的影响')
+@with_appcontext
+def migrate_content_command(table, batch_size, start_id, pause):
+    """把已有正文迁移到当前存储格式（去掉“正文：”前缀、按 CONTENT_COMPRESSION 压缩）"""
+    for name, model in MODELS.items():
+        if table not in (name, 'all'):
+            continue
+        scanned, rewritten = migrate_content(model, batch_size, start_id, pause)
+        click.echo(f"{model.__tablename__}: 扫描 {scanned} 行，改写 {rewritten} 行")
@@ -0,0 +1,190 @@
+from collections import OrderedDict
+from flask import request
+from sqlalchemy import select, union
+from app.config import Config
+from app.models import db, World, Chapter, NovelRecord, UserWorld
+from app.serializers import dumps, serialize_worlds, allowed_fields, WORLD, WORLD_CHARACTER, CHAPTER, NOVEL
+import threading
+import time
+
+# 用户首页聚合：一次返回用户按角色分组的世界（含角色与章节摘要）与最近的小说，
+# 替代前端逐个调用 user-worlds / worlds/<id> / worlds/<id>/chapters / novels 的串行请求
+
+ROLES = ('creator', 'participant', 'viewer')
+
+# 章节与小说只返回摘要字段，不含开场白、背景与正文
+CHAPTER_SUMMARY_FIELDS = tuple(
+    name for name in CHAPTER.field_names if name not in ('opening', 'background')
+)
+NOVEL_SUMMARY_FIELDS = tuple(name for name in NOVEL.field_names if name != 'content')
+
+# 世界部分支持 ?fields= / ?exclude= 投影（与 /api/db/worlds 相同）
+DASHBOARD_WORLD_FIELDS = allowed_fields(
+    WORLD, extra=('chapters',), nested={'main_characters': WORLD_CHARACTER}
+)
+
+
+def build_dashboard(user_id, projection=None, novel_limit=20):
+    """按固定的几次批量查询组装首页数据：成员关系+世界、角色、章节摘要、最近小说"""
+    only = WORLD.project(projection)
+    rows = db.session.execute(
+        select(UserWorld.role, *WORLD.columns(only))
+        .join(World, World.id == UserWorld.world_id)
+        .where(UserWorld.user_id == user_id)
+        .order_by(UserWorld.create_time.desc(), World.id)
+    ).all()
+    worlds = serialize_worlds([row[1:] for row in rows], projection)
+
+    if projection is None or projection.includes('chapters'):
+        chapters = {world['id']: [] for world in worlds}
+        if chapters:
+            chapter_rows = db.session.execute(
+                CHAPTER.select(CHAPTER_SUMMARY_FIELDS)
+                .where(Chapter.world_id.in_(list(chapters)))
+                .order_by(Chapter.world_id, Chapter.is_default.desc(), Chapter.id)
+            )
+            for chapter in CHAPTER.from_rows(chapter_rows, CHAPTER_SUMMARY_FIELDS):
+                chapters[chapter['world_id']].append(chapter)
+        for world in worlds:
+            world['chapters'] = chapters[world['id']]
+
+    by_role = {role: [] for role in ROLES}
+    for row, world in zip(rows, worlds):
+        by_role[row[0]].append(world)
+
+    novel_rows = db.session.execute(
+        NOVEL.select(NOVEL_SUMMARY_FIELDS).add_columns(Chapter.name, World.id, World.name)
+        .outerjoin(Chapter, Chapter.id == NovelRecord.chapter_id)
+        .outerjoin(World, World.id == Chapter.world_id)
+        .where(NovelRecord.user_id == user_id)
+        .order_by(NovelRecord.create_time.desc(), NovelRecord.id.desc())
+        .limit(novel_limit)
+    ).all()
+    novels = NOVEL.from_rows(novel_rows, NOVEL_SUMMARY_FIELDS)
+    for novel, row in zip(novels, novel_rows):
+        novel['chapter_name'], novel['world_id'], novel['world_name'] = row[-3:]
+
+    return {'user_id': user_id, 'worlds': by_role, 'recent_novels': novels}
+
+
+class DashboardCache:
+    """按用户缓存序列化后的首页数据（进程内 LRU + TTL）
+
+    同一用户的不同查询参数分别缓存；涉及该用户（本人发起，或其所在世界被修改）的写请求成功后整体失效。
+    """
+
+    def __init__(self, ttl=30, max_users=1024):
+        self.ttl = ttl
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()  # user_id -> {variant: (expires_at, body)}
+
+    def get(self, user_id, variant):
+        if self.ttl <= 0:
+            return None
+        with self._lock:
+            entries = self._cache.get(user_id)
+            entry = entries.get(variant) if entries else None
+            if entry is None:
+                return None
+            expires_at, body = entry
+            if expires_at < time.monotonic():
+                del entries[variant]
+                return None
+            self._cache.move_to_end(user_id)
+            return body
+
+    def put(self, user_id, variant, body):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._cache.setdefault(user_id, {})[variant] = (time.monotonic() + self.ttl, body)
+            self._cache.move_to_end(user_id)
+            while len(self._cache) > self.max_users:
+                self._cache.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._cache.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+def cached_dashboard(cache, user_id, projection, novel_limit):
+    """返回 (JSON 字节串, 是否命中缓存)"""
+    variant = (request.args.get('fields'), request.args.get('exclude'), novel_limit)
+    body = cache.get(user_id, variant)
+    if body is not None:
+        return body, True
+    body = dumps(build_dashboard(user_id, projection, novel_limit))
+    cache.put(user_id, variant, body)
+    return body, False
+
+
+def request_user_id():
+    """写请求涉及的用户：查询参数或请求体中的 user_id / creator_user_id"""
+    user_id = request.args.get('user_id') or request.args.get('creator_user_id')
+    if user_id is None and request.is_json:
+        data = request.get_json(silent=True)
+        if isinstance(data, dict):
+            user_id = data.get('user_id') or data.get('creator_user_id') or data.get('userId')
+    if user_id is None and request.form:
+        user_id = request.form.get('user_id') or request.form.get('creator_user_id')
+    try:
+        return int(user_id) if user_id is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+# 不改变任何首页内容的写接口（消息不出现在首页中），不查询受影响的用户
+_NO_DASHBOARD_CHANGE = {'db.create_message', 'db.delete_messages', 'db.batch'}
+
+
+def world_members(world_ids):
+    """世界的创建者与全部成员（user_worlds）的用户 id"""
+    world_ids = [world_id for world_id in world_ids if world_id is not None]
+    if not world_ids:
+        return set()
+    return set(db.session.scalars(union(
+        select(World.user_id).where(World.id.in_(world_ids)),
+        select(UserWorld.user_id).where(UserWorld.world_id.in_(world_ids)),
+    )))
+
+
+def request_dashboard_users():
+    """写请求会改变其首页的用户：发起者、涉及的世界（章节所在世界）的创建者与成员、涉及的小说作者
+
+    须在执行写操作之前调用（删除世界会一并删除成员记录）。
+    """
+    users = set()
+    user_id = request_user_id()
+    if user_id is not None:
+        users.add(user_id)
+    if request.endpoint in _NO_DASHBOARD_CHANGE:
+        return users
+
+    view_args = request.view_args or {}
+    world_ids = {view_args.get('world_id')}
+    data = request.get_json(silent=True) if request.is_json else request.form
+    if isinstance(data, dict) and data.get('world_id') is not None:
+        try:
+            world_ids.add(int(data.get('world_id')))
+        except (TypeError, ValueError):
+            pass
+    if view_args.get('chapter_id') is not None:
+        world_ids.add(db.session.scalar(select(Chapter.world_id).where(Chapter.id == view_args['chapter_id'])))
+    if view_args.get('novel_id') is not None:
+        users.add(db.session.scalar(select(NovelRecord.user_id).where(NovelRecord.id == view_args['novel_id'])))
+    users |= world_members(world_ids)
+    users.discard(None)
+    return users
+
+
+dashboard_cache = DashboardCache(Config.DASHBOARD_CACHE_TTL, Config.DASHBOARD_CACHE_MAX_USERS)
+
+
+def invalidate_dashboards(user_ids):
+    for user_id in user_ids:
+        dashboard_cache.invalidate(user_id)
@@ -0,0 +1,183 @@
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import NullPool
+from sqlalchemy.sql import Select
+import random
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+REPLICA_BIND_PREFIX = 'replica_'
+
+
+def engine_options(url, config):
+    """按数据库类型生成引擎参数：连接池大小、回收、pre-ping 与语句超时
+
+    DB_PGBOUNCER=true 时连接池交给 pgbouncer（事务池模式），应用侧不再保持连接，
+    语句超时改为在每个事务开始时 SET LOCAL（pgbouncer 不支持启动参数 options）。
+    """
+    backend = make_url(url).get_backend_name()
+    if backend == 'sqlite':
+        return {}
+
+    if config.get('DB_PGBOUNCER'):
+        return {'poolclass': NullPool}
+
+    options = {
+        'pool_size': config.get('DB_POOL_SIZE', 10),
+        'max_overflow': config.get('DB_MAX_OVERFLOW', 20),
+        'pool_timeout': config.get('DB_POOL_TIMEOUT', 30),
+        'pool_recycle': config.get('DB_POOL_RECYCLE', 1800),
+        'pool_pre_ping': config.get('DB_POOL_PRE_PING', True),
+    }
+    statement_timeout = config.get('DB_STATEMENT_TIMEOUT_MS', 0)
+    if backend == 'postgresql' and statement_timeout:
+        options['connect_args'] = {'options': f"-c statement_timeout={int(statement_timeout)}"}
+    return options
+
+
+def configure_database(app):
+    """在 db.init_app 之前调用：写入主库与只读副本的引擎参数"""
+    config = app.config
+    primary_url = config.get('SQLALCHEMY_DATABASE_URI')
+    if primary_url:
+        config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+            **engine_options(primary_url, config), **config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+        }
+
+    binds = dict(config.get('SQLALCHEMY_BINDS') or {})
+    for index, url in enumerate(config.get('DATABASE_REPLICA_URLS') or []):
+        binds[f"{REPLICA_BIND_PREFIX}{index}"] = {'url': url, **engine_options(url, config)}
+    config['SQLALCHEMY_BINDS'] = binds
+
+
+def configure_engine(engine, config):
+    """连接级初始化：SQLite 的 WAL / 外键，pgbouncer 模式下的语句超时"""
+    if engine.dialect.name == 'sqlite':
+        _configure_sqlite(engine, config)
+    elif engine.dialect.name == 'postgresql' and config.get('DB_PGBOUNCER') and config.get('DB_STATEMENT_TIMEOUT_MS'):
+        statement_timeout = int(config['DB_STATEMENT_TIMEOUT_MS'])
+
+        @event.listens_for(engine, "begin")
+        def _set_statement_timeout(conn):
+            conn.exec_driver_sql(f"SET LOCAL statement_timeout = {statement_timeout}")
+
+
+def _configure_sqlite(engine, config):
+    """SQLite 连接初始化：WAL 日志、忙等待超时与外键约束，与 PostgreSQL 的行为保持一致"""
+    wal = config.get('SQLITE_WAL', True)
+    busy_timeout = int(config.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            if wal:
+                # 内存数据库不支持 WAL，SQLite 会保持 memory 模式
+                cursor.execute("PRAGMA journal_mode=WAL")
+                cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute(f"PRAGMA busy_timeout={busy_timeout}")
+            cursor.execute("PRAGMA foreign_keys=ON")
+        finally:
+            cursor.close()
+
+    logger.info(f"使用 SQLite 数据库（WAL: {wal}）")
+
+
+class _RecentWriters:
+    """记录最近提交过写操作的客户端，在窗口期内读请求走主库（read-your-writes）"""
+
+    def __init__(self, max_entries=100000):
+        self._lock = threading.Lock()
+        self._until = {}
+        self.max_entries = max_entries
+
+    def mark(self, keys, seconds):
+        deadline = time.monotonic() + seconds
+        with self._lock:
+            if len(self._until) >= self.max_entries:
+                now = time.monotonic()
+                self._until = {k: v for k, v in self._until.items() if v > now}
+            for key in keys:
+                self._until[key] = deadline
+
+    def is_recent(self, keys):
+        now = time.monotonic()
+        with self._lock:
+            return any(self._until.get(key, 0) > now for key in keys)
+
+
+recent_writers = _RecentWriters()
+
+
+def _client_keys():
+    """客户端标识：请求中的 user_id（若有）与来源 IP"""
+    keys = [f"ip:{request.remote_addr}"]
+    user_id = request.args.get('user_id') or request.args.get('creator_user_id')
+    if user_id is None and request.is_json:
+        data = request.get_json(silent=True)
+        if isinstance(data, dict):
+            user_id = data.get('user_id') or data.get('userId')
+    if user_id is not None:
+        keys.append(f"user:{user_id}")
+    return keys
+
+
+def route_reads_to_replica(app):
+    """只读请求（GET）选择一个只读副本；该客户端刚提交过写操作时仍读主库"""
+    replicas = [key for key in app.config.get('SQLALCHEMY_BINDS', {}) if key.startswith(REPLICA_BIND_PREFIX)]
+    if not replicas or request.method != 'GET':
+        return
+    if recent_writers.is_recent(_client_keys()):
+        return
+    g.db_read_bind = random.choice(replicas)
+
+
+class RoutingSession(Session):
+    """读写分离的会话：标记为只读的请求中，SELECT 语句发往只读副本，其余语句与 flush 仍走主库
+
+    一旦会话内发生写操作，后续读取也改走主库，避免读到副本上尚未同步的数据。
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and has_request_context():
+            replica = g.get('db_read_bind')
+            if replica is not None:
+                if isinstance(clause, Select) and not self.info.get('has_writes'):
+                    engine = self._db.engines.get(replica)
+                    if engine is not None:
+                        return engine
+                elif clause is not None:
+                    g.db_read_bind = None
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _remember_writer(session):
+    """提交了写操作的客户端在 DB_READ_YOUR_WRITES_SECONDS 内的读请求走主库"""
+    has_writes = session.info.pop('has_writes', False)
+    if not has_writes or not has_request_context():
+        return
+    seconds = current_app.config.get('DB_READ_YOUR_WRITES_SECONDS', 5)
+    if seconds and current_app.config.get('DATABASE_REPLICA_URLS'):
+        recent_writers.mark(_client_keys(), seconds)
+
+
+@event.listens_for(RoutingSession, "after_rollback")
+def _clear_writes(session):
+    session.info.pop('has_writes', None)
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def _flag_writes(session, flush_context):
+    session.info['has_writes'] = True
+
+
+@event.listens_for(RoutingSession, "do_orm_execute")
+def _flag_bulk_writes(orm_execute_state):
+    if not orm_execute_state.is_select:
+        orm_execute_state.session.info['has_writes'] = True
@@ -0,0 +1,87 @@
+from flask import g, has_request_context, request, current_app
+from sqlalchemy import event
+from collections import Counter
+import re
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 折叠 IN 列表与多行 VALUES，使同一形状的语句归为一类
+_IN_LIST = re.compile(r"\(\s*(?:\?|%\(\w+\)s|:\w+)(?:\s*,\s*(?:\?|%\(\w+\)s|:\w+))+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def statement_shape(statement):
+    """去掉参数差异后的语句形状，用于识别 N+1 查询"""
+    shape = _WHITESPACE.sub(" ", statement).strip()
+    return _IN_LIST.sub("(?)", shape)
+
+
+class _RequestQueryStats:
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.shapes = Counter()
+
+
+def init_query_profiler(app, engines):
+    """为当前应用的各个数据库引擎开启按请求统计的 SQL 计数、耗时与 N+1 检测（需 DB_QUERY_PROFILING=true）
+
+    - 每个请求统计语句数与总耗时（毫秒），调试模式下通过 X-DB-Queries / X-DB-Time 响应头返回
+      （请求时判断：run.py 经 socketio.run(debug=True) 开启调试模式时，create_app 已经执行完毕）
+    - 同一语句形状在一个请求内重复超过 DB_N_PLUS_ONE_THRESHOLD 次时记录告警
+    - 超过 DB_SLOW_QUERY_MS 的语句连同参数记录到日志
+    """
+    config = app.config
+    if not config.get("DB_QUERY_PROFILING"):
+        return
+
+    slow_query_seconds = config.get("DB_SLOW_QUERY_MS", 200) / 1000.0
+    n_plus_one_threshold = config.get("DB_N_PLUS_ONE_THRESHOLD", 5)
+    for engine in engines:
+        _listen(engine, slow_query_seconds)
+
+    @app.after_request
+    def _report_query_stats(response):
+        stats = g.pop('_db_query_stats', None)
+        if stats is None:
+            return response
+
+        for shape, count in stats.shapes.items():
+            if count >= n_plus_one_threshold:
+                logger.warning(
+                    f"疑似 N+1 查询 - {request.method} {request.path} 同一语句执行 {count} 次: {shape}"
+                )
+
+        if current_app.debug or current_app.config.get("DB_QUERY_HEADERS"):
+            response.headers['X-DB-Queries'] = str(stats.count)
+            response.headers['X-DB-Time'] = f"{stats.total_time * 1000:.2f}"  # 毫秒
+        return response
+
+
+def _listen(engine, slow_query_seconds):
+    """单个引擎的语句计时；统计累加到当前请求"""
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('_profiler_query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('_profiler_query_start')
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+
+        if elapsed >= slow_query_seconds:
+            logger.warning(f"慢查询 {elapsed * 1000:.1f}ms: {statement} 参数: {parameters!r}")
+
+        if not has_request_context():
+            return
+        stats = g.get('_db_query_stats')
+        if stats is None:
+            stats = g._db_query_stats = _RequestQueryStats()
+        stats.count += 1
+        stats.total_time += elapsed
+        stats.shapes[statement_shape(statement)] += 1
+
@@ -0,0 +1,122 @@
+from flask import Response, stream_with_context
+from app.models import db, Chapter, ConversationMessage, NovelRecord
+from app.serializers import dumps, CHAPTER, MESSAGE, NOVEL
+from app.forks import visible_rows
+from app.archive import cold_world_chapters
+import heapq
+import zlib
+
+# 流式导出：服务端游标分批读取（yield_per），逐行输出 NDJSON，可选即时 gzip 压缩
+# 每行一个对象，type 字段标明记录类型（world / chapter / message / novel），
+# 查询只取列元组、不构造 ORM 对象，内存占用与章节、世界的规模无关
+
+# 累积到该字节数再发送一次，减少小块写入
+_FLUSH_BYTES = 64 * 1024
+
+
+def stream_rows(statement, serializer, record_type, batch_size):
+    """服务端游标逐批读取 serializer.select() 查询，逐行产出字典（record_type 不为空时带 type 字段）"""
+    from_row = serializer.compile()[1]
+    result = db.session.execute(statement.execution_options(stream_results=True, yield_per=batch_size))
+    try:
+        if record_type is None:
+            for row in result:
+                yield from_row(row)
+        else:
+            for row in result:
+                yield {'type': record_type, **from_row(row)}
+    finally:
+        result.close()
+
+
+def chapter_records(chapter, batch_size):
+    """章节导出：章节本身，随后按时间顺序的全部可见消息（分支章节包含继承的消息）"""
+    yield {'type': 'chapter', **chapter}
+    from_row = MESSAGE.compile()[1]
+    for row in visible_rows(chapter['id'], MESSAGE.columns(), batch_size):
+        yield {'type': 'message', **from_row(row)}
+
+
+def with_archived(records, world_id, record_type, key):
+    """把世界内已归档章节的消息按 key 归并进热表的消息流（records 须已按 key 排序）"""
+    columns, from_row = MESSAGE.compile()[:2]
+    keys = [column.key for column in columns]
+
+    def archived():
+        for _, rows in cold_world_chapters(world_id):
+            items = [from_row(tuple(row[name] for name in keys)) for row in rows]
+            if record_type is not None:
+                items = [{'type': record_type, **item} for item in items]
+            yield from sorted(items, key=key)
+
+    return heapq.merge(records, archived(), key=key)
+
+
+def world_records(world, batch_size):
+    """世界导出：世界（含角色）、全部章节、各章节的消息与小说"""
+    yield {'type': 'world', **world}
+    world_id = world['id']
+    yield from stream_rows(
+        CHAPTER.select().where(Chapter.world_id == world_id).order_by(Chapter.id),
+        CHAPTER, 'chapter', batch_size
+    )
+    yield from with_archived(stream_rows(
+        MESSAGE.select().join(Chapter, Chapter.id == ConversationMessage.chapter_id)
+        .where(Chapter.world_id == world_id)
+        .order_by(ConversationMessage.chapter_id, ConversationMessage.create_time, ConversationMessage.id),
+        MESSAGE, 'message', batch_size
+    ), world_id, 'message', key=lambda item: (item['chapter_id'], item['create_time'] or '', item['id']))
+    yield from stream_rows(
+        NOVEL.select().join(Chapter, Chapter.id == NovelRecord.chapter_id)
+        .where(Chapter.world_id == world_id)
+        .order_by(NovelRecord.id),
+        NOVEL, 'novel', batch_size
+    )
+
+
+def novel_records(user_id, batch_size):
+    """用户小说集导出：按创建时间倒序"""
+    yield from stream_rows(
+        NOVEL.select().where(NovelRecord.user_id == user_id)
+        .order_by(NovelRecord.create_time.desc(), NovelRecord.id.desc()),
+        NOVEL, 'novel', batch_size
+    )
+
+
+def _buffered(lines):
+    buffer = []
+    size = 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= _FLUSH_BYTES:
+            yield b''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def _gzipped(chunks, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def ndjson_response(records, filename, gzip=False, level=6):
+    """把记录生成器包装为流式下载响应；gzip=True 时输出 .ndjson.gz"""
+    chunks = _buffered(dumps(record) + b'\n' for record in records)
+    mimetype = 'application/x-ndjson'
+    filename = f"{filename}.ndjson"
+    if gzip:
+        chunks = _gzipped(chunks, level)
+        mimetype = 'application/gzip'
+        filename += '.gz'
+    # 流式输出期间保持请求上下文，数据库会话在响应发送完毕后才释放
+    response = Response(stream_with_context(chunks), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
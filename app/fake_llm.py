@@ -0,0 +1,184 @@
+from app.config import Config
+import json
+import random
+import threading
+import time
+import uuid
+
+# 离线的假大模型客户端，接口与 ZhipuAiClient 的 chat.completions.create 保持一致，
+# 用于压测与本地开发：可配置首 token 延迟、输出速率、错误率与 tool call 返回内容
+
+_FILLER_TEXT = (
+    "夜色如墨，檐角的风铃被晚风拨出细碎的声响。她抬眼望向你，指尖轻轻摩挲着茶盏的边沿，"
+    "沉默片刻后才低声开口：“你真的决定要去了吗？”烛火在她眸中跳动，映出一丝难以察觉的担忧。"
+)
+
+
+class FakeLLMError(Exception):
+    """模拟的模型服务错误"""
+
+
+class _Obj:
+    """简单的属性访问对象，模拟 SDK 返回的数据结构"""
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.__dict__!r})"
+
+
+class FakeStream:
+    """模拟流式响应，可迭代，支持 close()"""
+
+    def __init__(self, chunks, ttft, tokens_per_sec, fail_after=None):
+        self._chunks = chunks
+        self._ttft = ttft
+        self._tokens_per_sec = tokens_per_sec
+        self._fail_after = fail_after
+        self._closed = False
+
+    def __iter__(self):
+        time.sleep(self._ttft)
+        for i, (chunk, tokens) in enumerate(self._chunks):
+            if self._closed:
+                return
+            if self._fail_after is not None and i >= self._fail_after:
+                raise FakeLLMError("模拟的流式响应中断")
+            if i > 0 and self._tokens_per_sec > 0:
+                time.sleep(tokens / self._tokens_per_sec)
+            yield chunk
+
+    def close(self):
+        self._closed = True
+
+
+class _FakeCompletions:
+    def __init__(self, client):
+        self._client = client
+
+    def create(self, model=None, messages=None, stream=False, tools=None, tool_choice=None,
+               max_tokens=None, **kwargs):
+        return self._client._create(model, messages or [], stream, tools, max_tokens)
+
+
+class FakeLLMClient:
+    """可替换 ZhipuAiClient 的离线实现"""
+
+    def __init__(self, ttft=0.3, tokens_per_sec=40.0, error_rate=0.0, completion_tokens=120,
+                 tool_payloads=None, seed=None, chunk_tokens=4):
+        self.ttft = ttft
+        self.tokens_per_sec = tokens_per_sec
+        self.error_rate = error_rate
+        self.completion_tokens = completion_tokens
+        self.tool_payloads = tool_payloads or {}
+        self.chunk_tokens = max(1, chunk_tokens)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.chat = _Obj(completions=_FakeCompletions(self))
+
+    @classmethod
+    def from_config(cls):
+        tool_payloads = {}
+        if Config.FAKE_LLM_TOOL_PAYLOADS:
+            with open(Config.FAKE_LLM_TOOL_PAYLOADS, encoding="utf-8") as f:
+                tool_payloads = json.load(f)
+        return cls(
+            ttft=Config.FAKE_LLM_TTFT,
+            tokens_per_sec=Config.FAKE_LLM_TOKENS_PER_SEC,
+            error_rate=Config.FAKE_LLM_ERROR_RATE,
+            completion_tokens=Config.FAKE_LLM_COMPLETION_TOKENS,
+            tool_payloads=tool_payloads,
+            seed=Config.FAKE_LLM_SEED
+        )
+
+    def _roll(self):
+        with self._lock:
+            return self._random.random()
+
+    def _create(self, model, messages, stream, tools, max_tokens):
+        if self.error_rate and self._roll() < self.error_rate:
+            # 一半的错误发生在建立请求时，另一半发生在流式输出中途
+            if not stream or self._roll() < 0.5:
+                time.sleep(self.ttft)
+                raise FakeLLMError(f"模拟的模型服务错误（{model}）")
+            fail_midstream = True
+        else:
+            fail_midstream = False
+
+        prompt_tokens = sum(len(str(m.get("content") or "")) for m in messages)
+        tool_call = self._tool_call(tools) if tools else None
+        if tool_call:
+            text = None
+            completion_tokens = len(tool_call.function.arguments)
+        else:
+            length = min(self.completion_tokens, max_tokens or self.completion_tokens)
+            text = (_FILLER_TEXT * (length // len(_FILLER_TEXT) + 1))[:length]
+            completion_tokens = len(text)
+        usage = _Obj(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                     total_tokens=prompt_tokens + completion_tokens)
+
+        if stream:
+            chunks = self._stream_chunks(model, text, tool_call, usage)
+            fail_at = len(chunks) // 2 if fail_midstream else None
+            return FakeStream(chunks, self.ttft, self.tokens_per_sec, fail_at)
+
+        time.sleep(self.ttft + (completion_tokens / self.tokens_per_sec if self.tokens_per_sec > 0 else 0))
+        message = _Obj(role="assistant", content=text, tool_calls=[tool_call] if tool_call else None)
+        return _Obj(
+            id=f"fake-{uuid.uuid4().hex[:12]}",
+            model=model,
+            choices=[_Obj(index=0, message=message, finish_reason="tool_calls" if tool_call else "stop")],
+            usage=usage
+        )
+
+    def _tool_call(self, tools):
+        function = tools[0]["function"]
+        name = function["name"]
+        arguments = self.tool_payloads.get(name)
+        if arguments is None:
+            arguments = _example_arguments(function.get("parameters") or {})
+        return _Obj(
+            id=f"call_{uuid.uuid4().hex[:12]}",
+            type="function",
+            function=_Obj(name=name, arguments=json.dumps(arguments, ensure_ascii=False))
+        )
+
+    def _stream_chunks(self, model, text, tool_call, usage):
+        """切分为 (chunk, token数) 列表，最后一个分片携带 usage"""
+        step = self.chunk_tokens
+        chunks = []
+        if tool_call:
+            arguments = tool_call.function.arguments
+            for i in range(0, len(arguments), step):
+                first = i == 0
+                delta_call = _Obj(
+                    index=0,
+                    id=tool_call.id if first else None,
+                    type="function" if first else None,
+                    function=_Obj(name=tool_call.function.name if first else None, arguments=arguments[i:i + step])
+                )
+                chunks.append((_Obj(choices=[_Obj(index=0, delta=_Obj(content=None, tool_calls=[delta_call]))]),
+                               len(arguments[i:i + step])))
+        else:
+            for i in range(0, len(text), step):
+                chunks.append((_Obj(choices=[_Obj(index=0, delta=_Obj(content=text[i:i + step], tool_calls=None))]),
+                               len(text[i:i + step])))
+        chunks.append((_Obj(choices=[_Obj(index=0, delta=_Obj(content=None, tool_calls=None), finish_reason="stop")],
+                            usage=usage, model=model), 0))
+        return chunks
+
+
+def _example_arguments(schema):
+    """按参数定义生成示例数据"""
+    result = {}
+    for name, spec in (schema.get("properties") or {}).items():
+        if spec.get("type") == "array":
+            result[name] = [f"{spec.get('items', {}).get('description', name)}示例"]
+        elif spec.get("type") in ("integer", "number"):
+            result[name] = 1
+        elif spec.get("type") == "boolean":
+            result[name] = True
+        else:
+            result[name] = f"{spec.get('description', name)[:20]}（示例）"
+    return result
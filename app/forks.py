@@ -0,0 +1,266 @@
+from sqlalchemy import select, insert, update, and_, or_, case, literal, null
+from sqlalchemy.orm import aliased
+from app.models import db, Chapter, ConversationMessage, ChapterAnalysis
+from app.content import message_text
+from app.archive import archived_ids, cold_records, thaw_chapters
+from datetime import datetime
+import heapq
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 章节分支（写时复制）：分支章节只记录 (origin_chapter_id, fork_message_id)，
+# 共享父章节中 id 不大于分支点的可见消息，创建分支不复制任何消息。
+#
+# 章节的可见消息 = 自身消息 + 父章节可见消息中 id <= fork_message_id 的部分（沿祖先链递归），
+# 祖先链用一条递归 CTE 解析为 [(章节 id, 上界)]，再用一条查询取出全部可见消息。
+#
+# 父章节回溯（删除消息）或被删除时，先把受影响的分支“物化”：复制其继承的消息、清除分支点，
+# 之后再修改共享的消息，保证分支看到的历史不变。
+#
+# 祖先链中的章节可能已被冷归档（app/archive.py）：读取时热表结果与冷数据按 (create_time, id) 归并，
+# 需要改写历史的操作（回溯、物化）先把相关章节解冻回热表。
+
+# 祖先链最大深度，防止异常数据形成环
+MAX_FORK_DEPTH = 64
+
+
+def _min_bound(bound, fork_message_id):
+    return case(
+        (or_(bound.is_(None), fork_message_id < bound), fork_message_id),
+        else_=bound,
+    )
+
+
+def fork_chain(chapter_id):
+    """章节的祖先链：[(章节 id, 上界)]，自身上界为 None，祖先上界为可继承的最大消息 id"""
+    chain = select(
+        Chapter.id.label('chapter_id'),
+        Chapter.origin_chapter_id.label('parent_id'),
+        Chapter.fork_message_id.label('fork_message_id'),
+        null().label('bound'),
+        literal(0).label('depth'),
+    ).where(Chapter.id == chapter_id).cte('fork_chain', recursive=True)
+
+    parent = aliased(Chapter)
+    chain = chain.union_all(
+        select(
+            parent.id,
+            parent.origin_chapter_id,
+            parent.fork_message_id,
+            _min_bound(chain.c.bound, chain.c.fork_message_id),
+            chain.c.depth + 1,
+        ).join(chain, parent.id == chain.c.parent_id)
+        .where(chain.c.fork_message_id.is_not(None), chain.c.depth < MAX_FORK_DEPTH)
+    )
+    rows = db.session.execute(select(chain.c.chapter_id, chain.c.bound).order_by(chain.c.depth)).all()
+    return [(row[0], row[1]) for row in rows]
+
+
+def chain_condition(chain):
+    """祖先链对应的消息过滤条件"""
+    conditions = []
+    for chapter_id, bound in chain:
+        if bound is None:
+            conditions.append(ConversationMessage.chapter_id == chapter_id)
+        else:
+            conditions.append(and_(ConversationMessage.chapter_id == chapter_id, ConversationMessage.id <= bound))
+    return conditions[0] if len(conditions) == 1 else or_(*conditions)
+
+
+def visible_messages(chapter_id):
+    """章节可见消息在热表中的过滤条件（含继承自祖先章节的消息，不含已归档的部分）"""
+    return chain_condition(fork_chain(chapter_id) or [(chapter_id, None)])
+
+
+def archived_entries(chain):
+    """祖先链中已归档的部分"""
+    archived = archived_ids([chapter_id for chapter_id, _ in chain])
+    return [entry for entry in chain if entry[0] in archived]
+
+
+def chapter_chain(chapter_id):
+    """(祖先链, 其中已归档的部分)"""
+    chain = fork_chain(chapter_id) or [(chapter_id, None)]
+    return chain, archived_entries(chain)
+
+
+def _order_key(create_time, message_id):
+    return create_time or datetime.min, message_id
+
+
+def visible_rows(chapter_id, columns, batch_size=None):
+    """按 (create_time, id) 顺序逐行产出章节全部可见消息的 columns 列（含已归档的部分）
+
+    batch_size 不为空时使用服务端游标分批读取热表。
+    """
+    chain, cold = chapter_chain(chapter_id)
+    statement = select(*columns).where(chain_condition(chain))
+    if batch_size:
+        statement = statement.execution_options(stream_results=True, yield_per=batch_size)
+    if not cold:
+        result = db.session.execute(statement.order_by(ConversationMessage.create_time, ConversationMessage.id))
+        try:
+            yield from result
+        finally:
+            result.close()
+        return
+
+    # 热表结果追加排序列后与冷数据归并（NULL 时间统一排在最前，与冷数据的排序键一致）
+    keys = [column.key for column in columns]
+    width = len(keys)
+    cold_rows = [
+        tuple(record[key] for key in keys) + (record['create_time'], record['id']) for record in cold_records(cold)
+    ]
+    result = db.session.execute(
+        statement.add_columns(ConversationMessage.create_time, ConversationMessage.id)
+        .order_by(ConversationMessage.create_time.asc().nulls_first(), ConversationMessage.id)
+    )
+    try:
+        for row in heapq.merge(result, cold_rows, key=lambda row: _order_key(row[width], row[width + 1])):
+            yield tuple(row[:width])
+    finally:
+        result.close()
+
+
+def latest_message_id(chapter_id):
+    """章节可见消息中最新的一条的 id"""
+    chain, cold = chapter_chain(chapter_id)
+    latest = db.session.execute(
+        select(db.func.max(ConversationMessage.id)).where(chain_condition(chain))
+    ).scalar()
+    if cold:
+        latest = max([record['id'] for record in cold_records(cold)] + ([latest] if latest is not None else []))
+    return latest
+
+
+def message_visible(chapter_id, message_id):
+    """message_id 是否为章节的可见消息"""
+    chain, cold = chapter_chain(chapter_id)
+    hot = db.session.execute(
+        select(ConversationMessage.id).where(chain_condition(chain), ConversationMessage.id == message_id)
+    ).first()
+    return hot is not None or any(record['id'] == message_id for record in cold_records(cold))
+
+
+def chapter_history(chapter_id, limit=20):
+    """最近 limit 条可见消息，按时间正序，格式与前端传入的 messages 一致"""
+    chain, cold = chapter_chain(chapter_id)
+    rows = db.session.execute(
+        select(ConversationMessage.role, ConversationMessage.content, ConversationMessage.flags,
+               ConversationMessage.create_time, ConversationMessage.id)
+        .where(chain_condition(chain))
+        .order_by(ConversationMessage.create_time.desc(), ConversationMessage.id.desc())
+        .limit(limit)
+    ).all()
+    rows = list(reversed(rows))
+    if cold:
+        rows = sorted(rows + [
+            (record['role'], record['content'], record['flags'], record['create_time'], record['id'])
+            for record in cold_records(cold)
+        ], key=lambda row: _order_key(row[3], row[4]))[-limit:]
+    return [{'role': role, 'content': message_text(content, flags)} for role, content, flags, _, _ in rows]
+
+
+def fork_chapter(source, fork_message_id, creator_user_id, name=None, opening=None, background=None):
+    """从 source 章节的 fork_message_id 处创建分支（O(1)，不复制消息），返回新章节"""
+    chapter = Chapter(
+        world_id=source.world_id,
+        creator_user_id=creator_user_id,
+        name=name or f"{source.name}（分支）",
+        opening=source.opening if opening is None else opening,
+        background=source.background if background is None else background,
+        is_default=False,
+        origin_chapter_id=source.id,
+        fork_message_id=fork_message_id,
+    )
+    db.session.add(chapter)
+    db.session.flush()
+    return chapter
+
+
+def _fork_descendants(chapter_id):
+    """以 chapter_id 为根的分支树：[(章节 id, 父章节 id, 对根章节的上界)]，按深度排序"""
+    tree = select(
+        Chapter.id.label('chapter_id'),
+        Chapter.origin_chapter_id.label('parent_id'),
+        Chapter.fork_message_id.label('bound'),
+        literal(1).label('depth'),
+    ).where(Chapter.origin_chapter_id == chapter_id, Chapter.fork_message_id.is_not(None)) \
+        .cte('fork_tree', recursive=True)
+
+    child = aliased(Chapter)
+    tree = tree.union_all(
+        select(
+            child.id,
+            child.origin_chapter_id,
+            _min_bound(tree.c.bound, child.fork_message_id),
+            tree.c.depth + 1,
+        ).join(tree, child.origin_chapter_id == tree.c.chapter_id)
+        .where(child.fork_message_id.is_not(None), tree.c.depth < MAX_FORK_DEPTH)
+    )
+    return db.session.execute(
+        select(tree.c.chapter_id, tree.c.parent_id, tree.c.bound).order_by(tree.c.depth)
+    ).all()
+
+
+def _materialize(chapter_ids):
+    """把分支继承的消息复制为自身消息并清除分支点；先全部复制再清除，复制时祖先链保持不变"""
+    columns = (ConversationMessage.user_id, ConversationMessage.role, ConversationMessage.content,
+               ConversationMessage.flags, ConversationMessage.create_time)
+    copied = 0
+    for chapter_id in chapter_ids:
+        inherited = fork_chain(chapter_id)[1:]
+        if not inherited:
+            continue
+        # 继承的消息需要在热表中复制，已归档的祖先章节先解冻
+        thaw_chapters([entry[0] for entry in archived_entries(inherited)])
+        result = db.session.execute(
+            insert(ConversationMessage).from_select(
+                ['chapter_id', 'user_id', 'role', 'content', 'flags', 'create_time'],
+                select(literal(chapter_id), *columns).where(chain_condition(inherited))
+                .order_by(ConversationMessage.create_time, ConversationMessage.id)
+            )
+        )
+        copied += result.rowcount or 0
+    db.session.execute(
+        update(Chapter).where(Chapter.id.in_(chapter_ids)).values(fork_message_id=None)
+    )
+    # 物化后可见消息的 id 改变，重新计算统计（app.stats 依赖本模块，此处延迟导入）
+    from app.stats import refresh_chapters
+    refresh_chapters(chapter_ids)
+    logger.info(f"物化分支章节 {chapter_ids}，复制消息 {copied} 条")
+    return copied
+
+
+def detach_forks(chapter_id, from_message_id=None):
+    """chapter_id 将删除 id >= from_message_id 的可见消息（None 表示删除整个章节）之前调用：
+    物化所有会受影响的分支及其后代分支"""
+    affected = set()
+    for descendant, parent, bound in _fork_descendants(chapter_id):
+        if parent in affected or from_message_id is None or bound >= from_message_id:
+            affected.add(descendant)
+    if affected:
+        _materialize(sorted(affected))
+    return affected
+
+
+def truncate_history(chapter, from_message_id):
+    """回溯：删除章节中 id >= from_message_id 的可见消息，返回删除的自身消息数
+
+    继承的消息不删除，而是把分支点前移到 from_message_id 之前。
+    """
+    detach_forks(chapter.id, from_message_id)
+    thaw_chapters([chapter.id], from_message_id)
+    deleted = ConversationMessage.query.filter(
+        ConversationMessage.chapter_id == chapter.id,
+        ConversationMessage.id >= from_message_id
+    ).delete(synchronize_session=False)
+    if chapter.fork_message_id is not None and chapter.fork_message_id >= from_message_id:
+        chapter.fork_message_id = from_message_id - 1
+    # 覆盖了被删除消息的自动剧情分析描述的是已不存在的剧情，一并删除
+    ChapterAnalysis.query.filter(
+        ChapterAnalysis.chapter_id == chapter.id,
+        ChapterAnalysis.message_id >= from_message_id
+    ).delete(synchronize_session=False)
+    return deleted
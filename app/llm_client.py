@@ -0,0 +1,25 @@
+from zai import ZhipuAiClient
+from app.config import Config
+
+
+def create_client():
+    """按 LLM_PROVIDER 创建大模型客户端
+
+    - zhipu（默认）：真实客户端
+    - fake：离线假实现，用于压测
+    - record：真实客户端（LLM_RECORD_UPSTREAM=fake 时为离线假实现），调用记录追加到 LLM_CASSETTE
+    - replay：从 LLM_CASSETTE 回放，不访问网络
+    """
+    if Config.LLM_PROVIDER == "fake":
+        from app.fake_llm import FakeLLMClient
+        return FakeLLMClient.from_config()
+    if Config.LLM_PROVIDER == "replay":
+        from app.cassette import ReplayClient
+        return ReplayClient(Config.LLM_CASSETTE, speed=Config.LLM_REPLAY_SPEED, strict=Config.LLM_REPLAY_STRICT)
+    if Config.LLM_PROVIDER == "record":
+        from app.cassette import RecordingClient
+        if Config.LLM_RECORD_UPSTREAM == "fake":
+            from app.fake_llm import FakeLLMClient
+            return RecordingClient(FakeLLMClient.from_config(), Config.LLM_CASSETTE)
+        return RecordingClient(ZhipuAiClient(api_key=Config.ZHIPU_API_KEY), Config.LLM_CASSETTE)
+    return ZhipuAiClient(api_key=Config.ZHIPU_API_KEY)
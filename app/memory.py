@@ -0,0 +1,201 @@
+from collections import OrderedDict
+from sqlalchemy import select
+from app.config import Config
+from app.models import db, ConversationMessage, ChapterStats
+from app.content import message_text
+from app.forks import fork_chain, chain_condition, visible_rows
+import json
+import math
+import re
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 长期记忆：按章节的词法检索索引，聊天时从最近窗口之外的早期对话中召回与当前对话相关的若干条
+#
+# 索引为章节可见消息（含继承与已归档的消息）上的 BM25，中文按相邻两字切分（单字成段时取单字），
+# 英文与数字按词切分，无需分词词典与外部服务。
+# 索引常驻进程内存（按章节 LRU），首次使用时全量构建，之后每次使用只读取 id 大于已索引最大 id 的新消息；
+# 索引条数与 chapter_stats 消息数的差值变化时（回溯、物化、其他进程的删除）整体重建。
+
+K1 = 1.2
+B = 0.75
+
+_CJK = re.compile(r'[㐀-䶿一-鿿豈-﫿]+')
+_WORD = re.compile(r'[A-Za-z0-9]+')
+
+
+def terms(text):
+    """检索词：中文连续片段的相邻二字，英文与数字按词（小写）"""
+    result = []
+    for run in _CJK.findall(text or ''):
+        if len(run) == 1:
+            result.append(run)
+        else:
+            result.extend(run[i:i + 2] for i in range(len(run) - 1))
+    result.extend(word.lower() for word in _WORD.findall(text or ''))
+    return result
+
+
+def estimate_tokens(text):
+    """粗略估算 token 数：中文约一字一个，其余约四个字符一个"""
+    cjk = sum(len(run) for run in _CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class ChapterIndex:
+    """单个章节的倒排索引，消息按可见顺序追加"""
+
+    def __init__(self, chapter_id):
+        self.chapter_id = chapter_id
+        self.lock = threading.Lock()
+        self.built = False
+        # 全量构建时 chapter_stats 消息数与索引条数之差（统计未重建等情况下不为 0）
+        self.drift = 0
+        self.reset()
+
+    def reset(self):
+        self.order = []  # 按可见顺序的消息 id
+        self.docs = {}  # 消息 id -> (role, 内容, 词数)
+        self.postings = {}  # 词 -> {消息 id: 词频}
+        self.total_length = 0
+        self.last_id = 0
+
+    def add(self, message_id, role, content):
+        counts = {}
+        for term in terms(content):
+            counts[term] = counts.get(term, 0) + 1
+        for term, tf in counts.items():
+            self.postings.setdefault(term, {})[message_id] = tf
+        length = sum(counts.values())
+        self.docs[message_id] = (role, content, length)
+        self.order.append(message_id)
+        self.total_length += length
+        self.last_id = max(self.last_id, message_id)
+
+    def search(self, query, limit, skip_recent=0):
+        """BM25 得分最高的 limit 条 [(得分, 消息 id)]，不含最近的 skip_recent 条"""
+        candidates = len(self.order) - skip_recent
+        if candidates <= 0 or not self.docs:
+            return []
+        excluded = set(self.order[candidates:]) if skip_recent else ()
+        average = self.total_length / len(self.docs) or 1
+        scores = {}
+        for term in set(terms(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = math.log(1 + (len(self.docs) - len(posting) + 0.5) / (len(posting) + 0.5))
+            for message_id, tf in posting.items():
+                if message_id in excluded:
+                    continue
+                length = self.docs[message_id][2]
+                scores[message_id] = scores.get(message_id, 0.0) + \
+                    idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * length / average))
+        best = sorted(((score, message_id) for message_id, score in scores.items()), reverse=True)
+        return best[:limit]
+
+
+class LongTermMemory:
+    """进程内的章节索引缓存"""
+
+    def __init__(self, max_chapters=256, batch_size=1000):
+        self.max_chapters = max_chapters
+        self.batch_size = batch_size
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _build(self, index):
+        """按可见顺序全量构建（含继承与已归档的消息）"""
+        index.reset()
+        columns = [ConversationMessage.id, ConversationMessage.role, ConversationMessage.content,
+                   ConversationMessage.flags]
+        for message_id, role, content, flags in visible_rows(index.chapter_id, columns, self.batch_size):
+            index.add(message_id, role, message_text(content, flags))
+        index.built = True
+
+    def _catch_up(self, index):
+        """追加已索引之后的新消息（新消息只会写入热表，id 递增）"""
+        chain = fork_chain(index.chapter_id) or [(index.chapter_id, None)]
+        rows = db.session.execute(
+            select(ConversationMessage.id, ConversationMessage.role, ConversationMessage.content,
+                   ConversationMessage.flags)
+            .where(chain_condition(chain), ConversationMessage.id > index.last_id)
+            .order_by(ConversationMessage.create_time, ConversationMessage.id)
+        ).all()
+        for message_id, role, content, flags in rows:
+            index.add(message_id, role, message_text(content, flags))
+
+    def index(self, chapter_id):
+        """取得与数据库同步的章节索引"""
+        with self._lock:
+            index = self._indexes.get(chapter_id)
+            if index is None:
+                index = self._indexes[chapter_id] = ChapterIndex(chapter_id)
+            self._indexes.move_to_end(chapter_id)
+            while len(self._indexes) > self.max_chapters:
+                self._indexes.popitem(last=False)
+
+        expected = db.session.execute(
+            select(ChapterStats.message_count).where(ChapterStats.chapter_id == chapter_id)
+        ).scalar()
+        with index.lock:
+            if index.built:
+                self._catch_up(index)
+            if not index.built or (expected is not None and len(index.order) + index.drift != expected):
+                self._build(index)
+                # 重建后仍不一致说明统计本身有偏差（如旧数据未执行 rebuild-stats），记下差值：
+                # 新消息使两边同步增加，不再逐轮重建；回溯等改变历史的操作使差值变化时才再次重建
+                index.drift = expected - len(index.order) if expected is not None else 0
+                if index.drift:
+                    logger.warning(f"长期记忆索引与 chapter_stats 消息数不一致 - chapter_id: {chapter_id}, "
+                                   f"索引 {len(index.order)} 条, 统计 {expected} 条，可执行 rebuild-stats 修正")
+        return index
+
+    def recall(self, chapter_id, query, skip_recent, top_k, token_budget):
+        """最近 skip_recent 条之前、与 query 最相关的消息，按对话顺序返回 [{'role', 'content'}]，总长不超过 token_budget"""
+        if not query or top_k <= 0 or token_budget <= 0:
+            return []
+        index = self.index(chapter_id)
+        with index.lock:
+            hits = index.search(query, top_k, skip_recent)
+            position = {message_id: i for i, message_id in enumerate(index.order)} if hits else {}
+            selected, used = [], 0
+            for _, message_id in hits:
+                role, content, _ = index.docs[message_id]
+                cost = estimate_tokens(content)
+                if used + cost > token_budget:
+                    continue
+                selected.append(message_id)
+                used += cost
+            selected.sort(key=position.get)
+            return [{'role': index.docs[message_id][0], 'content': index.docs[message_id][1]} for message_id in selected]
+
+
+memory = LongTermMemory(max_chapters=Config.MEMORY_MAX_CHAPTERS)
+
+
+def recall_context(chapter_id, history):
+    """聊天上下文构造：以最近两轮对话为查询，召回 history 窗口之前的相关早期对话；未开启或出错时返回空列表"""
+    if not Config.MEMORY_ENABLED or not chapter_id or not history:
+        return []
+    query = ' '.join(str(item.get('content') or '') for item in history[-2:] if isinstance(item, dict))
+    try:
+        return memory.recall(int(chapter_id), query, len(history), Config.MEMORY_TOP_K, Config.MEMORY_TOKEN_BUDGET)
+    except Exception as e:
+        # 查询失败（如语句超时）会使 PostgreSQL 事务进入中止状态，回滚后聊天流程才能继续写入消息
+        db.session.rollback()
+        logger.error(f"长期记忆检索失败 - chapter_id: {chapter_id}: {e}")
+        return []
+
+
+def memory_prompt(recalled):
+    """召回结果在提示词中的段落（放在最近对话之前），无结果时为空字符串"""
+    if not recalled:
+        return ''
+    return f"""[Earlier Related History]
+以下是与当前情节相关的早期对话（按时间顺序），用于保持人物与情节前后一致，不必复述：
+{json.dumps(recalled, ensure_ascii=False)}
+
+"""
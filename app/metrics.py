@@ -0,0 +1,236 @@
+from app.config import Config
+from app.routing import add_call_listener
+from functools import wraps
+import json
+import random
+import threading
+import time
+import logging
+
+# 轻量的 Prometheus 文本格式指标实现，避免引入额外依赖
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values)) + (extra or [])
+    if not pairs:
+        return ""
+    escaped = [
+        '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in pairs
+    ]
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._function = None
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function):
+        """采集时才计算的指标（无标签）"""
+        self._function = function
+
+    def render(self):
+        if self._function is not None:
+            with self._lock:
+                self._values[()] = self._function()
+        return super().render()
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['counts'][i] += 1
+                    break
+            state['sum'] += value
+            state['count'] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            items = [(key, dict(state, counts=list(state['counts']))) for key, state in self._values.items()]
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state['counts']):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state['sum'])}")
+            lines.append(f"{self.name}_count{labels} {state['count']}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+HTTP_REQUEST_DURATION = registry.register(Histogram(
+    "http_request_duration_seconds", "REST 接口请求耗时", ("endpoint", "method", "status")
+))
+SOCKETIO_EVENT_DURATION = registry.register(Histogram(
+    "socketio_event_duration_seconds", "Socket.IO 事件处理耗时", ("event",)
+))
+LLM_TIME_TO_FIRST_TOKEN = registry.register(Histogram(
+    "llm_time_to_first_token_seconds", "大模型流式响应首 token 耗时", ("endpoint", "model")
+))
+LLM_REQUEST_DURATION = registry.register(Histogram(
+    "llm_request_duration_seconds", "大模型调用总耗时", ("endpoint", "model")
+))
+LLM_TOKENS_PER_SECOND = registry.register(Histogram(
+    "llm_tokens_per_second", "大模型输出速率（completion token/秒）", ("model",),
+    buckets=(5, 10, 20, 40, 60, 80, 100, 150, 200, 400)
+))
+LLM_PROMPT_TOKENS = registry.register(Counter(
+    "llm_prompt_tokens_total", "大模型 prompt token 数", ("endpoint", "model")
+))
+LLM_COMPLETION_TOKENS = registry.register(Counter(
+    "llm_completion_tokens_total", "大模型 completion token 数", ("endpoint", "model")
+))
+SOCKETIO_CONNECTIONS = registry.register(Gauge(
+    "socketio_active_connections", "当前 Socket.IO 连接数"
+))
+ACTIVE_STREAMS = registry.register(Gauge(
+    "socketio_active_streams", "正在进行的流式处理数", ("event",)
+))
+NOVEL_QUEUE_DEPTH = registry.register(Gauge(
+    "novel_queue_depth", "处理中的小说生成任务数"
+))
+DB_QUERY_DURATION = registry.register(Histogram(
+    "db_query_duration_seconds", "数据库语句执行耗时", ("operation",)
+))
+
+
+def observe_llm_call(stats):
+    """routing 的调用回调：记录大模型耗时、首 token 与 token 用量"""
+    LLM_REQUEST_DURATION.observe(stats.duration, endpoint=stats.endpoint, model=stats.model)
+    if stats.ttft is not None:
+        LLM_TIME_TO_FIRST_TOKEN.observe(stats.ttft, endpoint=stats.endpoint, model=stats.model)
+    LLM_PROMPT_TOKENS.inc(stats.prompt_tokens, endpoint=stats.endpoint, model=stats.model)
+    LLM_COMPLETION_TOKENS.inc(stats.completion_tokens, endpoint=stats.endpoint, model=stats.model)
+    generation_time = stats.duration - (stats.ttft or 0)
+    if stats.completion_tokens and generation_time > 0:
+        LLM_TOKENS_PER_SECOND.observe(stats.completion_tokens / generation_time, model=stats.model)
+
+
+def track_socket_event(event):
+    """记录 Socket.IO 事件处理耗时与并发流数量；放在 rate_limited 之内，被限流拒绝的事件不计入"""
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            ACTIVE_STREAMS.inc(event=event)
+            started = time.perf_counter()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                ACTIVE_STREAMS.dec(event=event)
+                SOCKETIO_EVENT_DURATION.observe(time.perf_counter() - started, event=event)
+        return wrapper
+    return decorator
+
+
+def log_sampled(logger, event, level=logging.INFO, **fields):
+    """按 Config.LOG_SAMPLE_RATE 采样输出结构化（JSON）日志，替代热路径上的整段打印"""
+    if level < logging.WARNING and random.random() >= Config.LOG_SAMPLE_RATE:
+        return
+    if not logger.isEnabledFor(level):
+        return
+    logger.log(level, json.dumps({"event": event, **fields}, ensure_ascii=False, default=str))
+
+
+def instrument_engine(engine):
+    """监听 SQLAlchemy 引擎事件，记录每条语句的执行耗时"""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('_metrics_query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('_metrics_query_start')
+        if not starts:
+            return
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "UNKNOWN"
+        DB_QUERY_DURATION.observe(time.perf_counter() - starts.pop(), operation=operation)
+
+
+add_call_listener(observe_llm_call)
@@ -1,8 +1,48 @@
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.types import TypeDecorator
 from typing import List, Optional
+from app.database import RoutingSession
+from app.content import codec
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+class StringList(TypeDecorator):
+    """字符串列表：PostgreSQL 使用原生数组，其余数据库（如 SQLite）以 JSON 存储"""
+    impl = db.JSON
+    cache_ok = True
+
+    def __init__(self, length=None):
+        super().__init__()
+        self.length = length
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(db.ARRAY(db.String(self.length)))
+        return dialect.type_descriptor(db.JSON())
+
+class CompressedText(TypeDecorator):
+    """正文：开启 CONTENT_COMPRESSION 时按 zstd 压缩存为二进制，读取时解压；未开启时即普通 TEXT
+
+    读到字符串（SQLite 中迁移前的旧数据）时原样返回，压缩与未压缩的数据可以共存。
+    """
+    impl = db.Text
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if codec.enabled:
+            return dialect.type_descriptor(db.LargeBinary())
+        return dialect.type_descriptor(db.Text())
+
+    def process_bind_param(self, value, dialect):
+        if value is None or not codec.enabled:
+            return value
+        return codec.compress(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None or isinstance(value, str):
+            return value
+        return codec.decompress(value)
 
 class User(db.Model):
     __tablename__ = 'users'
@@ -29,11 +69,11 @@ class World(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     name = db.Column(db.String(100), nullable=False)
-    tags = db.Column(db.ARRAY(db.String(50)))  # PostgreSQL数组类型
+    tags = db.Column(StringList(50))  # PostgreSQL数组类型，其余数据库为JSON
     is_public = db.Column(db.Boolean, default=False)
     worldview = db.Column(db.Text)
     master_setting = db.Column(db.Text)
-    origin_world_id = db.Column(db.Integer, db.ForeignKey('worlds.id'), nullable=True)
+    origin_world_id = db.Column(db.Integer, db.ForeignKey('worlds.id'), nullable=True, index=True)
     create_time = db.Column(db.DateTime, default=datetime.utcnow)
     popularity = db.Column(db.Integer, default=0)
     
@@ -45,13 +85,16 @@ class Chapter(db.Model):
     __tablename__ = 'chapters'
     
     id = db.Column(db.Integer, primary_key=True)
-    world_id = db.Column(db.Integer, db.ForeignKey('worlds.id'), nullable=False)
+    world_id = db.Column(db.Integer, db.ForeignKey('worlds.id'), nullable=False, index=True)
     creator_user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     name = db.Column(db.String(100), nullable=False)
     opening = db.Column(db.Text)
     background = db.Column(db.Text)
     is_default = db.Column(db.Boolean, default=False)
-    origin_chapter_id = db.Column(db.Integer, db.ForeignKey('chapters.id'), nullable=True)
+    origin_chapter_id = db.Column(db.Integer, db.ForeignKey('chapters.id'), nullable=True, index=True)
+    # 分支点：不为空时本章节共享 origin_chapter 中 id 不大于该值的可见消息（不复制）；
+    # 只作为 id 上界使用，不要求对应的消息存在，因此不设外键
+    fork_message_id = db.Column(db.Integer, nullable=True)
     create_time = db.Column(db.DateTime, default=datetime.utcnow)
     
     # 关系
@@ -65,14 +108,23 @@ class ConversationMessage(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     chapter_id = db.Column(db.Integer, db.ForeignKey('chapters.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    role = db.Column(db.Enum('user', 'ai', name='message_role'), nullable=False)
-    content = db.Column(db.Text, nullable=False)
+    role = db.Column(db.Enum('user', 'ai', name='message_role', create_constraint=True), nullable=False)
+    content = db.Column(CompressedText, nullable=False)
+    # 位标记：1 表示 AI 正文，content 不含“正文：”前缀，输出时拼回（见 app/content.py）
+    flags = db.Column(db.SmallInteger, nullable=False, default=0, server_default='0')
     create_time = db.Column(db.DateTime, default=datetime.utcnow)
     
     # 关系
     chapter = db.relationship('Chapter', backref=db.backref('messages', lazy=True))
     user = db.relationship('User', backref=db.backref('messages', lazy=True))
 
+    # 按章节读取、回溯删除都是 (chapter_id, id) 上的范围查询；
+    # SQLite 默认会重用已删除的最大 id，归档移出热表的消息 id 必须保持唯一，因此使用 AUTOINCREMENT
+    __table_args__ = (
+        db.Index('ix_conversation_messages_chapter_id_id', 'chapter_id', 'id'),
+        {'sqlite_autoincrement': True},
+    )
+
 class NovelRecord(db.Model):
     __tablename__ = 'novel_records'
     
@@ -80,7 +132,7 @@ class NovelRecord(db.Model):
     chapter_id = db.Column(db.Integer, db.ForeignKey('chapters.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     title = db.Column(db.String(200), nullable=True)
-    content = db.Column(db.Text, nullable=False)
+    content = db.Column(CompressedText, nullable=False)
     create_time = db.Column(db.DateTime, default=datetime.utcnow)
     popularity = db.Column(db.Integer, default=0)
     
@@ -94,7 +146,7 @@ class UserWorld(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     world_id = db.Column(db.Integer, db.ForeignKey('worlds.id'), nullable=False)
-    role = db.Column(db.Enum('creator', 'participant', 'viewer', name='user_role'), nullable=False)
+    role = db.Column(db.Enum('creator', 'participant', 'viewer', name='user_role', create_constraint=True), nullable=False)
     create_time = db.Column(db.DateTime, default=datetime.utcnow)
     
     # 关系
@@ -104,4 +156,63 @@ class UserWorld(db.Model):
     # 联合唯一约束
     __table_args__ = (
         db.UniqueConstraint('user_id', 'world_id', name='unique_user_world'),
-    )
\ No newline at end of file
+    )
+
+# 统计表（反范式）：随消息、小说的写入在同一事务内增量更新，列表接口据此排序、过滤，
+# 无需对 conversation_messages 逐行 COUNT(*)；数据不一致时可用 flask rebuild-stats 全量重建
+class ChapterStats(db.Model):
+    __tablename__ = 'chapter_stats'
+
+    chapter_id = db.Column(db.Integer, db.ForeignKey('chapters.id'), primary_key=True)
+    world_id = db.Column(db.Integer, db.ForeignKey('worlds.id'), nullable=False)
+    # 可见消息（分支章节含继承自父章节的部分）的条数、正文总字符数与最新一条
+    message_count = db.Column(db.Integer, nullable=False, default=0)
+    total_chars = db.Column(db.BigInteger, nullable=False, default=0)
+    last_message_id = db.Column(db.Integer)
+    last_message_time = db.Column(db.DateTime)
+    novel_count = db.Column(db.Integer, nullable=False, default=0)
+    # 其中继承自祖先章节的部分；世界统计只汇总章节自身的消息，不重复计入继承的部分
+    inherited_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    inherited_chars = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
+    update_time = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_chapter_stats_world_id_last_message_time', 'world_id', 'last_message_time'),
+    )
+
+class WorldStats(db.Model):
+    __tablename__ = 'world_stats'
+
+    world_id = db.Column(db.Integer, db.ForeignKey('worlds.id'), primary_key=True)
+    chapter_count = db.Column(db.Integer, nullable=False, default=0)
+    message_count = db.Column(db.Integer, nullable=False, default=0, index=True)
+    total_chars = db.Column(db.BigInteger, nullable=False, default=0)
+    novel_count = db.Column(db.Integer, nullable=False, default=0)
+    last_active_time = db.Column(db.DateTime, index=True)
+    update_time = db.Column(db.DateTime, default=datetime.utcnow)
+
+# 冷归档：长期不活跃章节的消息整体压缩为一行，移出 conversation_messages（见 app/archive.py）
+class ArchivedChapter(db.Model):
+    __tablename__ = 'archived_chapters'
+
+    chapter_id = db.Column(db.Integer, db.ForeignKey('chapters.id'), primary_key=True)
+    message_count = db.Column(db.Integer, nullable=False)
+    total_chars = db.Column(db.BigInteger, nullable=False)
+    first_message_id = db.Column(db.Integer)
+    last_message_id = db.Column(db.Integer)
+    last_message_time = db.Column(db.DateTime)
+    codec = db.Column(db.String(10), nullable=False)  # zstd / zlib
+    payload = db.Column(db.LargeBinary, nullable=False)  # 压缩后的 NDJSON，每行一条消息，按 id 排序
+    archive_time = db.Column(db.DateTime, default=datetime.utcnow)
+
+# 自动剧情分析：每个章节只保留最新一次的结果（见 app/analysis.py）
+class ChapterAnalysis(db.Model):
+    __tablename__ = 'chapter_analyses'
+
+    chapter_id = db.Column(db.Integer, db.ForeignKey('chapters.id'), primary_key=True)
+    content = db.Column(db.Text, nullable=False)
+    message_id = db.Column(db.Integer)  # 分析覆盖到的最新消息
+    # 分析时章节的消息数与正文字符数（chapter_stats），用于判断下一次何时触发
+    message_count = db.Column(db.Integer, nullable=False, default=0)
+    total_chars = db.Column(db.BigInteger, nullable=False, default=0)
+    update_time = db.Column(db.DateTime, default=datetime.utcnow)
@@ -0,0 +1,139 @@
+from datetime import date
+from flask.cli import with_appcontext
+from sqlalchemy import text
+from app.models import db
+import click
+import logging
+
+logger = logging.getLogger(__name__)
+
+# conversation_messages 的 PostgreSQL 声明式分区
+#
+# 表结构由 db.create_all() 创建，无法声明分区，因此提供一次性的转换命令，在维护窗口内执行：
+#   原表改名 -> 按原结构创建同名分区表 -> 复制数据 -> 建索引、序列归属改到新表 -> （可选）删除原表
+# 分区方式：
+#   hash   按 chapter_id 哈希分成 N 个分区，同一章节的消息落在同一分区，按章节读取只扫描一个分区
+#   range  按 create_time 每月一个分区，另有 DEFAULT 分区兜底；旧分区可整体 DETACH 后转储或删除
+# 分区表的主键必须包含分区键，数据库中的主键因此为 (chapter_id, id) / (id, create_time)，
+# ORM 映射仍以 id 为主键（id 由序列生成，保持唯一）。
+
+TABLE = 'conversation_messages'
+OLD_TABLE = 'conversation_messages_unpartitioned'
+INDEX = 'ix_conversation_messages_chapter_id_id'
+
+
+def _month(value):
+    return date(value.year, value.month, 1)
+
+
+def _next_month(value):
+    return date(value.year + value.month // 12, value.month % 12 + 1, 1)
+
+
+def month_partition(month):
+    """某月分区的建表语句"""
+    return (
+        f"CREATE TABLE IF NOT EXISTS {TABLE}_y{month.year}m{month.month:02d} PARTITION OF {TABLE} "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_next_month(month).isoformat()}')"
+    )
+
+
+def month_partitions(start, months):
+    """从 start 所在月起连续 months 个月的分区建表语句"""
+    month = _month(start)
+    statements = []
+    for _ in range(months):
+        statements.append(month_partition(month))
+        month = _next_month(month)
+    return statements
+
+
+def partition_statements(scheme, partitions=16, first_month=None, months_ahead=3, today=None):
+    """把 conversation_messages 转为分区表的全部语句"""
+    if scheme == 'hash':
+        partition_by, primary_key = 'HASH (chapter_id)', '(chapter_id, id)'
+    else:
+        partition_by, primary_key = 'RANGE (create_time)', '(id, create_time)'
+
+    statements = [
+        f"ALTER TABLE {TABLE} RENAME TO {OLD_TABLE}",
+        f"ALTER TABLE {OLD_TABLE} RENAME CONSTRAINT {TABLE}_pkey TO {OLD_TABLE}_pkey",
+        f"ALTER INDEX IF EXISTS {INDEX} RENAME TO ix_{OLD_TABLE}_chapter_id_id",
+        f"CREATE TABLE {TABLE} (LIKE {OLD_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) "
+        f"PARTITION BY {partition_by}",
+    ]
+    if scheme == 'hash':
+        statements += [
+            f"CREATE TABLE {TABLE}_p{remainder} PARTITION OF {TABLE} "
+            f"FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})"
+            for remainder in range(partitions)
+        ]
+    else:
+        # 分区键进入主键后不能为 NULL，缺失的创建时间按 1970-01-01 落入 DEFAULT 分区
+        today = today or date.today()
+        first_month = _month(first_month or today)
+        months = (today.year - first_month.year) * 12 + today.month - first_month.month + 1 + months_ahead
+        statements += month_partitions(first_month, months)
+        statements.append(f"CREATE TABLE {TABLE}_default PARTITION OF {TABLE} DEFAULT")
+        statements.append(f"UPDATE {OLD_TABLE} SET create_time = '1970-01-01' WHERE create_time IS NULL")
+        statements.append(f"ALTER TABLE {TABLE} ALTER COLUMN create_time SET NOT NULL")
+
+    statements += [
+        f"ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_pkey PRIMARY KEY {primary_key}",
+        f"ALTER TABLE {TABLE} ADD FOREIGN KEY (chapter_id) REFERENCES chapters (id)",
+        f"ALTER TABLE {TABLE} ADD FOREIGN KEY (user_id) REFERENCES users (id)",
+        f"INSERT INTO {TABLE} SELECT * FROM {OLD_TABLE}",
+    ]
+    if scheme == 'range':
+        # hash 分区的主键 (chapter_id, id) 已覆盖按章节读取
+        statements.append(f"CREATE INDEX {INDEX} ON {TABLE} (chapter_id, id)")
+    statements += [
+        f"ALTER SEQUENCE {TABLE}_id_seq OWNED BY {TABLE}.id",
+        f"ANALYZE {TABLE}",
+    ]
+    return statements
+
+
+def _require_postgresql():
+    if db.engine.dialect.name != 'postgresql':
+        raise click.ClickException('分区表只支持 PostgreSQL')
+
+
+@click.command('partition-messages')
+@click.option('--by', 'scheme', type=click.Choice(['hash', 'range']), default='hash', show_default=True,
+              help='hash：按 chapter_id 哈希；range：按 create_time 每月一个分区')
+@click.option('--partitions', default=16, show_default=True, help='hash 分区数')
+@click.option('--months-ahead', default=3, show_default=True, help='range 分区预先创建的未来月数')
+@click.option('--execute', is_flag=True, help='执行转换（默认只打印语句）')
+@click.option('--drop-old', is_flag=True, help='转换后删除原表')
+@with_appcontext
+def partition_messages_command(scheme, partitions, months_ahead, execute, drop_old):
+    """把 conversation_messages 转为分区表（在一个事务内完成，期间锁表，请在维护窗口执行）"""
+    _require_postgresql()
+    first_month = None
+    if scheme == 'range':
+        first_month = db.session.execute(text(f"SELECT min(create_time) FROM {TABLE}")).scalar()
+    statements = partition_statements(scheme, partitions, first_month, months_ahead)
+    if drop_old:
+        statements.append(f"DROP TABLE {OLD_TABLE}")
+    if not execute:
+        for statement in statements:
+            click.echo(statement + ';')
+        return
+    for statement in statements:
+        logger.info(statement)
+        db.session.execute(text(statement))
+    db.session.commit()
+    click.echo(f"{TABLE} 已转为 {scheme} 分区表")
+
+
+@click.command('extend-message-partitions')
+@click.option('--months-ahead', default=3, show_default=True, help='确保从本月起的未来若干月都有分区')
+@with_appcontext
+def extend_message_partitions_command(months_ahead):
+    """为按月分区的 conversation_messages 预先创建未来的月分区（可由定时任务每月执行）"""
+    _require_postgresql()
+    for statement in month_partitions(date.today(), months_ahead + 1):
+        db.session.execute(text(statement))
+    db.session.commit()
+    click.echo(f"已确保未来 {months_ahead} 个月的分区存在")
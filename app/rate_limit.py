@@ -0,0 +1,327 @@
+from flask import request, jsonify, make_response, current_app
+from flask_socketio import emit
+from app.config import Config
+from app.models import db, Chapter
+from app.routing import add_call_listener
+from contextvars import ContextVar
+from collections import OrderedDict
+from functools import wraps
+import math
+import threading
+import time
+import logging
+
+try:
+    import redis
+except ImportError:  # 共享存储后端为可选依赖
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# 当前请求的限流身份 (ip_key, user_key, world_key)，供 token 用量回调时扣减
+_current_identity = ContextVar('rate_limit_identity', default=None)
+
+
+class MemoryBucketBackend:
+    """进程内令牌桶存储，适用于单实例部署"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}  # key -> [tokens, updated_at]
+
+    def consume(self, key, capacity, rate, cost, allow_debt=False, dry_run=False):
+        """补充令牌后尝试扣减 cost，返回 (是否放行, 剩余令牌, 需等待秒数)
+
+        allow_debt=True 时无条件扣减（允许透支），用于请求结束后按实际 token 用量记账；
+        dry_run=True 时只检查是否足够，不扣减。
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated_at) * rate)
+            allowed = allow_debt or tokens >= cost
+            if dry_run:
+                return allowed, tokens, _retry_after(tokens, cost, rate, allowed)
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+        return allowed, tokens, _retry_after(tokens, cost, rate, allowed)
+
+
+class RedisBucketBackend:
+    """基于 Redis 的共享令牌桶，多实例部署时共用同一份配额"""
+
+    SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local allow_debt = tonumber(ARGV[4])
+local now = tonumber(ARGV[5])
+local dry_run = tonumber(ARGV[6])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(bucket[1]) or capacity
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * rate)
+local allowed = 0
+if allow_debt == 1 or tokens >= cost then
+  allowed = 1
+end
+if dry_run == 1 then
+  return {allowed, tostring(tokens)}
+end
+if allowed == 1 then
+  tokens = tokens - cost
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated_at', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) * 2 + 60)
+return {allowed, tostring(tokens)}
+"""
+
+    def __init__(self, url):
+        if redis is None:
+            raise RuntimeError("RATE_LIMIT_BACKEND=redis 需要安装 redis 包")
+        self._client = redis.Redis.from_url(url)
+        self._script = self._client.register_script(self.SCRIPT)
+
+    def consume(self, key, capacity, rate, cost, allow_debt=False, dry_run=False):
+        allowed, tokens = self._script(
+            keys=[f"ratelimit:{key}"],
+            args=[capacity, rate, cost, 1 if allow_debt else 0, time.time(), 1 if dry_run else 0]
+        )
+        allowed = bool(int(allowed))
+        tokens = float(tokens)
+        return allowed, tokens, _retry_after(tokens, cost, rate, allowed)
+
+
+def _retry_after(tokens, cost, rate, allowed):
+    if allowed or rate <= 0:
+        return 0
+    return max(0, (cost - tokens) / rate)
+
+
+SCOPES = ('ip', 'user', 'world')
+
+
+class RateLimiter:
+    """按客户端 IP、用户与世界三个维度限制请求速率（次/秒）与大模型 token 用量（个/分钟）"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        # (维度, 桶容量, 每秒补充速率)
+        self.request_limits = {
+            'ip': (Config.RATE_LIMIT_IP_BURST, Config.RATE_LIMIT_IP_RPS),
+            'user': (Config.RATE_LIMIT_USER_BURST, Config.RATE_LIMIT_USER_RPS),
+            'world': (Config.RATE_LIMIT_WORLD_BURST, Config.RATE_LIMIT_WORLD_RPS),
+        }
+        self.token_limits = {
+            'ip': (Config.RATE_LIMIT_IP_TOKENS_PER_MIN, Config.RATE_LIMIT_IP_TOKENS_PER_MIN / 60.0),
+            'user': (Config.RATE_LIMIT_USER_TOKENS_PER_MIN, Config.RATE_LIMIT_USER_TOKENS_PER_MIN / 60.0),
+            'world': (Config.RATE_LIMIT_WORLD_TOKENS_PER_MIN, Config.RATE_LIMIT_WORLD_TOKENS_PER_MIN / 60.0),
+        }
+
+    def _buckets(self, identity):
+        for scope, key in zip(SCOPES, identity):
+            if key is None:
+                continue
+            for kind, limits in (('req', self.request_limits), ('tok', self.token_limits)):
+                capacity, rate = limits[scope]
+                yield f"{kind}:{key}", capacity, rate
+
+    def admit(self, identity):
+        """请求准入：请求速率桶扣 1，token 桶需有余量；返回 RateLimitDecision
+
+        先检查全部桶，都有余量时才扣减，某一维度超限时不消耗其他维度的配额。
+        """
+        decision = RateLimitDecision()
+        buckets = list(self._buckets(identity))
+        for key, capacity, rate in buckets:
+            allowed, remaining, retry_after = self.backend.consume(key, capacity, rate, 1, dry_run=True)
+            if not allowed:
+                decision.update(allowed, capacity, remaining, retry_after)
+                return decision
+        for key, capacity, rate in buckets:
+            allowed, remaining, retry_after = self.backend.consume(key, capacity, rate, 1)
+            decision.update(allowed, capacity, remaining, retry_after)
+            if not allowed:
+                # 检查与扣减之间被并发请求耗尽，按超限处理
+                return decision
+        return decision
+
+    def charge(self, identity, tokens):
+        """请求完成后按实际 token 用量扣减（允许透支，透支部分在后续请求中体现为等待）"""
+        if not tokens:
+            return
+        for scope, key in zip(SCOPES, identity):
+            if key is None:
+                continue
+            capacity, rate = self.token_limits[scope]
+            self.backend.consume(f"tok:{key}", capacity, rate, tokens, allow_debt=True)
+
+
+class RateLimitDecision:
+    """准入结果，记录最紧的那个桶，用于生成 429 响应头"""
+
+    def __init__(self):
+        self.allowed = True
+        self.limit = None
+        self.remaining = None
+        self.retry_after = 0
+
+    def update(self, allowed, capacity, remaining, retry_after):
+        if self.remaining is None or remaining < self.remaining or not allowed:
+            self.limit = capacity
+            self.remaining = remaining
+        self.allowed = self.allowed and allowed
+        self.retry_after = max(self.retry_after, retry_after)
+
+    def headers(self):
+        if self.limit is None:
+            return {}
+        headers = {
+            'X-RateLimit-Limit': str(int(self.limit)),
+            'X-RateLimit-Remaining': str(max(0, int(self.remaining))),
+            'X-RateLimit-Reset': str(math.ceil(self.retry_after)),
+        }
+        if not self.allowed:
+            headers['Retry-After'] = str(max(1, math.ceil(self.retry_after)))
+        return headers
+
+
+def _create_backend():
+    if Config.RATE_LIMIT_BACKEND == 'redis':
+        return RedisBucketBackend(Config.RATE_LIMIT_REDIS_URL)
+    return MemoryBucketBackend()
+
+
+limiter = RateLimiter(_create_backend())
+
+
+class ChapterWorldCache:
+    """章节 -> 所属世界的小缓存（TTL + LRU）；查不到的章节不缓存，章节创建后即可按世界限流"""
+
+    def __init__(self, ttl=300, max_entries=4096):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # chapter_id -> (expires_at, world_id)
+
+    def get(self, chapter_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(chapter_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(chapter_id)
+                return entry[1]
+        world_id = db.session.query(Chapter.world_id).filter(Chapter.id == chapter_id).scalar()
+        if world_id is not None:
+            with self._lock:
+                self._entries[chapter_id] = (now + self.ttl, world_id)
+                self._entries.move_to_end(chapter_id)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return world_id
+
+
+def _world_of_chapter(chapter_id):
+    # 缓存随应用实例（及其数据库）存在，不跨应用共享
+    cache = current_app.extensions.get('rate_limit_chapter_worlds')
+    if cache is None:
+        cache = current_app.extensions.setdefault('rate_limit_chapter_worlds', ChapterWorldCache())
+    return cache.get(chapter_id)
+
+
+def _identify(data):
+    """从请求参数中提取限流身份：客户端 IP（始终计入）、用户与世界
+
+    userId 由客户端提供，每次换一个即可绕过用户桶，因此 IP 桶始终生效，用户桶叠加其上。
+    """
+    ip_key = f"ip:{request.remote_addr}"
+    user_id = data.get("userId") or data.get("user_id")
+    user_key = f"user:{user_id}" if user_id else None
+
+    world_id = data.get("worldId") or data.get("world_id")
+    chapter_id = data.get("chapterId") or data.get("chapter_id")
+    if not world_id and chapter_id:
+        try:
+            world_id = _world_of_chapter(int(chapter_id))
+        except Exception as e:
+            logger.error(f"限流查询章节所属世界失败: {str(e)}")
+    world_key = f"world:{world_id}" if world_id else None
+    return ip_key, user_key, world_key
+
+
+def rate_limited(error_event=None):
+    """大模型接口的统一准入控制，REST 视图与 Socket.IO 事件处理器均可使用
+
+    - REST：超限时返回 429 及 Retry-After / X-RateLimit-* 响应头，放行时同样附带 X-RateLimit-* 头
+    - Socket.IO：超限时向客户端发送 error_event 事件（含 retry_after）
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if not Config.RATE_LIMIT_ENABLED:
+                return f(*args, **kwargs)
+
+            is_socket = hasattr(request, 'sid')
+            if is_socket:
+                data = args[0] if args and isinstance(args[0], dict) else {}
+            else:
+                data = request.get_json(silent=True) or {}
+
+            identity = _identify(data)
+            decision = limiter.admit(identity)
+            if not decision.allowed:
+                logger.warning(f"请求被限流 - {f.__name__}, identity: {identity}")
+                if is_socket:
+                    if error_event:
+                        emit(error_event, {
+                            'error': '请求过于频繁，请稍后再试',
+                            'retry_after': math.ceil(decision.retry_after)
+                        })
+                    return None
+                response = jsonify({'error': '请求过于频繁，请稍后再试'})
+                response.status_code = 429
+                response.headers.update(decision.headers())
+                return response
+
+            token = _current_identity.set(identity)
+            try:
+                result = f(*args, **kwargs)
+            finally:
+                _current_identity.reset(token)
+
+            if is_socket:
+                return result
+            response = make_response(result)
+            response.headers.update(decision.headers())
+            return response
+        return wrapper
+    return decorator
+
+
+def bind_identity(f):
+    """把当前请求的限流身份带到后台线程池：返回的函数执行期间的大模型 token 用量计入该身份的配额
+
+    线程池中的任务不继承提交时的 ContextVar，代用户发起的后台调用（回复建议预取、自动剧情分析）需在提交时绑定。
+    """
+    identity = _current_identity.get()
+    if identity is None:
+        return f
+
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        token = _current_identity.set(identity)
+        try:
+            return f(*args, **kwargs)
+        finally:
+            _current_identity.reset(token)
+    return wrapper
+
+
+def _charge_usage(stats):
+    identity = _current_identity.get()
+    if identity is not None:
+        limiter.charge(identity, stats.prompt_tokens + stats.completion_tokens)
+
+
+add_call_listener(_charge_usage)
@@ -1,225 +1,235 @@
-from flask import Blueprint, request, jsonify
-from app.models import db, World, Chapter, ConversationMessage, NovelRecord, UserWorld, WorldCharacter, User
+from flask import Blueprint, request, jsonify, current_app, abort, make_response, stream_with_context, g
+from app.models import (
+    db, World, Chapter, ConversationMessage, NovelRecord, UserWorld, WorldCharacter, User, ChapterStats, WorldStats,
+    ChapterAnalysis
+)
+from app.suggestions import prefetcher
+from app.database import route_reads_to_replica
+from app.export import ndjson_response, chapter_records, world_records, novel_records
+from app.bundle import export_bundle, import_bundle, BundleError
+from app.forks import visible_rows, message_visible, fork_chapter, latest_message_id, truncate_history, detach_forks
+from app.archive import forget_archives
+from app.analysis import latest_analysis
+from app.worlds import fork_world, world_lineage
+from app.dashboard import (
+    DASHBOARD_WORLD_FIELDS, dashboard_cache, cached_dashboard, request_dashboard_users, invalidate_dashboards
+)
+from app.batch import BatchError, parse_batch, run_batch
+from app.stats import (
+    StatsOptions, record_message, record_novel, refresh_chapters, refresh_worlds, forget_chapters, forget_world
+)
+from app.content import split_body
+from app.serializers import (
+    json_response, serialize_worlds, characters_by_world, Projection, allowed_fields,
+    WORLD, WORLD_CHARACTER, CHAPTER, MESSAGE, NOVEL, USER_WORLD, WORLD_FIELDS
+)
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
+import shutil
+import tempfile
 
 db_bp = Blueprint('db', __name__, url_prefix='/api/db')
 
-# 1. 获取全部的World信息
+# 读写分离：GET 请求读只读副本（配置了 DATABASE_REPLICA_URLS 时）
+@db_bp.before_request
+def select_read_replica():
+    route_reads_to_replica(current_app)
+
+# 用户首页聚合的按用户缓存：成功的写请求使相关用户（发起者、涉及世界的创建者与成员）的缓存失效；
+# 受影响的用户在写操作之前查出（删除世界会一并删除成员记录）
+@db_bp.before_request
+def collect_dashboard_users():
+    if request.method != 'GET':
+        g.dashboard_users = request_dashboard_users()
+
+@db_bp.after_request
+def invalidate_dashboard(response):
+    users = g.pop('dashboard_users', None)
+    if users and response.status_code < 400:
+        invalidate_dashboards(users)
+    return response
+
+# 字段投影：GET 接口支持 ?fields=a,b 或 ?exclude=a,b，未请求的列不会出现在 SELECT 中
+CHAPTER_FIELDS = allowed_fields(CHAPTER)
+CHAPTER_DETAIL_FIELDS = allowed_fields(
+    CHAPTER, extra=('worldview', 'master_sitting'), nested={'main_characters': WORLD_CHARACTER}
+)
+MESSAGE_FIELDS = allowed_fields(MESSAGE)
+NOVEL_FIELDS = allowed_fields(NOVEL)
+NOVEL_LIST_FIELDS = allowed_fields(NOVEL, extra=('chapter_name', 'world_name', 'world_id'))
+USER_WORLD_FIELDS = allowed_fields(USER_WORLD)
+
+def parse_projection(allowed):
+    try:
+        return Projection.from_request(request.args, allowed)
+    except ValueError as e:
+        abort(make_response(jsonify({'error': str(e)}), 400))
+
+def parse_stats_options(model):
+    try:
+        return StatsOptions.from_request(request.args, model)
+    except ValueError as e:
+        abort(make_response(jsonify({'error': str(e)}), 400))
+
+# 1. 获取全部的World信息（支持按统计排序、过滤：sort_by / min_messages / active_since / stats=true）
 @db_bp.route('/worlds', methods=['GET'])
 def get_all_worlds():
+    projection = parse_projection(WORLD_FIELDS)
+    stats = parse_stats_options(WorldStats)
+    only = WORLD.project(projection)
     try:
-        worlds = World.query.all()
-        result = []
-        for world in worlds:
-            # 加载并返回世界角色
-            characters = [
-                {
-                    'name': c.name,
-                    'background': c.background
-                } for c in world.characters
-            ]
-            result.append({
-                'id': world.id,
-                'user_id': world.user_id,
-                'name': world.name,
-                'tags': world.tags,
-                'is_public': world.is_public,
-                'worldview': world.worldview,
-                'master_setting': world.master_setting,
-                'origin_world_id': world.origin_world_id,
-                'create_time': world.create_time.isoformat(),
-                'popularity': world.popularity,
-                'main_characters': characters
-            })
-        return jsonify(result)
+        # 直接序列化行元组，角色一次批量查询
+        rows = db.session.execute(stats.apply(WORLD.select(only), World.id, (World.id,))).all()
+        fixed = len(WORLD.columns(only))
+        return json_response(stats.attach(serialize_worlds([row[:fixed] for row in rows], projection), rows))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 # 新增：按ID获取单个World详情（含角色）
 @db_bp.route('/worlds/<int:world_id>', methods=['GET'])
 def get_world_detail(world_id):
+    projection = parse_projection(WORLD_FIELDS)
     try:
-        world = World.query.get(world_id)
-        if world is None:
+        rows = db.session.execute(WORLD.select(WORLD.project(projection)).where(World.id == world_id)).all()
+        if not rows:
             return jsonify({'error': '世界不存在'}), 404
-        characters = [{'name': c.name, 'background': c.background} for c in world.characters]
-        return jsonify({
-            'id': world.id,
-            'user_id': world.user_id,
-            'name': world.name,
-            'tags': world.tags,
-            'is_public': world.is_public,
-            'worldview': world.worldview,
-            'master_setting': world.master_setting,
-            'origin_world_id': world.origin_world_id,
-            'create_time': world.create_time.isoformat(),
-            'popularity': world.popularity,
-            'main_characters': characters
-        })
+        return json_response(serialize_worlds(rows, projection)[0])
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-# 2. 获取指定World和creator_user_id对应的全部Chapter信息
+# 2. 获取指定World和creator_user_id对应的全部Chapter信息（同样支持统计排序、过滤）
 @db_bp.route('/worlds/<int:world_id>/chapters', methods=['GET'])
 def get_chapters_by_world_and_creator(world_id):
+    projection = parse_projection(CHAPTER_FIELDS)
+    stats = parse_stats_options(ChapterStats)
+    only = CHAPTER.project(projection)
     try:
         creator_user_id = request.args.get('creator_user_id', type=int)
-        if not creator_user_id:
-            # 如果没有提供creator_user_id，获取该世界下的所有章节
-            chapters = Chapter.query.filter_by(world_id=world_id).all()
-        else:
-            # 如果提供了creator_user_id，按原逻辑过滤
-            chapters = Chapter.query.filter_by(
-                world_id=world_id,
-                creator_user_id=creator_user_id
-            ).all()
-        
-        result = [
-            {
-                'id': chapter.id,
-                'world_id': chapter.world_id,
-                'creator_user_id': chapter.creator_user_id,
-                'name': chapter.name,
-                'opening': chapter.opening,
-                'background': chapter.background,
-                'is_default': chapter.is_default,
-                'origin_chapter_id': chapter.origin_chapter_id,
-                'create_time': chapter.create_time.isoformat() if hasattr(chapter.create_time, 'isoformat') else chapter.create_time
-            } for chapter in chapters
-        ]
-        return jsonify(result)
+        query = CHAPTER.select(only).where(Chapter.world_id == world_id)
+        if creator_user_id:
+            # 如果提供了creator_user_id，按原逻辑过滤；否则获取该世界下的所有章节
+            query = query.where(Chapter.creator_user_id == creator_user_id)
+        rows = db.session.execute(stats.apply(query, Chapter.id, (Chapter.id,))).all()
+        return json_response(stats.attach(CHAPTER.from_rows(rows, only), rows))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 # 新增：按ID获取单个Chapter详情（供前端拉取background与world_id）
 @db_bp.route('/chapters/<int:chapter_id>', methods=['GET'])
 def get_chapter_detail(chapter_id):
+    projection = parse_projection(CHAPTER_DETAIL_FIELDS)
+    only = CHAPTER.project(projection)
+    # 新增字段（来自 World）；前端使用 master_sitting，这里从 world.master_setting 做映射
+    world_columns = [
+        (key, column) for key, column in (('worldview', World.worldview), ('master_sitting', World.master_setting))
+        if projection.includes(key)
+    ]
     try:
-        chapter = Chapter.query.get(chapter_id)
-        if chapter is None:
+        query = CHAPTER.select(only).add_columns(Chapter.world_id, *(column for _, column in world_columns))
+        if world_columns:
+            query = query.outerjoin(World, World.id == Chapter.world_id)
+        row = db.session.execute(query.where(Chapter.id == chapter_id)).first()
+        if row is None:
             return jsonify({'error': '章节不存在'}), 404
 
-        # 新增：加载所属世界并返回世界相关上下文字段
-        world = World.query.get(chapter.world_id) if chapter.world_id else None
-
-        return jsonify({
-            'id': chapter.id,
-            'world_id': chapter.world_id,
-            'creator_user_id': chapter.creator_user_id,
-            'name': chapter.name,
-            'opening': chapter.opening,
-            'background': chapter.background,
-            'is_default': chapter.is_default,
-            'origin_chapter_id': chapter.origin_chapter_id,
-            'create_time': chapter.create_time.isoformat() if hasattr(chapter.create_time, 'isoformat') else chapter.create_time,
-            # 新增字段（来自 World）
-            'worldview': (world.worldview if world else None),
-            # 前端使用 master_sitting，这里从 world.master_setting 做映射
-            'master_sitting': (world.master_setting if world else None),
-            'main_characters': ([{'name': c.name, 'background': c.background} for c in world.characters] if world else [])
-        })
+        fixed = len(CHAPTER.columns(only))
+        result = CHAPTER.from_rows([row], only)[0]
+        for index, (key, _) in enumerate(world_columns):
+            result[key] = row[fixed + 1 + index]
+        if projection.includes('main_characters'):
+            world_id = row[fixed]
+            result['main_characters'] = (
+                characters_by_world([world_id], projection.nested('main_characters'))[world_id] if world_id else []
+            )
+        return json_response(result)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-# 3. 获取指定chapter_id对应的全部ConversationMessage信息
+# 3. 获取指定chapter_id对应的全部ConversationMessage信息（分支章节包含继承自父章节的消息）
 @db_bp.route('/chapters/<int:chapter_id>/messages', methods=['GET'])
 def get_messages_by_chapter(chapter_id):
+    projection = parse_projection(MESSAGE_FIELDS)
+    only = MESSAGE.project(projection)
     try:
-        messages = ConversationMessage.query.filter_by(chapter_id=chapter_id).order_by(
-            ConversationMessage.create_time
-        ).all()
-        
-        result = [
-            {
-                'id': msg.id,
-                'chapter_id': msg.chapter_id,
-                'user_id': msg.user_id,
-                'role': msg.role,
-                'content': msg.content,
-                'create_time': msg.create_time.isoformat()
-            } for msg in messages
-        ]
-        return jsonify(result)
+        # 含已归档（冷表）的消息
+        rows = visible_rows(chapter_id, MESSAGE.columns(only))
+        return json_response(MESSAGE.from_rows(rows, only))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# 章节最新一次的自动剧情分析（回溯删除了分析覆盖的消息后返回 404）
+@db_bp.route('/chapters/<int:chapter_id>/analysis', methods=['GET'])
+def get_chapter_analysis(chapter_id):
+    try:
+        analysis = latest_analysis(chapter_id)
+        if analysis is None:
+            return jsonify({'error': '暂无剧情分析'}), 404
+        return json_response({'chapter_id': chapter_id, 'analysis': analysis})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 # 新增：获取所有NovelRecord信息（小说集功能）
 @db_bp.route('/novels', methods=['GET'])
 def get_all_novels():
+    projection = parse_projection(NOVEL_LIST_FIELDS)
+    only = NOVEL.project(projection)
+    with_chapter = projection.includes('chapter_name')
+    with_world = projection.includes('world_name') or projection.includes('world_id')
     try:
         # 获取查询参数，支持按用户ID筛选和排序方式
         user_id = request.args.get('user_id', type=int)
         sort_by = request.args.get('sort_by', 'create_time')  # 默认为按创建时间排序
         
-        query = NovelRecord.query
+        # 关联的章节与世界信息（可选，用于显示更多上下文）一并联表查询；投影中不需要时不联表
+        query = NOVEL.select(only)
+        if with_chapter or with_world:
+            query = query.add_columns(Chapter.name, World.name, World.id).outerjoin(
+                Chapter, Chapter.id == NovelRecord.chapter_id
+            ).outerjoin(World, World.id == Chapter.world_id)
         
         if user_id:
-            query = query.filter_by(user_id=user_id)
+            query = query.where(NovelRecord.user_id == user_id)
         
         # 根据排序参数进行排序
         if sort_by == 'popularity':
-            novels = query.order_by(NovelRecord.popularity.desc()).all()
+            query = query.order_by(NovelRecord.popularity.desc())
         else:
             # 默认为按创建时间倒序排列
-            novels = query.order_by(NovelRecord.create_time.desc()).all()
+            query = query.order_by(NovelRecord.create_time.desc())
         
-        result = []
-        for novel in novels:
-            # 获取关联的章节信息（可选，用于显示更多上下文）
-            chapter = Chapter.query.get(novel.chapter_id)
-            world = World.query.get(chapter.world_id) if chapter else None
-            
-            novel_data = {
-                'id': novel.id,
-                'chapter_id': novel.chapter_id,
-                'user_id': novel.user_id,
-                'title': novel.title,
-                'content': novel.content,
-                'create_time': novel.create_time.isoformat(),
-                'popularity': novel.popularity or 0
-            }
-            
-            # 添加关联信息（如果存在）
-            if chapter:
-                novel_data['chapter_name'] = chapter.name
-            if world:
-                novel_data['world_name'] = world.name
-                novel_data['world_id'] = world.id
-            
-            result.append(novel_data)
+        rows = db.session.execute(query).all()
+        result = NOVEL.from_rows(rows, only)
+        if with_chapter or with_world:
+            for novel_data, row in zip(result, rows):
+                chapter_name, world_name, world_id = row[-3:]
+                # 添加关联信息（如果存在）
+                if with_chapter and chapter_name is not None:
+                    novel_data['chapter_name'] = chapter_name
+                if world_id is not None:
+                    if projection.includes('world_name'):
+                        novel_data['world_name'] = world_name
+                    if projection.includes('world_id'):
+                        novel_data['world_id'] = world_id
         
-        return jsonify(result)
+        return json_response(result)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 @db_bp.route('/chapters/<int:chapter_id>/novels', methods=['GET'])
 def get_novels_by_chapter(chapter_id):
+    projection = parse_projection(NOVEL_FIELDS)
+    only = NOVEL.project(projection)
     try:
         # 获取排序参数
         sort_by = request.args.get('sort_by', 'create_time')
         
         # 根据排序参数进行排序
+        query = NOVEL.select(only).where(NovelRecord.chapter_id == chapter_id)
         if sort_by == 'popularity':
-            novels = NovelRecord.query.filter_by(chapter_id=chapter_id).order_by(
-                NovelRecord.popularity.desc()
-            ).all()
+            query = query.order_by(NovelRecord.popularity.desc())
         else:
-            novels = NovelRecord.query.filter_by(chapter_id=chapter_id).order_by(
-                NovelRecord.create_time.desc()
-            ).all()
+            query = query.order_by(NovelRecord.create_time.desc())
         
-        result = [
-            {
-                'id': novel.id,
-                'chapter_id': novel.chapter_id,
-                'user_id': novel.user_id,
-                'title': novel.title,
-                'content': novel.content,
-                'create_time': novel.create_time.isoformat(),
-                'popularity': novel.popularity or 0
-            } for novel in novels
-        ]
-        return jsonify(result)
+        return json_response(NOVEL.from_rows(db.session.execute(query), only))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -255,26 +265,44 @@ def create_novel(chapter_id):
         )
 
         db.session.add(novel)
+        db.session.flush()
+        record_novel(novel)
         db.session.commit()
 
         # 返回创建的记录
-        return jsonify({
-            'id': novel.id,
-            'chapter_id': novel.chapter_id,
-            'user_id': novel.user_id,
-            'title': novel.title,
-            'content': novel.content,
-            'create_time': novel.create_time.isoformat(),
-            'popularity': novel.popularity or 0
-        }), 201
+        return json_response(NOVEL.from_object(novel), 201)
 
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+# 批量请求：一次执行多个 GET 子请求，结果按顺序流式返回
+@db_bp.route('/batch', methods=['POST'], endpoint='batch')
+def batch_requests():
+    try:
+        paths = parse_batch(request.get_json(silent=True), current_app.config.get('BATCH_MAX_REQUESTS', 20))
+    except BatchError as e:
+        return jsonify({'error': str(e)}), 400
+    return current_app.response_class(stream_with_context(run_batch(paths)), mimetype='application/json')
+
+# 用户首页聚合：按角色分组的世界（含角色与章节摘要）与最近的小说，一次请求返回
+@db_bp.route('/users/<int:user_id>/dashboard', methods=['GET'])
+def get_user_dashboard(user_id):
+    projection = parse_projection(DASHBOARD_WORLD_FIELDS)
+    novel_limit = min(request.args.get('novel_limit', 20, type=int), 100)
+    try:
+        body, hit = cached_dashboard(dashboard_cache, user_id, projection, novel_limit)
+        response = current_app.response_class(body, mimetype='application/json')
+        response.headers['X-Cache'] = 'HIT' if hit else 'MISS'
+        return response
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 # 5. 获取指定user_id和role对应的全部UserWorld信息
 @db_bp.route('/user-worlds', methods=['GET'])
 def get_user_worlds_by_user_and_role():
+    projection = parse_projection(USER_WORLD_FIELDS)
+    only = USER_WORLD.project(projection)
     try:
         user_id = request.args.get('user_id', type=int)
         role = request.args.get('role')
@@ -285,24 +313,95 @@ def get_user_worlds_by_user_and_role():
         if role not in ['creator', 'participant', 'viewer']:
             return jsonify({'error': '无效的role值'}), 400
             
-        user_worlds = UserWorld.query.filter_by(
-            user_id=user_id,
-            role=role
-        ).all()
-        
-        result = [
-            {
-                'id': uw.id,
-                'user_id': uw.user_id,
-                'world_id': uw.world_id,
-                'role': uw.role,
-                'create_time': uw.create_time.isoformat()
-            } for uw in user_worlds
-        ]
-        return jsonify(result)
+        rows = db.session.execute(
+            USER_WORLD.select(only).where(UserWorld.user_id == user_id, UserWorld.role == role)
+        )
+        return json_response(USER_WORLD.from_rows(rows, only))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# 流式导出（NDJSON）：?gzip=true 时即时压缩为 .ndjson.gz
+def _export_options():
+    gzip = request.args.get('gzip', 'false').lower() in ('1', 'true')
+    return current_app.config.get('EXPORT_BATCH_SIZE', 1000), gzip, current_app.config.get('EXPORT_GZIP_LEVEL', 6)
+
+@db_bp.route('/chapters/<int:chapter_id>/export', methods=['GET'])
+def export_chapter(chapter_id):
+    try:
+        row = db.session.execute(CHAPTER.select().where(Chapter.id == chapter_id)).first()
+        if row is None:
+            return jsonify({'error': '章节不存在'}), 404
+        batch_size, gzip, level = _export_options()
+        records = chapter_records(CHAPTER.from_rows([row])[0], batch_size)
+        return ndjson_response(records, f"chapter-{chapter_id}", gzip, level)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@db_bp.route('/worlds/<int:world_id>/export', methods=['GET'])
+def export_world(world_id):
+    try:
+        rows = db.session.execute(WORLD.select().where(World.id == world_id)).all()
+        if not rows:
+            return jsonify({'error': '世界不存在'}), 404
+        batch_size, gzip, level = _export_options()
+        records = world_records(serialize_worlds(rows)[0], batch_size)
+        return ndjson_response(records, f"world-{world_id}", gzip, level)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# 世界包（zip）：导出整个世界，或导入为新世界
+@db_bp.route('/worlds/<int:world_id>/bundle', methods=['GET'])
+def export_world_bundle(world_id):
+    try:
+        rows = db.session.execute(WORLD.select().where(World.id == world_id)).all()
+        if not rows:
+            return jsonify({'error': '世界不存在'}), 404
+        batch_size, _, level = _export_options()
+        response = current_app.response_class(
+            stream_with_context(export_bundle(WORLD.from_rows(rows)[0], batch_size, level)), mimetype='application/zip'
+        )
+        response.headers['Content-Disposition'] = f'attachment; filename="world-{world_id}.zip"'
+        return response
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@db_bp.route('/worlds/import', methods=['POST'])
+def import_world_bundle():
+    # 世界包以 multipart 的 bundle 字段上传，或直接作为请求体（application/zip）
+    user_id = request.args.get('user_id', type=int) or request.form.get('user_id', type=int)
+    if not user_id:
+        return jsonify({'error': '缺少user_id参数'}), 400
+    if db.session.get(User, user_id) is None:
+        return jsonify({'error': '用户不存在'}), 404
+
+    with tempfile.TemporaryFile() as upload:
+        source = request.files.get('bundle')
+        shutil.copyfileobj(source.stream if source else request.stream, upload)
+        upload.seek(0)
+        try:
+            world_id, counts = import_bundle(
+                upload, user_id, current_app.config.get('EXPORT_BATCH_SIZE', 1000),
+                current_app.config.get('BUNDLE_USE_COPY', True)
+            )
+            db.session.commit()
+        except BundleError as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 400
+        except Exception as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 500
+
+    rows = db.session.execute(WORLD.select().where(World.id == world_id)).all()
+    return json_response({'world': serialize_worlds(rows)[0], 'counts': counts}, 201)
+
+@db_bp.route('/novels/export', methods=['GET'])
+def export_novels():
+    user_id = request.args.get('user_id', type=int)
+    if not user_id:
+        return jsonify({'error': '缺少user_id参数'}), 400
+    batch_size, gzip, level = _export_options()
+    return ndjson_response(novel_records(user_id, batch_size), f"novels-user-{user_id}", gzip, level)
+
 # 6. 注册或登录（POST）
 @db_bp.route('/auth', methods=['POST'])
 def register_or_login():
@@ -358,21 +457,9 @@ def create_world():
             db.session.add(wc)
 
     db.session.commit()
-    return jsonify({
-        'id': world.id,
-        'user_id': world.user_id,
-        'name': world.name,
-        'tags': world.tags,
-        'is_public': world.is_public,
-        'worldview': world.worldview,
-        'master_setting': world.master_setting,
-        'main_characters': [
-            {'name': c.name, 'background': c.background} for c in world.characters
-        ],
-        'origin_world_id': world.origin_world_id,
-        'create_time': world.create_time.isoformat() if world.create_time else None,
-        'popularity': world.popularity
-    }), 201
+    result = WORLD.from_object(world)
+    result['main_characters'] = WORLD_CHARACTER.from_objects(world.characters)
+    return json_response(result, 201)
 
 @db_bp.route('/chapters', methods=['POST'])
 def create_chapter():
@@ -388,18 +475,43 @@ def create_chapter():
         create_time=data.get('create_time'),
     )
     db.session.add(chapter)
+    db.session.flush()
+    refresh_worlds([chapter.world_id])
     db.session.commit()
-    return jsonify({
-        'id': chapter.id,
-        'world_id': chapter.world_id,
-        'creator_user_id': chapter.creator_user_id,
-        'name': chapter.name,
-        'opening': chapter.opening,
-        'background': chapter.background,
-        'is_default': chapter.is_default,
-        'origin_chapter_id': chapter.origin_chapter_id,
-        'create_time': chapter.create_time.isoformat() if hasattr(chapter.create_time, 'isoformat') else chapter.create_time
-    }), 201
+    return json_response(CHAPTER.from_object(chapter), 201)
+
+# 从指定消息处创建章节分支，共享此前的对话记录而不复制
+@db_bp.route('/chapters/<int:chapter_id>/fork', methods=['POST'])
+def create_chapter_fork(chapter_id):
+    try:
+        data = request.get_json(silent=True) or request.form
+        creator_user_id = data.get('creator_user_id') or data.get('user_id')
+        if not creator_user_id:
+            return jsonify({'error': '缺少creator_user_id参数'}), 400
+
+        source = db.session.get(Chapter, chapter_id)
+        if source is None:
+            return jsonify({'error': '章节不存在'}), 404
+
+        # 未指定分支点时从最新一条消息处分支
+        message_id = data.get('message_id')
+        if message_id is None:
+            message_id = latest_message_id(chapter_id) or 0
+        else:
+            message_id = int(message_id)
+            if not message_visible(chapter_id, message_id):
+                return jsonify({'error': '分支点消息不属于该章节'}), 400
+
+        chapter = fork_chapter(
+            source, message_id, creator_user_id,
+            name=data.get('name'), opening=data.get('opening'), background=data.get('background')
+        )
+        refresh_chapters([chapter.id])
+        db.session.commit()
+        return json_response(CHAPTER.from_object(chapter), 201)
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
 
 @db_bp.route('/chapters/<int:chapter_id>/messages', methods=['POST'])
 def create_message(chapter_id):
@@ -416,28 +528,29 @@ def create_message(chapter_id):
         if data['role'] not in ['user', 'ai']:
             return jsonify({'error': 'role必须为"user"或"ai"'}), 400
 
-        # 构建消息对象
+        # 构建消息对象（AI 正文的“正文：”前缀存为标记位）
+        content, flags = split_body(data['content'], data['role'])
         message = ConversationMessage(
             chapter_id=chapter_id,
             user_id=data['user_id'],
             role=data['role'],
-            content=data['content'],
+            content=content,
+            flags=flags,
             # 若未提供create_time则使用当前时间
             create_time=datetime.fromisoformat(data['create_time']) if 'create_time' in data else datetime.utcnow()
         )
         
         db.session.add(message)
+        db.session.flush()
+        record_message(message)
         db.session.commit()
+
+        # 用户抢先回复时取消该章节的建议预取
+        if message.role == 'user':
+            prefetcher.cancel(chapter_id)
         
         # 返回创建的消息详情
-        return jsonify({
-            'id': message.id,
-            'chapter_id': message.chapter_id,
-            'user_id': message.user_id,
-            'role': message.role,
-            'content': message.content,
-            'create_time': message.create_time.isoformat()
-        }), 201
+        return json_response(MESSAGE.from_object(message), 201)
         
     except ValueError as ve:
         # 处理时间格式错误
@@ -460,11 +573,11 @@ def delete_messages(chapter_id):
         if not message_id:
             return jsonify({'error': '缺少id参数'}), 400
         
-        # 查询并删除符合条件的消息（同章节且id >= 给定id）
-        deleted_count = ConversationMessage.query.filter(
-            ConversationMessage.chapter_id == chapter_id,
-            ConversationMessage.id >= message_id
-        ).delete(synchronize_session=False)
+        # 查询并删除符合条件的消息（同章节且id >= 给定id）；共享这些消息的分支先物化
+        chapter = db.session.get(Chapter, chapter_id)
+        deleted_count = truncate_history(chapter, message_id) if chapter is not None else 0
+        if chapter is not None:
+            refresh_chapters([chapter_id])
         
         db.session.commit()
         
@@ -487,16 +600,27 @@ def delete_chapter(chapter_id):
         if chapter is None:
             return jsonify({'error': '章节不存在'}), 404
 
+        # 从本章节分出的分支先物化，分支记录不再指向本章节
+        detach_forks(chapter_id)
+        Chapter.query.filter(Chapter.origin_chapter_id == chapter_id).update(
+            {'origin_chapter_id': None}, synchronize_session=False
+        )
+
         # 先删除该章节下的消息与小说（避免外键约束冲突）
         deleted_messages = ConversationMessage.query.filter(
             ConversationMessage.chapter_id == chapter_id
-        ).delete(synchronize_session=False)
+        ).delete(synchronize_session=False) + forget_archives([chapter_id])
         deleted_novels = NovelRecord.query.filter(
             NovelRecord.chapter_id == chapter_id
         ).delete(synchronize_session=False)
 
-        # 删除章节本身
+        # 删除章节本身及其统计、自动分析，所在世界的统计重新汇总
+        world_id = chapter.world_id
+        forget_chapters([chapter_id])
+        ChapterAnalysis.query.filter(ChapterAnalysis.chapter_id == chapter_id).delete(synchronize_session=False)
         db.session.delete(chapter)
+        db.session.flush()
+        refresh_worlds([world_id])
         db.session.commit()
 
         return jsonify({
@@ -544,13 +668,7 @@ def create_user_world():
         db.session.add(uw)
         db.session.commit()
 
-        return jsonify({
-            'id': uw.id,
-            'user_id': uw.user_id,
-            'world_id': uw.world_id,
-            'role': uw.role,
-            'create_time': uw.create_time.isoformat()
-        }), 201
+        return json_response(USER_WORLD.from_object(uw), 201)
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -599,6 +717,41 @@ def increase_novel_popularity(novel_id):
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+# 服务端克隆世界（角色与默认章节），新世界记录来源世界
+@db_bp.route('/worlds/<int:world_id>/fork', methods=['POST'])
+def fork_world_endpoint(world_id):
+    data = request.get_json(silent=True) or request.form
+    user_id = data.get('user_id')
+    if not user_id:
+        return jsonify({'error': '缺少user_id参数'}), 400
+    try:
+        source = db.session.execute(
+            db.select(World.user_id, World.is_public).where(World.id == world_id)
+        ).first()
+        if source is None:
+            return jsonify({'error': '世界不存在'}), 404
+        # 只能克隆公开世界或自己的世界
+        if not source.is_public and source.user_id != int(user_id):
+            return jsonify({'error': '无权克隆该世界'}), 403
+        is_public = data.get('is_public', False)
+        if isinstance(is_public, str):
+            is_public = is_public.lower() in ('1', 'true')
+        return jsonify(fork_world(world_id, user_id, name=data.get('name'), is_public=is_public)), 201
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+# 世界谱系：来源链与全部派生世界
+@db_bp.route('/worlds/<int:world_id>/lineage', methods=['GET'])
+def get_world_lineage(world_id):
+    try:
+        if db.session.get(World, world_id) is None:
+            return jsonify({'error': '世界不存在'}), 404
+        limit = min(request.args.get('limit', 100, type=int), 1000)
+        return json_response(world_lineage(world_id, limit))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 # 删除世界及其所有相关数据
 @db_bp.route('/worlds/<int:world_id>', methods=['DELETE'])
 def delete_world(world_id):
@@ -626,16 +779,29 @@ def delete_world(world_id):
                 NovelRecord.chapter_id == chapter_id
             ).delete(synchronize_session=False)
         
-        # 3. 删除所有章节
+        deleted_messages += forget_archives(chapter_ids)
+
+        # 3. 其他世界中从本世界克隆的章节、派生世界不再指向本世界（批量更新，避免逐个加载 derived_worlds）
+        Chapter.query.filter(
+            Chapter.origin_chapter_id.in_(chapter_ids), Chapter.world_id != world_id
+        ).update({'origin_chapter_id': None}, synchronize_session=False)
+        World.query.filter(World.origin_world_id == world_id).update(
+            {'origin_world_id': None}, synchronize_session=False
+        )
+
+        # 4. 删除统计、自动分析与所有章节
+        forget_world(world_id)
+        if chapter_ids:
+            ChapterAnalysis.query.filter(ChapterAnalysis.chapter_id.in_(chapter_ids)).delete(synchronize_session=False)
         deleted_chapters = Chapter.query.filter_by(world_id=world_id).delete(synchronize_session=False)
         
-        # 4. 删除用户与世界的关系记录
+        # 5. 删除用户与世界的关系记录
         deleted_user_worlds = UserWorld.query.filter_by(world_id=world_id).delete(synchronize_session=False)
         
-        # 5. 删除世界角色
+        # 6. 删除世界角色
         deleted_characters = WorldCharacter.query.filter_by(world_id=world_id).delete(synchronize_session=False)
         
-        # 6. 最后删除世界本身
+        # 7. 最后删除世界本身
         db.session.delete(world)
         db.session.commit()
 
@@ -1,15 +1,26 @@
 from flask import Blueprint, request, jsonify
-from zai import ZhipuAiClient
 from app.config import Config
+from app.llm_client import create_client
+from app.routing import hedged_completion
+from app.rate_limit import rate_limited
+from app.metrics import log_sampled
+from app.forks import latest_message_id
+from app.memory import recall_context, memory_prompt
+from app.analysis import build_analysis_messages
+from app.suggestions import generate_suggestions, prefetcher
 import json
+import logging
 import uuid
 import threading
+import contextvars
 import time
 from datetime import datetime
 
 llm_bp = Blueprint('llm', __name__, url_prefix='/api')
 
-client = ZhipuAiClient(api_key=Config.ZHIPU_API_KEY)
+logger = logging.getLogger(__name__)
+
+client = create_client()
 
 # 全局任务存储，用于跟踪异步任务状态
 novel_tasks = {}
@@ -90,17 +101,16 @@ def generate_novel_async(task_id, data, socketio_instance):
             'progress': '正在调用 AI 模型生成内容...'
         })
 
-        response = client.chat.completions.create(
-            model="glm-4.6",
+        response = hedged_completion(
+            client, "novel",
             messages=messages,
-            thinking={"type": "enabled"},
             temperature=0.7
         )
 
         result = response.choices[0].message.content
         
-        print(f"任务 {task_id} 大模型原始响应：", response)
-        print(f"任务 {task_id} AI回复内容：", result)
+        log_sampled(logger, "novel_completed", task_id=task_id, result_chars=len(result or ""),
+                    completion_tokens=getattr(getattr(response, 'usage', None), 'completion_tokens', None))
         
         # 更新任务状态为完成
         novel_tasks[task_id].update({
@@ -118,7 +128,7 @@ def generate_novel_async(task_id, data, socketio_instance):
         })
         
     except Exception as e:
-        print(f"任务 {task_id} 生成失败：", str(e))
+        logger.error(f"任务 {task_id} 生成失败：{str(e)}")
         # 更新任务状态为失败
         novel_tasks[task_id].update({
             "status": "failed",
@@ -134,12 +144,13 @@ def generate_novel_async(task_id, data, socketio_instance):
         })
 
 @llm_bp.route("/chat", methods=["POST"])
+@rate_limited()
 def chat():
     try:
         data = request.get_json(silent=True) or {}
         history = data.get("messages") or []
-
-        print(data)
+        # 传入 chapterId 时召回最近窗口之外的相关早期对话（长期记忆）
+        recalled = recall_context(data.get("chapterId"), history)
 
         # 提取上下文字段
         worldview = data.get("worldview") or ""
@@ -159,12 +170,10 @@ def chat():
         else:
             mc_text = str(main_characters) if main_characters else "无明确角色"
 
-        print("世界观:", worldview)
-        print("主要角色 sitting:", master_sitting)
-        print("玩家背景设定:", background)
-        print("主要角色信息:", mc_text)
-        print("剧情分析:", story_analysis)
-        print("剧情引导:", story_guide)
+        log_sampled(logger, "chat_request", history_len=len(history), worldview_chars=len(worldview),
+                    master_sitting_chars=len(master_sitting), background_chars=len(background),
+                    story_analysis_chars=len(story_analysis), story_guide_chars=len(story_guide),
+                    memory_hits=len(recalled))
         # 构造结构化提示词
         structured_prompt = f"""[Role]
 你是一位「沉浸式互动剧本作者」，以第三人称全知视角创作，擅长用细腻笔触构建场景、刻画人心。
@@ -205,21 +214,21 @@ def chat():
 2. 禁止出现现代网络梗、OOC 提示、括号解说，语言贴合世界观与角色身份；
 3. 直接输出正文内容，**绝对不要**添加任何前缀（如"正文"、"回复"等），聚焦当前对话节点的自然延续，让文字自带 “镜头感”。
 
-[Recent History]
+{memory_prompt(recalled)}[Recent History]
 {json.dumps(history, ensure_ascii=False) if history else '无历史对话'}
 """
 
         messages = [{"role": "system", "content": structured_prompt}] + [{"role":"user","content":"现在我需要你根据最近的历史对话，继续下一个对话节点。"}]
 
-        response = client.chat.completions.create(
-            model="glm-4-plus",
+        response = hedged_completion(
+            client, "chat",
             messages=messages,
             temperature=0.7,
             max_tokens=200
         )
 
-        print("大模型原始响应：", response)
-        print("AI回复内容：", response.choices[0].message.content)
+        log_sampled(logger, "chat_completed", response_chars=len(response.choices[0].message.content or ""),
+                    completion_tokens=getattr(getattr(response, 'usage', None), 'completion_tokens', None))
 
         return jsonify({"response": response.choices[0].message.content})
 
@@ -227,128 +236,23 @@ def chat():
         return jsonify({"error": str(e)}), 500
 
 @llm_bp.route("/chat/suggestions", methods=["POST"])
+@rate_limited()
 def chat_suggestions():
     try:
         data = request.get_json(silent=True) or {}
-        history = data.get("messages") or []
 
-        # 统一组装主要角色信息
-        main_characters = data.get("main_characters")
-        if isinstance(main_characters, (list, tuple)):
-            mc_text = ", ".join(map(str, main_characters))
-        elif isinstance(main_characters, dict):
-            mc_text = json.dumps(main_characters, ensure_ascii=False)
-        else:
-            mc_text = str(main_characters) if main_characters else ""
-
-        # 定义function call的工具
-        tools = [
-            {
-                "type": "function",
-                "function": {
-                    "name": "generate_reply_suggestions",
-                    "description": "生成6条玩家视角的回复示例，每条对应不同的情节延续方向",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "suggestion_1": {
-                                "type": "string",
-                                "description": "第一条回复示例，20-80字，中文，贴合世界观与角色身份"
-                            },
-                            "suggestion_2": {
-                                "type": "string",
-                                "description": "第二条回复示例，20-80字，中文，贴合世界观与角色身份"
-                            },
-                            "suggestion_3": {
-                                "type": "string",
-                                "description": "第三条回复示例，20-80字，中文，贴合世界观与角色身份"
-                            },
-                            "suggestion_4": {
-                                "type": "string",
-                                "description": "第四条回复示例，20-80字，中文，贴合世界观与角色身份"
-                            },
-                            "suggestion_5": {
-                                "type": "string",
-                                "description": "第五条回复示例，20-80字，中文，贴合世界观与角色身份"
-                            },
-                            "suggestion_6": {
-                                "type": "string",
-                                "description": "第六条回复示例，20-80字，中文，贴合世界观与角色身份"
-                            }
-                        },
-                        "required": ["suggestion_1", "suggestion_2", "suggestion_3", "suggestion_4", "suggestion_5", "suggestion_6"]
-                    }
-                }
-            }
-        ]
-
-        # 构造 system 提示
-        system_prompt = f"""[Role]
-你是对话回复辅助生成器，需基于上下文设定与历史对话，生成 6 条玩家视角的回复示例。所有内容必须贴合世界观、核心人物特征，且紧密承接上轮对话，强化剧情连贯性与代入感。
-
-[Output Requirements]
-1. 请使用提供的generate_reply_suggestions工具来生成6条回复示例。
-2. 每条回复必须对应不同的情节延续方向（如 "主动追问""动作回应""情绪流露" 等，避免方向重复）。
-3. 以玩家扮演的身份或者"你"为主语，镜头聚焦玩家动作与情绪。
-4. 必须承接上轮对话，自然推进情节；避免重复历史台词。
-5. 每句可由动作描写+神态刻画+对话组成，可含简短内心闪念。
-6. 简洁自然，20-80字，中文，贴合世界观与角色身份。
-7. 严格按照工具定义的参数格式输出，不要有任何额外的解释或说明。
+        # 优先命中AI回复落库后的预取结果
+        chapter_id = data.get("chapterId")
+        if chapter_id:
+            message_id = data.get("messageId")
+            if not message_id:
+                message_id = latest_message_id(int(chapter_id))
+            if message_id:
+                cached = prefetcher.get(int(chapter_id), int(message_id), wait=Config.SUGGESTION_PREFETCH_WAIT)
+                if cached is not None:
+                    return jsonify(cached)
 
-[Core Context]
-世界观：{data.get("worldview") or "无特殊设定"}
-核心人物设定：{data.get("master_sitting") or "无特定人物关系"}
-其余关系人物信息：{mc_text}
-玩家背景：{data.get("background") or "无特定场景"}
-
-[Current Conversation History]
-{json.dumps(history, ensure_ascii=False) if history else "无历史对话"}
-"""
-
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": "现在我需要你生成6条回复示例"}
-        ]
-
-        # 创建function call响应
-        response = client.chat.completions.create(
-            model="glm-4-plus",
-            messages=messages,
-            tools=tools,
-            tool_choice="auto",
-            temperature=0.7,
-            max_tokens=1000
-        )
-
-        # 获取function call结果
-        function_call_result = response.choices[0].message.tool_calls[0] if response.choices[0].message.tool_calls else None
-        print(function_call_result)
-        if function_call_result:
-            # 直接返回原始的function call调用信息
-            return jsonify({
-                'id': function_call_result.id,
-                'type': function_call_result.type,
-                'function': {
-                    'name': function_call_result.function.name,
-                    'arguments': function_call_result.function.arguments
-                }
-            })
-        else:
-            # 如果没有返回function call，降级处理
-            fallback_messages = [
-                {"role": "system", "content": "你是对话回复辅助生成器，请直接生成6条回复示例。"},
-                {"role": "user", "content": "现在我需要你生成6条回复示例"}
-            ]
-            
-            fallback_response = client.chat.completions.create(
-                model="glm-4-plus",
-                messages=fallback_messages,
-                temperature=0.7,
-                max_tokens=600
-            )
-            
-            content = fallback_response.choices[0].message.content
-            return jsonify({"fallback_content": content})
+        return jsonify(generate_suggestions(data))
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -378,6 +282,7 @@ def apply_sliding_window(messages, window_size=20):
     return messages[-window_size:]
 
 @llm_bp.route("/chat/analyze", methods=["POST"])
+@rate_limited()
 def analyze_story():
     try:
         data = request.get_json(silent=True) or {}
@@ -388,74 +293,24 @@ def analyze_story():
         window_size = 20
         filtered_history = apply_sliding_window(history, window_size)
 
-        # 提取上下文字段
         worldview = data.get("worldview") or ""
         master_sitting = data.get("master_sitting") or ""
-        background = data.get("background") or ""
+        log_sampled(logger, "analyze_request", history_len=len(history), window_len=len(filtered_history),
+                    worldview_chars=len(worldview), master_sitting_chars=len(master_sitting))
 
-        # 统一处理 main_characters
-        main_characters = data.get("main_characters")
-        if isinstance(main_characters, (list, tuple)):
-            mc_text = ", ".join(map(str, main_characters))
-        elif isinstance(main_characters, dict):
-            mc_text = json.dumps(main_characters, ensure_ascii=False)
-        else:
-            mc_text = str(main_characters) if main_characters else "无明确角色"
-
-        print("开始分析剧情:")
-        print("世界观:", worldview)
-        print("主要角色 setting:", master_sitting)
-        print("玩家背景设定:", background)
-        print("主要角色信息:", mc_text)
-        print(f"原始对话历史长度: {len(history)}, 应用滑动窗口后长度: {len(filtered_history)}")
-
-        # 构造结构化提示词，用于剧情分析
-        structured_prompt = f"""[Role]
-你是专业剧情分析师，从对话历史提取关键信息，结合世界观、角色与玩家设定，生成简短文本报告，助力后续创作。
-
-[Core Context]
-# 世界观
-{worldview or '无特殊设定'}
-
-# 核心人物
-{master_sitting}
-
-# 其余关系人物
-{mc_text or '无特定人物关系'}
-
-# 玩家背景设定
-{background or '无特定玩家背景'}
-
-[Current Conversation History]
-{json.dumps(filtered_history, ensure_ascii=False) if filtered_history else '无历史对话'}
-
-[Output Requirements]
-用流畅中文段落输出，每部分空行隔开，总字数控制在 300 字内：
-1. 剧情概览：用80字总结当前剧情走向。
-2. 关键事件：按时间顺序列出1-3个最重要的事件，每条20字以内，用"·"开头。
-3. 角色与玩家状态：40 字内说明核心角色与玩家的情感 / 立场。
-4. 关键伏笔：提 1-2 个影响后续剧情的重要信息。
-5. 当前悬念：30 字内点明主要矛盾或待解问题。
-
-无需任何标题或前缀，直接输出正文即可。
-"""
-
-        messages = [
-            {"role": "system", "content": structured_prompt},
-            {"role": "user", "content": "请根据提供的对话历史和上下文信息，分析当前剧情情况，提取关键事件并整理长期记忆。"}
-        ]
+        messages = build_analysis_messages(data, filtered_history)
 
-        response = client.chat.completions.create(
-            model="glm-4-plus",
+        response = hedged_completion(
+            client, "chat_analyze",
             messages=messages,
             thinking={"type": "enabled"},
             temperature=0.3,
             max_tokens=700
         )
 
-        print("剧情分析原始响应：", response)
         analysis_text = response.choices[0].message.content
-        print("剧情分析内容：", analysis_text)
+        log_sampled(logger, "analyze_completed", analysis_chars=len(analysis_text or ""),
+                    completion_tokens=getattr(getattr(response, 'usage', None), 'completion_tokens', None))
 
         # 直接返回纯文本分析结果
         return jsonify({"analysis": analysis_text})
@@ -464,6 +319,7 @@ def analyze_story():
         return jsonify({"error": str(e)}), 500
 
 @llm_bp.route("/novel", methods=["POST"])
+@rate_limited()
 def generate_novel():
     try:
         # 获取前端传递的参数
@@ -477,10 +333,10 @@ def generate_novel():
         # 导入 socketio 实例
         from app.routes.websocket import socketio
         
-        # 启动后台任务
+        # 启动后台任务（复制上下文，使后台调用的 token 用量计入当前用户的配额）
         thread = threading.Thread(
-            target=generate_novel_async,
-            args=(task_id, data, socketio)
+            target=contextvars.copy_context().run,
+            args=(generate_novel_async, task_id, data, socketio)
         )
         thread.daemon = True
         thread.start()
@@ -1,15 +1,27 @@
 from flask import Blueprint, request, jsonify
 from flask_socketio import SocketIO, emit, join_room
-from zai import ZhipuAiClient
 from app.config import Config
+from app.llm_client import create_client
+from app.routing import hedged_stream, hedged_completion
+from app.rate_limit import rate_limited
+from app.metrics import log_sampled, track_socket_event, SOCKETIO_CONNECTIONS
 from app.models import db, ConversationMessage
+from app.stats import record_message
+from app.content import FLAG_BODY, message_text
+from app.forks import chapter_history
+from app.memory import recall_context, memory_prompt
+from app.analysis import build_analysis_messages, latest_analysis, schedule_analysis
+from app.suggestions import prefetcher, stream_suggestions
+from app.tool_stream import ToolCallAccumulator
+from app.worlds import WORLD_SETTING_TOOLS, materialize_world_setting
+from app.dashboard import invalidate_dashboards
 import json
 import logging
 
 websocket_bp = Blueprint('websocket', __name__)
 socketio = SocketIO(cors_allowed_origins="*")
 
-client = ZhipuAiClient(api_key=Config.ZHIPU_API_KEY)
+client = create_client()
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -18,13 +30,15 @@ logger = logging.getLogger(__name__)
 @socketio.on('connect')
 def handle_connect():
     """客户端连接时触发"""
-    print('客户端已连接')
+    SOCKETIO_CONNECTIONS.inc()
+    logger.debug('客户端已连接')
     emit('connected', {'status': 'connected'})
 
 @socketio.on('disconnect')
 def handle_disconnect():
     """客户端断开连接时触发"""
-    print('客户端已断开连接')
+    SOCKETIO_CONNECTIONS.dec()
+    logger.debug('客户端已断开连接')
 
 @socketio.on('join')
 def handle_join(data):
@@ -33,12 +47,47 @@ def handle_join(data):
     join_room(room)
     emit('joined', {'room': room, 'status': 'joined'})
 
+def schedule_suggestion_prefetch(data, history, chapter_id, message_id, ai_content, sid):
+    """AI消息落库后，基于新的章节状态后台预取回复建议，完成后推送给当前客户端
+
+    history 为本轮聊天已解析的历史（前端未传 messages 时来自数据库），追加AI回复后作为预取上下文。
+    """
+    if not Config.SUGGESTION_PREFETCH_ENABLED:
+        return
+
+    prefetch_data = dict(data)
+    prefetch_data["messages"] = list(history or []) + [
+        {"role": "ai", "content": ai_content}
+    ]
+
+    def push(payload):
+        socketio.emit('chat_suggestions_ready', {
+            'chapter_id': chapter_id,
+            'message_id': message_id,
+            'suggestions': payload
+        }, to=sid)
+
+    try:
+        prefetcher.schedule(chapter_id, message_id, prefetch_data, on_ready=push)
+    except Exception as e:
+        logger.error(f"提交回复建议预取失败: {str(e)}")
+
+def resolve_history(data, limit=20):
+    """前端未传 messages 时，按 chapterId 从数据库取最近的可见消息（分支章节含继承的消息）"""
+    history = data.get("messages")
+    if history:
+        return history
+    chapter_id = data.get("chapterId")
+    return chapter_history(int(chapter_id), limit) if chapter_id else []
+
 @socketio.on('chat_stream')
+@rate_limited(error_event='chat_stream_error')
+@track_socket_event('chat_stream')
 def handle_chat_stream(data):
     """处理流式聊天并保存消息到数据库"""
     try:
         # 解析参数
-        history = data.get("messages") or []
+        history = resolve_history(data)
         worldview = data.get("worldview") or ""
         master_sitting = data.get("master_sitting") or ""
         background = data.get("background") or ""
@@ -48,6 +97,17 @@ def handle_chat_stream(data):
         user_id = data.get("userId")
         
         logger.info(f"收到聊天请求 - chapter_id: {chapter_id}, user_id: {user_id}")
+
+        # 前端未传剧情分析时使用后台自动分析的最新结果（只读取已完成的结果，不等待）
+        if not story_analysis and chapter_id and Config.ANALYSIS_AUTO_ENABLED:
+            story_analysis = latest_analysis(int(chapter_id)) or ""
+
+        # 长期记忆：召回最近窗口之外的相关早期对话
+        recalled = recall_context(chapter_id, history)
+
+        # 用户已经回复，上一轮的建议预取不再需要
+        if chapter_id:
+            prefetcher.cancel(int(chapter_id))
         
         # 统一处理 main_characters
         main_characters = data.get("main_characters")
@@ -98,7 +158,7 @@ def handle_chat_stream(data):
 2. 禁止出现现代网络梗、OOC 提示、括号解说，语言贴合世界观与角色身份；
 3. 直接输出正文内容，**绝对不要**添加任何前缀（如"正文"、"回复"等），聚焦当前对话节点的自然延续，让文字自带 "镜头感"。
 
-[Recent History]
+{memory_prompt(recalled)}[Recent History]
 {json.dumps(history, ensure_ascii=False) if history else '无历史对话'}
 """
 
@@ -109,12 +169,11 @@ def handle_chat_stream(data):
 
         # 创建流式响应
         try:
-            stream = client.chat.completions.create(
-                model="glm-4-plus",
+            stream = hedged_stream(
+                client, "chat_stream",
                 messages=messages,
                 temperature=0.7,
-                max_tokens=200,
-                stream=True
+                max_tokens=200
             )
             
             # 发送流式响应并累积内容
@@ -126,7 +185,7 @@ def handle_chat_stream(data):
                         'content': content,
                         'finished': False
                     })
-            logger.info(f"AI回复已完成 - 内容: {accumulated_content}")
+            log_sampled(logger, "chat_stream_completed", chapter_id=chapter_id, response_chars=len(accumulated_content))
             
             # 保存AI消息到数据库
             if accumulated_content and chapter_id and user_id:
@@ -135,9 +194,12 @@ def handle_chat_stream(data):
                         chapter_id=int(chapter_id),
                         user_id=int(user_id),
                         role='ai',
-                        content=f"正文：{accumulated_content}"
+                        content=accumulated_content,
+                        flags=FLAG_BODY
                     )
                     db.session.add(ai_message)
+                    db.session.flush()
+                    record_message(ai_message)
                     db.session.commit()
                     logger.info(f"AI消息已保存到数据库 - ID: {ai_message.id}")
                     
@@ -146,6 +208,10 @@ def handle_chat_stream(data):
                         'finished': True,
                         'message_id': ai_message.id
                     })
+                    schedule_suggestion_prefetch(
+                        data, history, int(chapter_id), ai_message.id, message_text(ai_message.content, ai_message.flags), request.sid
+                    )
+                    schedule_analysis(int(chapter_id), data)
                 except Exception as db_error:
                     logger.error(f"保存AI消息到数据库失败: {str(db_error)}")
                     db.session.rollback()
@@ -157,8 +223,8 @@ def handle_chat_stream(data):
         except Exception as stream_error:
             logger.error(f"流式响应失败: {str(stream_error)}")
             # 如果流式响应失败，降级到普通响应
-            response = client.chat.completions.create(
-                model="glm-4-plus",
+            response = hedged_completion(
+                client, "chat_stream",
                 messages=messages,
                 temperature=0.7,
                 max_tokens=200
@@ -174,9 +240,12 @@ def handle_chat_stream(data):
                         chapter_id=int(chapter_id),
                         user_id=int(user_id),
                         role='ai',
-                        content=f"正文：{content}"
+                        content=content,
+                        flags=FLAG_BODY
                     )
                     db.session.add(ai_message)
+                    db.session.flush()
+                    record_message(ai_message)
                     db.session.commit()
                     logger.info(f"AI消息已保存到数据库 - ID: {ai_message.id}")
                     
@@ -186,6 +255,10 @@ def handle_chat_stream(data):
                         'finished': True,
                         'message_id': ai_message.id
                     })
+                    schedule_suggestion_prefetch(
+                        data, history, int(chapter_id), ai_message.id, message_text(ai_message.content, ai_message.flags), request.sid
+                    )
+                    schedule_analysis(int(chapter_id), data)
                 except Exception as db_error:
                     logger.error(f"保存AI消息到数据库失败: {str(db_error)}")
                     db.session.rollback()
@@ -206,67 +279,21 @@ def handle_chat_stream(data):
         emit('chat_stream_error', {'error': str(e)})
 
 @socketio.on('chat_analyze_stream')
+@rate_limited(error_event='chat_analyze_stream_error')
+@track_socket_event('chat_analyze_stream')
 def handle_chat_analyze_stream(data):
     """处理流式剧情分析"""
     try:
-        history = data.get("messages") or []
-        worldview = data.get("worldview") or ""
-        master_sitting = data.get("master_sitting") or ""
-        background = data.get("background") or ""
-        
-        # 统一处理 main_characters
-        main_characters = data.get("main_characters")
-        if isinstance(main_characters, (list, tuple)):
-            mc_text = ", ".join(map(str, main_characters))
-        elif isinstance(main_characters, dict):
-            mc_text = json.dumps(main_characters, ensure_ascii=False)
-        else:
-            mc_text = str(main_characters) if main_characters else "无明确角色"
-
-        # 构造结构化提示词
-        structured_prompt = f"""[Role]
-你是专业剧情分析师，从对话历史提取关键信息，结合世界观、角色与玩家设定，生成简短文本报告，助力后续创作。
-
-[Core Context]
-# 世界观
-{worldview or '无特殊设定'}
-
-# 核心人物
-{master_sitting}
-
-# 其余关系人物
-{mc_text or '无特定人物关系'}
-
-# 玩家背景设定
-{background or '无特定玩家背景'}
-
-[Current Conversation History]
-{json.dumps(history, ensure_ascii=False) if history else '无历史对话'}
-
-[Output Requirements]
-用流畅中文段落输出，每部分空行隔开，总字数控制在 300 字内：
-1. 剧情概览：用80字总结当前剧情走向。
-2. 关键事件：按时间顺序列出1-3个最重要的事件，每条20字以内，用"·"开头。
-3. 角色与玩家状态：40 字内说明核心角色与玩家的情感 / 立场。
-4. 关键伏笔：提 1-2 个影响后续剧情的重要信息。
-5. 当前悬念：30 字内点明主要矛盾或待解问题。
-
-无需任何标题或前缀，直接输出正文即可。
-"""
-
-        messages = [
-            {"role": "system", "content": structured_prompt},
-            {"role": "user", "content": "请根据提供的对话历史和上下文信息，分析当前剧情情况，提取关键事件并整理长期记忆。"}
-        ]
+        history = resolve_history(data)
+        messages = build_analysis_messages(data, history)
 
         # 创建流式响应
         try:
-            stream = client.chat.completions.create(
-                model="glm-4-plus",
+            stream = hedged_stream(
+                client, "chat_analyze",
                 messages=messages,
                 temperature=0.3,
-                max_tokens=700,
-                stream=True
+                max_tokens=700
             )
             
             # 发送流式响应
@@ -282,8 +309,8 @@ def handle_chat_analyze_stream(data):
             emit('chat_analyze_stream_end', {'finished': True})
         except Exception as stream_error:
             # 如果流式响应失败，降级到普通响应
-            response = client.chat.completions.create(
-                model="glm-4-plus",
+            response = hedged_completion(
+                client, "chat_analyze",
                 messages=messages,
                 temperature=0.3,
                 max_tokens=700
@@ -299,7 +326,37 @@ def handle_chat_analyze_stream(data):
     except Exception as e:
         emit('chat_analyze_stream_error', {'error': str(e)})
 
+@socketio.on('chat_suggestions_stream')
+@rate_limited(error_event='chat_suggestions_error')
+@track_socket_event('chat_suggestions_stream')
+def handle_chat_suggestions_stream(data):
+    """流式生成回复建议，每条建议生成完毕即推送"""
+    try:
+        # 命中预取结果时直接逐条推送
+        chapter_id = data.get("chapterId")
+        message_id = data.get("messageId")
+        if chapter_id and message_id:
+            cached = prefetcher.get(int(chapter_id), int(message_id))
+            if cached is not None and cached.get('function'):
+                arguments = json.loads(cached['function']['arguments'] or "{}")
+                for field, value in arguments.items():
+                    emit('chat_suggestions_field', {'field': field, 'value': value})
+                emit('chat_suggestions_end', {'finished': True, 'content': cached})
+                return
+
+        def on_field(field, value):
+            emit('chat_suggestions_field', {'field': field, 'value': value})
+
+        payload = stream_suggestions(data, on_field=on_field)
+        emit('chat_suggestions_end', {'finished': True, 'content': payload})
+
+    except Exception as e:
+        logger.error(f"回复建议流式生成异常: {str(e)}")
+        emit('chat_suggestions_error', {'error': str(e)})
+
 @socketio.on('world-creator')
+@rate_limited(error_event='world_creator_error')
+@track_socket_event('world-creator')
 def handle_world_creator(data):
     """处理世界观创建请求，使用function call方式生成结构化的世界观设定"""
     try:
@@ -307,6 +364,9 @@ def handle_world_creator(data):
         user_message = data.get("message", "")
         history = data.get("history", [])
         user_id = data.get("userId", None)
+        stream_mode = bool(data.get("stream"))
+        materialize = bool(data.get("materialize"))
+        end_payload = {'finished': True}
         
         logger.info(f"收到世界观创建请求 - user_id: {user_id}")
         
@@ -315,94 +375,6 @@ def handle_world_creator(data):
             emit('world_creator_error', {'error': '用户消息不能为空'})
             return
         
-        # 定义function call的工具
-        tools = [
-            {
-                "type": "function",
-                "function": {
-                    "name": "create_world_setting",
-                    "description": "创建详细的世界观设定，包括世界背景、角色信息和初始剧情",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "world_name": {
-                                "type": "string",
-                                "description": "世界的名称"
-                            },
-                            "world_description": {
-                                "type": "string",
-                                "description": "世界观的详细描述，包括地理环境、历史背景、文化特色、社会结构等"
-                            },
-                            "character_name": {
-                                "type": "string",
-                                "description": "AI主要扮演角色的名字，非用户角色"
-                            },
-                            "appearance": {
-                                "type": "string",
-                                "description": "AI主要扮演角色的外貌特征描述"
-                            },
-                            "clothing_style": {
-                                "type": "string",
-                                "description": "AI主要扮演角色的服饰风格描述"
-                            },
-                            "character_background": {
-                                "type": "string",
-                                "description": "AI主要扮演角色的背景故事描述"
-                            },
-                            "personality_traits": {
-                                "type": "string",
-                                "description": "AI主要扮演角色的性格特征描述"
-                            },
-                            "language_style": {
-                                "type": "string",
-                                "description": "AI主要扮演角色的语言风格描述"
-                            },
-                            "behavior_logic": {
-                                "type": "string",
-                                "description": "AI主要扮演角色的行为逻辑描述"
-                            },
-                            "psychological_traits": {
-                                "type": "string",
-                                "description": "AI主要扮演角色的心理特质描述"
-                            },
-                            "chapter_name": {
-                                "type": "string",
-                                "description": "章节的名称"
-                            },
-                            "opening_line": {
-                                "type": "string",
-                                "description": "章节的开场白，需为引导故事情节开始的动态场景描写，包含时间、角色互动、背景回顾、日常细节、情感铺垫和动作描写，让用户能快速代入剧情，自然开启故事"
-                            },
-                            "user_role": {
-                                "type": "string",
-                                "description": "用户在故事中的角色，需包含详细的身份背景、职业/生活状态、人际关系、性格特质、核心矛盾或坚持，内容具体且有画面感，避免简单笼统的描述"
-                            },
-                            "other_character_names": {
-                                "type": "array",
-                                "description": "其余人物的名字列表",
-                                "items": {
-                                    "type": "string",
-                                    "description": "人物名字"
-                                }
-                            },
-                            "other_character_backgrounds": {
-                                "type": "array",
-                                "description": "其余人物的背景故事列表，与名字列表一一对应",
-                                "items": {
-                                    "type": "string",
-                                    "description": "人物背景故事"
-                                }
-                            }
-                        },
-                        "required": ["world_name", "world_description", "character_name", "appearance", 
-                                    "clothing_style", "character_background", "personality_traits", 
-                                    "language_style", "behavior_logic", "psychological_traits", 
-                                    "chapter_name", "opening_line", "user_role", "other_character_names", "other_character_backgrounds"]
-                    }
-                }
-            }
-        ]
-
         # 构造世界观创建的提示词
         structured_prompt = f"""[Role]
 你是一位专业的世界观设定师，擅长创建丰富、连贯、有深度的虚构世界。
@@ -443,34 +415,64 @@ def handle_world_creator(data):
 
         # 创建function call响应
         try:
-            response = client.chat.completions.create(
-                model="glm-4-plus",
-                messages=messages,
-                tools=tools,
-                tool_choice="auto",
-                temperature=0.7,
-                max_tokens=2000
-            )
-            
-            # 获取function call结果
-            function_call_result = response.choices[0].message.tool_calls[0] if response.choices[0].message.tool_calls else None
+            if stream_mode:
+                # 流式模式：参数中的每个字段闭合后立即推送
+                stream = hedged_stream(
+                    client, "world_creator",
+                    messages=messages,
+                    tools=WORLD_SETTING_TOOLS,
+                    tool_choice="auto",
+                    temperature=0.7,
+                    max_tokens=2000
+                )
+                accumulator = ToolCallAccumulator()
+                for chunk in stream:
+                    for field, value in accumulator.feed_chunk(chunk):
+                        emit('world_creator_field', {'field': field, 'value': value})
+                function_call_data = accumulator.result()
+            else:
+                response = hedged_completion(
+                    client, "world_creator",
+                    messages=messages,
+                    tools=WORLD_SETTING_TOOLS,
+                    tool_choice="auto",
+                    temperature=0.7,
+                    max_tokens=2000
+                )
+
+                # 获取function call结果
+                function_call_result = response.choices[0].message.tool_calls[0] if response.choices[0].message.tool_calls else None
+                function_call_data = None
+                if function_call_result:
+                    # 构建原始function call数据结构
+                    function_call_data = {
+                        'id': function_call_result.id,
+                        'type': function_call_result.type,
+                        'function': {
+                            'name': function_call_result.function.name,
+                            'arguments': function_call_result.function.arguments
+                        }
+                    }
             
-            if function_call_result:
+            if function_call_data:
                 # 直接返回原始的function call调用信息给前端
-                # 构建原始function call数据结构
-                function_call_data = {
-                    'id': function_call_result.id,
-                    'type': function_call_result.type,
-                    'function': {
-                        'name': function_call_result.function.name,
-                        'arguments': function_call_result.function.arguments
-                    }
-                }
                 emit('world_creator_data', {
                     'content': function_call_data,
                     'finished': True
                 })
-                logger.info(f"世界观创建function call成功 - 函数名: {function_call_result.function.name}")
+                logger.info(f"世界观创建function call成功 - 函数名: {function_call_data['function']['name']}")
+
+                # 由服务端直接落库世界、角色、默认章节与创建者关系
+                if materialize and user_id:
+                    try:
+                        end_payload.update(
+                            materialize_world_setting(function_call_data['function']['arguments'], user_id)
+                        )
+                        invalidate_dashboards([int(user_id)])
+                        logger.info(f"世界观已落库 - world_id: {end_payload['world_id']}")
+                    except Exception as db_error:
+                        logger.error(f"世界观落库失败: {str(db_error)}")
+                        end_payload['materialize_error'] = str(db_error)
             else:
                 # 如果没有返回function call，降级处理
                 fallback_messages = [
@@ -478,8 +480,8 @@ def handle_world_creator(data):
                     {"role": "user", "content": user_message}
                 ]
                 
-                fallback_response = client.chat.completions.create(
-                    model="glm-4-plus",
+                fallback_response = hedged_completion(
+                    client, "world_creator",
                     messages=fallback_messages,
                     temperature=0.7,
                     max_tokens=1000
@@ -491,8 +493,8 @@ def handle_world_creator(data):
                     'finished': True
                 })
             
-            # 发送完成信号
-            emit('world_creator_end', {'finished': True})
+            # 发送完成信号（落库成功时包含新记录ID）
+            emit('world_creator_end', end_payload)
                 
         except Exception as e:
             logger.error(f"Function call处理异常: {str(e)}")
@@ -503,8 +505,8 @@ def handle_world_creator(data):
             ]
             
             try:
-                fallback_response = client.chat.completions.create(
-                    model="glm-4-plus",
+                fallback_response = hedged_completion(
+                    client, "world_creator",
                     messages=fallback_messages,
                     temperature=0.7,
                     max_tokens=1000
@@ -0,0 +1,285 @@
+from app.config import Config
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import queue
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 各接口默认的模型路由策略
+# primary / fallback 为模型参数（model 及该模型专属的额外参数），hedge_after 为首 token 截止时间（秒）
+# 超过 hedge_after 仍未收到首个 token 时，向 fallback 发起对冲请求，先产出 token 的一方胜出
+# 非流式接口没有首 token 的概念，hedge_after 按整个响应的耗时计算
+DEFAULT_POLICIES = {
+    "chat": {"primary": {"model": "glm-4-plus"}, "fallback": {"model": "glm-4-air"}, "hedge_after": 8.0},
+    "chat_stream": {"primary": {"model": "glm-4-plus"}, "fallback": {"model": "glm-4-air"}, "hedge_after": 3.0},
+    "chat_suggestions": {"primary": {"model": "glm-4-plus"}, "fallback": None, "hedge_after": None},
+    "chat_analyze": {"primary": {"model": "glm-4-plus"}, "fallback": None, "hedge_after": None},
+    # 后台自动分析：不在用户的等待路径上，可单独路由到更便宜的模型
+    "chat_analyze_auto": {"primary": {"model": "glm-4-plus"}, "fallback": None, "hedge_after": None},
+    "world_creator": {"primary": {"model": "glm-4-plus"}, "fallback": None, "hedge_after": None},
+    "novel": {
+        "primary": {"model": "glm-4.6", "thinking": {"type": "enabled"}},
+        "fallback": {"model": "glm-4-plus"},
+        "hedge_after": None
+    },
+}
+
+
+class RoutingPolicy:
+    """单个接口的模型路由策略"""
+
+    def __init__(self, primary, fallback=None, hedge_after=None):
+        self.primary = dict(primary)
+        self.fallback = dict(fallback) if fallback else None
+        self.hedge_after = hedge_after
+
+
+def get_policy(endpoint):
+    """读取接口的路由策略，Config.LLM_ROUTING 中的配置覆盖默认值"""
+    policy = dict(DEFAULT_POLICIES.get(endpoint) or DEFAULT_POLICIES["chat"])
+    policy.update(Config.LLM_ROUTING.get(endpoint) or {})
+    return RoutingPolicy(policy["primary"], policy.get("fallback"), policy.get("hedge_after"))
+
+
+class LLMCallStats:
+    """一次大模型调用的统计信息，调用完成后交给监听器（限流记账、指标）"""
+
+    def __init__(self, endpoint, model, prompt_tokens, completion_tokens, duration, ttft=None):
+        self.endpoint = endpoint
+        self.model = model
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.duration = duration
+        self.ttft = ttft
+
+
+# 调用监听器：fn(LLMCallStats)，在每次调用完成后于调用方线程中回调
+_call_listeners = []
+
+
+def add_call_listener(listener):
+    _call_listeners.append(listener)
+
+
+def _report_call(endpoint, route, usage, duration, ttft=None, completion_chars=0):
+    """上报一次调用的统计；流式响应没有 usage 时按输出字符数估算 completion token"""
+    prompt_tokens = getattr(usage, 'prompt_tokens', 0) or 0 if usage else 0
+    completion_tokens = getattr(usage, 'completion_tokens', 0) or 0 if usage else completion_chars
+    stats = LLMCallStats(endpoint, route.get('model'), prompt_tokens, completion_tokens, duration, ttft)
+    for listener in _call_listeners:
+        try:
+            listener(stats)
+        except Exception as e:
+            logger.error(f"调用监听器执行失败: {str(e)}")
+
+
+def _output_chars(chunk):
+    if not chunk.choices:
+        return 0
+    delta = chunk.choices[0].delta
+    size = len(getattr(delta, 'content', None) or "") + len(getattr(delta, 'reasoning_content', None) or "")
+    for tool_call in getattr(delta, 'tool_calls', None) or []:
+        function = getattr(tool_call, 'function', None)
+        size += len(getattr(function, 'arguments', None) or "") if function else 0
+    return size
+
+
+def _has_output(chunk):
+    """流式分片中是否已产出有效 token（正文、思考内容或 tool call）"""
+    if not chunk.choices:
+        return False
+    delta = chunk.choices[0].delta
+    return bool(
+        getattr(delta, 'content', None)
+        or getattr(delta, 'reasoning_content', None)
+        or getattr(delta, 'tool_calls', None)
+    )
+
+
+class _StreamRacer(threading.Thread):
+    """在后台线程中读取一路流式响应，把分片放入共享队列"""
+
+    def __init__(self, client, route, kwargs, events):
+        super().__init__(daemon=True)
+        self.client = client
+        self.route = route
+        self.kwargs = kwargs
+        self.events = events
+        self.cancelled = threading.Event()
+        self.stream = None
+
+    def run(self):
+        try:
+            self.stream = self.client.chat.completions.create(**{**self.kwargs, **self.route, 'stream': True})
+            for chunk in self.stream:
+                if self.cancelled.is_set():
+                    break
+                self.events.put((self, 'chunk', chunk))
+            else:
+                self.events.put((self, 'done', None))
+        except Exception as e:
+            self.events.put((self, 'error', e))
+        finally:
+            if self.cancelled.is_set():
+                self.close()
+
+    def cancel(self):
+        # 立即关闭底层连接，避免卡住的落败方迟迟不释放
+        self.cancelled.set()
+        self.close()
+
+    def close(self):
+        close = getattr(self.stream, 'close', None)
+        if close:
+            try:
+                close()
+            except Exception:
+                pass
+
+
+def hedged_stream(client, endpoint, **kwargs):
+    """按路由策略发起流式请求，返回分片迭代器
+
+    - 主模型在 hedge_after 秒内没有产出首个 token 时，向备用模型发起对冲请求
+    - 主模型在首 token 前报错时立即切换到备用模型
+    - 先产出 token 的一路胜出，另一路被取消
+    """
+    policy = get_policy(endpoint)
+    events = queue.Queue()
+    racers = []
+    buffers = {}
+    winner = None
+    usage = None
+    completion_chars = 0
+
+    def launch(route):
+        racer = _StreamRacer(client, route, kwargs, events)
+        racers.append(racer)
+        buffers[racer] = []
+        racer.start()
+        return racer
+
+    started = time.monotonic()
+    first_token_at = None
+    launch(policy.primary)
+    hedge_deadline = time.monotonic() + policy.hedge_after if policy.fallback and policy.hedge_after else None
+
+    try:
+        while True:
+            timeout = None
+            if winner is None and hedge_deadline is not None and len(racers) == 1:
+                timeout = max(0, hedge_deadline - time.monotonic())
+            try:
+                racer, kind, payload = events.get(timeout=timeout)
+            except queue.Empty:
+                logger.warning(f"{endpoint} 首token超时 {policy.hedge_after}s，对冲请求备用模型 {policy.fallback.get('model')}")
+                launch(policy.fallback)
+                continue
+
+            if winner is not None and racer is not winner:
+                continue
+
+            if kind == 'chunk':
+                if winner is None:
+                    buffers[racer].append(payload)
+                    if not _has_output(payload):
+                        continue
+                    winner = racer
+                    first_token_at = time.monotonic()
+                    for other in racers:
+                        if other is not racer:
+                            other.cancel()
+                    if len(racers) > 1:
+                        logger.info(f"{endpoint} 对冲胜出模型: {racer.route.get('model')}")
+                    chunks = buffers.pop(racer)
+                else:
+                    chunks = [payload]
+                # 只统计胜出一路的用量与输出长度
+                for chunk in chunks:
+                    usage = getattr(chunk, 'usage', None) or usage
+                    completion_chars += _output_chars(chunk)
+                    yield chunk
+            elif kind == 'done':
+                if winner is None:
+                    # 没有任何 token 就结束，直接采用该路结果
+                    winner = racer
+                    for buffered in buffers.pop(racer):
+                        usage = getattr(buffered, 'usage', None) or usage
+                        yield buffered
+                _report_call(
+                    endpoint, racer.route, usage, time.monotonic() - started,
+                    ttft=(first_token_at - started) if first_token_at else None,
+                    completion_chars=completion_chars
+                )
+                return
+            elif kind == 'error':
+                if winner is not None:
+                    raise payload
+                logger.error(f"{endpoint} 模型 {racer.route.get('model')} 请求失败: {str(payload)}")
+                racer.cancel()
+                alive = [r for r in racers if r is not racer and not r.cancelled.is_set()]
+                if alive:
+                    continue
+                if policy.fallback and len(racers) == 1:
+                    launch(policy.fallback)
+                    continue
+                raise payload
+    finally:
+        for racer in racers:
+            racer.cancel()
+
+
+_completion_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='llm-hedge')
+
+
+def hedged_completion(client, endpoint, **kwargs):
+    """按路由策略发起非流式请求
+
+    主模型在 hedge_after 秒内未返回时向备用模型发起对冲请求，先完成的一方胜出；
+    主模型报错时切换到备用模型。非流式请求无法中途取消，落败一方的结果直接丢弃。
+    """
+    policy = get_policy(endpoint)
+
+    started = time.monotonic()
+
+    def call(route):
+        response = client.chat.completions.create(**{**kwargs, **route})
+        return route, response
+
+    def finish(result):
+        route, response = result
+        _report_call(endpoint, route, getattr(response, 'usage', None), time.monotonic() - started)
+        return response
+
+    if not policy.fallback:
+        return finish(call(policy.primary))
+
+    primary = _completion_executor.submit(call, policy.primary)
+    pending = {primary}
+    hedged = False
+    timeout = policy.hedge_after
+    while pending:
+        done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        if not done:
+            logger.warning(f"{endpoint} 响应超时 {policy.hedge_after}s，对冲请求备用模型 {policy.fallback.get('model')}")
+            pending.add(_completion_executor.submit(call, policy.fallback))
+            hedged = True
+            timeout = None
+            continue
+        # 两路可能同时完成，优先采用成功的一路
+        succeeded = [future for future in done if future.exception() is None]
+        if succeeded:
+            for other in pending:
+                other.cancel()
+            return finish(succeeded[0].result())
+        for future in done:
+            error = future.exception()
+            logger.error(f"{endpoint} 模型请求失败: {str(error)}")
+        if not hedged:
+            pending.add(_completion_executor.submit(call, policy.fallback))
+            hedged = True
+            timeout = None
+        elif not pending:
+            raise error
@@ -0,0 +1,225 @@
+from flask import Response
+from sqlalchemy import select
+from app.models import db, World, WorldCharacter, Chapter, ConversationMessage, NovelRecord, UserWorld
+from app.content import message_text
+from functools import lru_cache
+import json
+
+try:
+    import orjson
+except ImportError:  # 未安装时退回标准库
+    orjson = None
+
+# 每个模型一个序列化器：按字段列表预先生成取值函数，既可序列化 ORM 对象，
+# 也可直接序列化 select(*columns) 返回的行元组，避免为列表接口逐行构造 ORM 对象
+# 字段投影（Projection）会下推到 SELECT 的列，未请求的大文本列不会被读取
+
+
+def _iso(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def _or_zero(value):
+    return value or 0
+
+
+def dumps(data):
+    """序列化为 UTF-8 JSON 字节串"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+
+
+def json_response(data, status=200):
+    return Response(dumps(data), status=status, mimetype='application/json')
+
+
+class ModelSerializer:
+    """单个模型的序列化器
+
+    fields: 输出字段顺序，元素为列名或 (输出键, 列名, 转换函数)；
+    列名也可以是多个列名的元组，此时转换函数按顺序接收这些列的值
+    """
+
+    def __init__(self, model, fields):
+        self.model = model
+        self.fields = []
+        for field in fields:
+            if isinstance(field, str):
+                field = (field, field, None)
+            self.fields.append(field)
+        self.field_names = tuple(key for key, _, _ in self.fields)
+
+    def _select_fields(self, only=None):
+        if only is None:
+            return self.fields
+        wanted = set(only)
+        return [field for field in self.fields if field[0] in wanted]
+
+    def project(self, projection, always=('id',)):
+        """按 Projection 计算需要输出的字段（按定义顺序），不限制时返回 None"""
+        if projection is None or projection.unrestricted:
+            return None
+        return tuple(
+            name for name in self.field_names
+            if name in always or projection.includes(name)
+        )
+
+    @lru_cache(maxsize=64)
+    def compile(self, only=None):
+        """生成 (columns, from_row, from_object)：查询所需的列，以及按行元组 / ORM 对象取值的函数"""
+        fields = self._select_fields(only)
+        names = [column if isinstance(column, tuple) else (column,) for _, column, _ in fields]
+        columns = tuple(getattr(self.model, name) for group in names for name in group)
+        namespace = {'_fn_%d' % i: fn for i, (_, _, fn) in enumerate(fields) if fn is not None}
+
+        def expr(i, sources):
+            return f"_fn_{i}({', '.join(sources)})" if fields[i][2] is not None else sources[0]
+
+        row_items, obj_items, position = [], [], 0
+        for i, group in enumerate(names):
+            row_sources = [f"row[{position + offset}]" for offset in range(len(group))]
+            position += len(group)
+            row_items.append(f"{fields[i][0]!r}: {expr(i, row_sources)}")
+            obj_items.append(f"{fields[i][0]!r}: {expr(i, [f'obj.{name}' for name in group])}")
+        row_items, obj_items = ", ".join(row_items), ", ".join(obj_items)
+        source = f"def from_row(row):\n    return {{{row_items}}}\n" \
+                 f"def from_object(obj):\n    return {{{obj_items}}}\n"
+        exec(compile(source, f"<serializer {self.model.__name__}>", "exec"), namespace)
+        return columns, namespace['from_row'], namespace['from_object']
+
+    def columns(self, only=None):
+        return self.compile(only)[0]
+
+    def select(self, only=None):
+        return select(*self.columns(only))
+
+    def from_rows(self, rows, only=None):
+        from_row = self.compile(only)[1]
+        return [from_row(row) for row in rows]
+
+    def from_object(self, obj, only=None):
+        return self.compile(only)[2](obj)
+
+    def from_objects(self, objects, only=None):
+        from_object = self.compile(only)[2]
+        return [from_object(obj) for obj in objects]
+
+
+WORLD = ModelSerializer(World, [
+    'id', 'user_id', 'name', 'tags', 'is_public', 'worldview', 'master_setting', 'origin_world_id',
+    ('create_time', 'create_time', _iso), 'popularity',
+])
+WORLD_CHARACTER = ModelSerializer(WorldCharacter, ['name', 'background'])
+CHAPTER = ModelSerializer(Chapter, [
+    'id', 'world_id', 'creator_user_id', 'name', 'opening', 'background', 'is_default', 'origin_chapter_id',
+    'fork_message_id', ('create_time', 'create_time', _iso),
+])
+MESSAGE = ModelSerializer(ConversationMessage, [
+    'id', 'chapter_id', 'user_id', 'role', ('content', ('content', 'flags'), message_text),
+    ('create_time', 'create_time', _iso),
+])
+NOVEL = ModelSerializer(NovelRecord, [
+    'id', 'chapter_id', 'user_id', 'title', 'content', ('create_time', 'create_time', _iso),
+    ('popularity', 'popularity', _or_zero),
+])
+USER_WORLD = ModelSerializer(UserWorld, [
+    'id', 'user_id', 'world_id', 'role', ('create_time', 'create_time', _iso),
+])
+
+serializers = {
+    World: WORLD,
+    WorldCharacter: WORLD_CHARACTER,
+    Chapter: CHAPTER,
+    ConversationMessage: MESSAGE,
+    NovelRecord: NOVEL,
+    UserWorld: USER_WORLD,
+}
+
+
+def get_serializer(model):
+    return serializers[model]
+
+
+class Projection:
+    """请求的字段投影：?fields=a,b 只返回指定字段，?exclude=a,b 排除指定字段
+
+    嵌套字段用点号表示，如 fields=id,name,main_characters.name
+    """
+
+    def __init__(self, fields=None, exclude=None):
+        self.fields = set(fields) if fields is not None else None
+        self.exclude = set(exclude or ())
+
+    @classmethod
+    def from_request(cls, args, allowed):
+        """从查询参数解析投影；allowed 为可用字段（含嵌套字段），出现未知字段时抛出 ValueError"""
+        def split(name):
+            value = args.get(name)
+            return [item.strip() for item in value.split(',') if item.strip()] if value else None
+
+        fields, exclude = split('fields'), split('exclude')
+        unknown = [name for name in (fields or []) + (exclude or []) if name not in allowed]
+        if unknown:
+            raise ValueError(f"未知字段: {', '.join(unknown)}")
+        return cls(fields, exclude)
+
+    @property
+    def unrestricted(self):
+        return self.fields is None and not self.exclude
+
+    def includes(self, name):
+        if name in self.exclude:
+            return False
+        if self.fields is None:
+            return True
+        return name in self.fields or any(field.startswith(name + '.') for field in self.fields)
+
+    def nested(self, name):
+        """子对象的投影：fields=main_characters 表示子对象全部字段"""
+        prefix = name + '.'
+        exclude = [field[len(prefix):] for field in self.exclude if field.startswith(prefix)]
+        if self.fields is None or name in self.fields:
+            return Projection(None, exclude)
+        return Projection([field[len(prefix):] for field in self.fields if field.startswith(prefix)], exclude)
+
+
+def allowed_fields(serializer, extra=(), nested=None):
+    """接口可投影的字段：模型字段、接口附加字段与嵌套字段（{名称: 子序列化器}）"""
+    names = set(serializer.field_names) | set(extra)
+    for name, child in (nested or {}).items():
+        names.add(name)
+        names.update(f"{name}.{field}" for field in child.field_names)
+    return names
+
+
+def characters_by_world(world_ids, projection=None):
+    """一次查询取出多个世界的角色，返回 {world_id: [角色字典]}"""
+    result = {world_id: [] for world_id in world_ids}
+    if not world_ids:
+        return result
+    only = WORLD_CHARACTER.project(projection, always=())
+    columns = WORLD_CHARACTER.columns(only)
+    rows = db.session.execute(
+        select(WorldCharacter.world_id, *columns)
+        .where(WorldCharacter.world_id.in_(list(result)))
+        .order_by(WorldCharacter.world_id, WorldCharacter.id)
+    )
+    from_row = WORLD_CHARACTER.compile(only)[1]
+    for row in rows:
+        result[row[0]].append(from_row(row[1:]))
+    return result
+
+
+WORLD_FIELDS = allowed_fields(WORLD, nested={'main_characters': WORLD_CHARACTER})
+
+
+def serialize_worlds(rows, projection=None):
+    """世界行元组（WORLD.columns(WORLD.project(projection)) 顺序）序列化，并按需附带 main_characters"""
+    worlds = WORLD.from_rows(rows, WORLD.project(projection))
+    if projection is None or projection.includes('main_characters'):
+        nested = projection.nested('main_characters') if projection is not None else None
+        characters = characters_by_world([world['id'] for world in worlds], nested)
+        for world in worlds:
+            world['main_characters'] = characters[world['id']]
+    return worlds
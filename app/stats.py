@@ -0,0 +1,362 @@
+from datetime import datetime
+from flask.cli import with_appcontext
+from sqlalchemy import select, insert, update, delete, case, or_, func, literal, bindparam
+from sqlalchemy.dialects import postgresql, sqlite
+from app.models import db, World, Chapter, ConversationMessage, NovelRecord, ChapterStats, WorldStats, ArchivedChapter
+from app.forks import fork_chain, chain_condition, archived_entries
+from app.archive import cold_records
+from app.content import codec
+import click
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# 章节 / 世界统计（chapter_stats、world_stats）的维护
+#
+# 热路径（新增消息、小说）用一条 UPSERT 增量更新，与业务写入在同一事务内提交；
+# 低频操作（回溯、删除章节、分支、克隆、导入）按消息表与小说表重新计算受影响的章节，
+# 世界统计再由章节统计汇总。分支章节的消息数包含继承自父章节的可见消息，与 GET messages 一致；
+# 继承的部分另记在 inherited_count / inherited_chars 中，世界统计汇总时减去，只计实际存储的消息。
+# 已归档章节的消息计入统计：热表部分与归档行（archived_chapters）中记录的汇总相加。
+
+
+def _later(column, value):
+    return case((or_(column.is_(None), column < value), value), else_=column)
+
+
+def _latest(first, second):
+    """两个可能为 NULL 的列中较大的一个"""
+    return case((first.is_(None), second), (or_(second.is_(None), first >= second), first), else_=second)
+
+
+def _upsert(model, key, values, changes):
+    """按主键插入或更新一行：values 为新行的初始值，changes 为已存在时的 SET 表达式"""
+    table = model.__table__
+    dialect = db.session.get_bind(mapper=model.__mapper__).dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        statement = (postgresql.insert if dialect == 'postgresql' else sqlite.insert)(table).values(**values)
+        db.session.execute(statement.on_conflict_do_update(index_elements=[key], set_=changes))
+        return
+    # 其他数据库：先更新，不存在再插入
+    result = db.session.execute(update(table).where(table.c[key] == values[key]).values(**changes))
+    if not result.rowcount:
+        db.session.execute(insert(table).values(**values))
+
+
+def _world_of(chapter_id):
+    return select(Chapter.world_id).where(Chapter.id == chapter_id).scalar_subquery()
+
+
+def record_message(message):
+    """新增消息后调用（需已 flush 取得 id）：章节与所在世界的消息数、字符数、最新消息"""
+    now = datetime.utcnow()
+    chars = len(message.content or '')
+    created = message.create_time or now
+    _upsert(ChapterStats, 'chapter_id', {
+        'chapter_id': message.chapter_id, 'world_id': _world_of(message.chapter_id),
+        'message_count': 1, 'total_chars': chars, 'last_message_id': message.id,
+        'last_message_time': created, 'novel_count': 0, 'update_time': now,
+    }, {
+        'message_count': ChapterStats.message_count + 1,
+        'total_chars': ChapterStats.total_chars + chars,
+        'last_message_id': _later(ChapterStats.last_message_id, message.id),
+        'last_message_time': _later(ChapterStats.last_message_time, created),
+        'update_time': now,
+    })
+    _upsert(WorldStats, 'world_id', {
+        'world_id': _world_of(message.chapter_id), 'chapter_count': 0, 'message_count': 1,
+        'total_chars': chars, 'novel_count': 0, 'last_active_time': created, 'update_time': now,
+    }, {
+        'message_count': WorldStats.message_count + 1,
+        'total_chars': WorldStats.total_chars + chars,
+        'last_active_time': _later(WorldStats.last_active_time, created),
+        'update_time': now,
+    })
+
+
+def record_novel(novel):
+    """新增小说后调用：章节与所在世界的小说数"""
+    now = datetime.utcnow()
+    _upsert(ChapterStats, 'chapter_id', {
+        'chapter_id': novel.chapter_id, 'world_id': _world_of(novel.chapter_id),
+        'message_count': 0, 'total_chars': 0, 'novel_count': 1, 'update_time': now,
+    }, {'novel_count': ChapterStats.novel_count + 1, 'update_time': now})
+    _upsert(WorldStats, 'world_id', {
+        'world_id': _world_of(novel.chapter_id), 'chapter_count': 0, 'message_count': 0,
+        'total_chars': 0, 'novel_count': 1, 'update_time': now,
+    }, {'novel_count': WorldStats.novel_count + 1, 'update_time': now})
+
+
+def _content_chars(condition):
+    """满足条件的消息的正文字符数 {chapter_id: 字符数}
+
+    压缩存储时数据库只能看到压缩后的字节，需要取回正文在应用侧计算。
+    """
+    content = ConversationMessage.content
+    if not codec.enabled:
+        return dict(db.session.execute(
+            select(ConversationMessage.chapter_id, func.sum(func.length(content)))
+            .where(condition).group_by(ConversationMessage.chapter_id)
+        ).all())
+    totals = {}
+    result = db.session.execute(
+        select(ConversationMessage.chapter_id, content).where(condition).execution_options(yield_per=1000)
+    )
+    for chapter_id, text in result:
+        totals[chapter_id] = totals.get(chapter_id, 0) + len(text)
+    return totals
+
+
+def _refresh_chapter_rows(where):
+    """重新计算 where(Chapter.id 或 chapter_id 列) 选中的章节统计"""
+    now = datetime.utcnow()
+    messages = select(
+        ConversationMessage.chapter_id,
+        func.count().label('message_count'),
+        (literal(0) if codec.enabled else func.sum(func.length(ConversationMessage.content))).label('total_chars'),
+        func.max(ConversationMessage.id).label('last_message_id'),
+        func.max(ConversationMessage.create_time).label('last_message_time'),
+    ).where(where(ConversationMessage.chapter_id)).group_by(ConversationMessage.chapter_id).subquery()
+    novels = select(NovelRecord.chapter_id, func.count().label('novel_count')) \
+        .where(where(NovelRecord.chapter_id)).group_by(NovelRecord.chapter_id).subquery()
+
+    archived = ArchivedChapter.__table__
+
+    db.session.execute(delete(ChapterStats).where(where(ChapterStats.chapter_id)))
+    db.session.execute(insert(ChapterStats).from_select(
+        ['chapter_id', 'world_id', 'message_count', 'total_chars', 'last_message_id', 'last_message_time',
+         'novel_count', 'inherited_count', 'inherited_chars', 'update_time'],
+        select(
+            Chapter.id, Chapter.world_id,
+            func.coalesce(messages.c.message_count, 0) + func.coalesce(archived.c.message_count, 0),
+            func.coalesce(messages.c.total_chars, 0) + func.coalesce(archived.c.total_chars, 0),
+            _latest(messages.c.last_message_id, archived.c.last_message_id),
+            _latest(messages.c.last_message_time, archived.c.last_message_time),
+            func.coalesce(novels.c.novel_count, 0), literal(0), literal(0), literal(now, db.DateTime),
+        ).outerjoin(messages, messages.c.chapter_id == Chapter.id)
+        .outerjoin(archived, archived.c.chapter_id == Chapter.id)
+        .outerjoin(novels, novels.c.chapter_id == Chapter.id)
+        .where(where(Chapter.id))
+    ))
+    if codec.enabled:
+        chars = _content_chars(where(ConversationMessage.chapter_id))
+        if chars:
+            table = ChapterStats.__table__
+            db.session.execute(
+                update(table).where(table.c.chapter_id == bindparam('key'))
+                .values(total_chars=table.c.total_chars + bindparam('chars')),
+                [{'key': chapter_id, 'chars': total} for chapter_id, total in chars.items()]
+            )
+
+    # 分支章节再加上继承的可见消息（继承部分不会再变化，父章节回溯前分支会先被物化）
+    forks = db.session.scalars(
+        select(Chapter.id).where(where(Chapter.id), Chapter.fork_message_id.is_not(None))
+    ).all()
+    for chapter_id in forks:
+        inherited = fork_chain(chapter_id)[1:]
+        if not inherited:
+            continue
+        count, last_id, last_time = db.session.execute(
+            select(func.count(), func.max(ConversationMessage.id), func.max(ConversationMessage.create_time))
+            .where(chain_condition(inherited))
+        ).one()
+        chars = sum(_content_chars(chain_condition(inherited)).values()) if count else 0
+        for record in cold_records(archived_entries(inherited)):
+            count += 1
+            chars += len(record['content'])
+            last_id = max(last_id or 0, record['id'])
+            if record['create_time'] and (last_time is None or record['create_time'] > last_time):
+                last_time = record['create_time']
+        if not count:
+            continue
+        db.session.execute(update(ChapterStats).where(ChapterStats.chapter_id == chapter_id).values(
+            message_count=ChapterStats.message_count + count,
+            total_chars=ChapterStats.total_chars + chars,
+            inherited_count=count,
+            inherited_chars=chars,
+            last_message_id=_later(ChapterStats.last_message_id, last_id),
+            last_message_time=_later(ChapterStats.last_message_time, last_time),
+        ))
+
+
+def _refresh_world_rows(where):
+    """由章节统计汇总 where(World.id 或 world_id 列) 选中的世界统计（消息数与字符数不含分支继承的部分）"""
+    chapters = select(
+        Chapter.world_id,
+        func.count().label('chapter_count'),
+        func.sum(ChapterStats.message_count - ChapterStats.inherited_count).label('message_count'),
+        func.sum(ChapterStats.total_chars - ChapterStats.inherited_chars).label('total_chars'),
+        func.sum(ChapterStats.novel_count).label('novel_count'),
+        func.max(ChapterStats.last_message_time).label('last_active_time'),
+    ).outerjoin(ChapterStats, ChapterStats.chapter_id == Chapter.id) \
+        .where(where(Chapter.world_id)).group_by(Chapter.world_id).subquery()
+
+    db.session.execute(delete(WorldStats).where(where(WorldStats.world_id)))
+    db.session.execute(insert(WorldStats).from_select(
+        ['world_id', 'chapter_count', 'message_count', 'total_chars', 'novel_count', 'last_active_time',
+         'update_time'],
+        select(
+            World.id, func.coalesce(chapters.c.chapter_count, 0), func.coalesce(chapters.c.message_count, 0),
+            func.coalesce(chapters.c.total_chars, 0), func.coalesce(chapters.c.novel_count, 0),
+            chapters.c.last_active_time, literal(datetime.utcnow(), db.DateTime),
+        ).outerjoin(chapters, chapters.c.world_id == World.id)
+        .where(where(World.id))
+    ))
+
+
+def refresh_worlds(world_ids):
+    """世界的章节增删后调用：重新汇总这些世界的统计"""
+    world_ids = sorted({world_id for world_id in world_ids if world_id is not None})
+    if world_ids:
+        _refresh_world_rows(lambda column: column.in_(world_ids))
+
+
+def refresh_chapters(chapter_ids):
+    """章节消息被批量修改（回溯、物化、导入、分支）后调用：重新计算章节及其所在世界的统计"""
+    chapter_ids = sorted(set(chapter_ids))
+    if not chapter_ids:
+        return
+    _refresh_chapter_rows(lambda column: column.in_(chapter_ids))
+    refresh_worlds(db.session.scalars(select(Chapter.world_id).where(Chapter.id.in_(chapter_ids))).all())
+
+
+def forget_chapters(chapter_ids):
+    """删除章节前调用：删除其统计行（所在世界由调用方在删除后 refresh_worlds）"""
+    if chapter_ids:
+        db.session.execute(delete(ChapterStats).where(ChapterStats.chapter_id.in_(list(chapter_ids))))
+
+
+def forget_world(world_id):
+    """删除世界前调用"""
+    db.session.execute(delete(ChapterStats).where(ChapterStats.world_id == world_id))
+    db.session.execute(delete(WorldStats).where(WorldStats.world_id == world_id))
+
+
+def rebuild_stats(batch_size=10000):
+    """全量重建：按 id 区间分批重新计算章节统计，再汇总世界统计，每批单独提交
+
+    重建期间仍有写入时个别行可能有偏差，再运行一次即可。返回 (章节数, 世界数)。
+    """
+    started = time.perf_counter()
+    totals = []
+    for model, refresh in ((Chapter, _refresh_chapter_rows), (World, _refresh_world_rows)):
+        last_id = db.session.execute(select(func.max(model.id))).scalar() or 0
+        for start in range(1, last_id + 1, batch_size):
+            end = start + batch_size - 1
+            refresh(lambda column: column.between(start, end))
+            db.session.commit()
+        totals.append(db.session.execute(
+            select(func.count()).select_from(ChapterStats if model is Chapter else WorldStats)
+        ).scalar())
+    # 区间之外（大于当前最大 id）的已删除章节 / 世界遗留的统计行
+    db.session.execute(delete(ChapterStats).where(ChapterStats.chapter_id.not_in(select(Chapter.id))))
+    db.session.execute(delete(WorldStats).where(WorldStats.world_id.not_in(select(World.id))))
+    db.session.commit()
+    logger.info(f"统计表重建完成: 章节 {totals[0]}，世界 {totals[1]}，耗时 {time.perf_counter() - started:.1f}s")
+    return tuple(totals)
+
+
+@click.command('rebuild-stats')
+@click.option('--batch-size', default=10000, show_default=True, help='每批处理的章节 / 世界 id 区间大小')
+@with_appcontext
+def rebuild_stats_command(batch_size):
+    """全量重建 chapter_stats / world_stats"""
+    chapters, worlds = rebuild_stats(batch_size)
+    click.echo(f"chapter_stats {chapters} 行，world_stats {worlds} 行")
+
+
+class StatsOptions:
+    """列表接口的统计排序与过滤：?sort_by=、?min_messages=、?active_since=、?stats=true（附带 stats 字段）"""
+
+    def __init__(self, model, sort_by=None, min_messages=None, active_since=None, include=False):
+        self.model = model
+        self.sort_by = sort_by
+        self.min_messages = min_messages
+        self.active_since = active_since
+        self.include = include
+
+    @classmethod
+    def from_request(cls, args, model):
+        """解析查询参数，参数不合法时抛出 ValueError"""
+        sort_by = args.get('sort_by') or None
+        if sort_by is not None and sort_by not in sort_columns(model):
+            raise ValueError(f"sort_by 只支持: {', '.join(sort_columns(model))}")
+        min_messages = args.get('min_messages')
+        if min_messages is not None:
+            try:
+                min_messages = int(min_messages)
+            except ValueError:
+                raise ValueError('min_messages 必须为整数')
+        active_since = args.get('active_since')
+        if active_since is not None:
+            try:
+                active_since = datetime.fromisoformat(active_since)
+            except ValueError:
+                raise ValueError('active_since 时间格式错误')
+        include = args.get('stats', 'false').lower() == 'true'
+        return cls(model, sort_by, min_messages, active_since, include)
+
+    @property
+    def needed(self):
+        return bool(self.sort_by or self.min_messages is not None or self.active_since or self.include)
+
+    def apply(self, query, key_column, default_order):
+        """为查询联接统计表并加上过滤、排序；include 时统计列追加在行尾（顺序同 stats_columns）"""
+        if not self.needed:
+            return query.order_by(*default_order)
+        model = self.model
+        query = query.outerjoin(model, _key(model) == key_column)
+        if self.include:
+            query = query.add_columns(*stats_columns(model))
+        if self.min_messages is not None:
+            query = query.where(model.message_count >= self.min_messages)
+        if self.active_since is not None:
+            query = query.where(_last_active(model) >= self.active_since)
+        if self.sort_by:
+            query = query.order_by(sort_columns(model)[self.sort_by].desc().nulls_last())
+        return query.order_by(*default_order)
+
+    def attach(self, items, rows):
+        """把行尾的统计列序列化为各条记录的 stats 字段"""
+        if not self.include:
+            return items
+        names = [column.key for column in stats_columns(self.model)]
+        for item, row in zip(items, rows):
+            item['stats'] = {name: _stat_value(name, value) for name, value in zip(names, row[-len(names):])}
+        return items
+
+
+def _stat_value(name, value):
+    # 没有统计行（从未有过消息）的记录：计数为 0，最新消息为 null
+    if value is None:
+        return None if name.startswith('last_') else 0
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def _key(model):
+    return ChapterStats.chapter_id if model is ChapterStats else WorldStats.world_id
+
+
+def _last_active(model):
+    return ChapterStats.last_message_time if model is ChapterStats else WorldStats.last_active_time
+
+
+def sort_columns(model):
+    columns = {
+        'last_active': _last_active(model),
+        'message_count': model.message_count,
+        'novel_count': model.novel_count,
+        'total_chars': model.total_chars,
+    }
+    if model is WorldStats:
+        columns['chapter_count'] = WorldStats.chapter_count
+    return columns
+
+
+def stats_columns(model):
+    if model is ChapterStats:
+        return (ChapterStats.message_count, ChapterStats.total_chars, ChapterStats.last_message_id,
+                ChapterStats.last_message_time, ChapterStats.novel_count)
+    return (WorldStats.chapter_count, WorldStats.message_count, WorldStats.total_chars, WorldStats.novel_count,
+            WorldStats.last_active_time)
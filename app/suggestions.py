@@ -0,0 +1,289 @@
+from app.config import Config
+from app.llm_client import create_client
+from app.routing import hedged_stream, hedged_completion
+from app.tool_stream import ToolCallAccumulator
+from app.rate_limit import bind_identity
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+import json
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+client = create_client()
+
+# 定义function call的工具
+SUGGESTION_TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "generate_reply_suggestions",
+            "description": "生成6条玩家视角的回复示例，每条对应不同的情节延续方向",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "suggestion_1": {
+                        "type": "string",
+                        "description": "第一条回复示例，20-80字，中文，贴合世界观与角色身份"
+                    },
+                    "suggestion_2": {
+                        "type": "string",
+                        "description": "第二条回复示例，20-80字，中文，贴合世界观与角色身份"
+                    },
+                    "suggestion_3": {
+                        "type": "string",
+                        "description": "第三条回复示例，20-80字，中文，贴合世界观与角色身份"
+                    },
+                    "suggestion_4": {
+                        "type": "string",
+                        "description": "第四条回复示例，20-80字，中文，贴合世界观与角色身份"
+                    },
+                    "suggestion_5": {
+                        "type": "string",
+                        "description": "第五条回复示例，20-80字，中文，贴合世界观与角色身份"
+                    },
+                    "suggestion_6": {
+                        "type": "string",
+                        "description": "第六条回复示例，20-80字，中文，贴合世界观与角色身份"
+                    }
+                },
+                "required": ["suggestion_1", "suggestion_2", "suggestion_3", "suggestion_4", "suggestion_5", "suggestion_6"]
+            }
+        }
+    }
+]
+
+def build_suggestion_messages(data):
+    """根据上下文设定与历史对话构造回复建议的提示词"""
+    history = data.get("messages") or []
+
+    # 统一组装主要角色信息
+    main_characters = data.get("main_characters")
+    if isinstance(main_characters, (list, tuple)):
+        mc_text = ", ".join(map(str, main_characters))
+    elif isinstance(main_characters, dict):
+        mc_text = json.dumps(main_characters, ensure_ascii=False)
+    else:
+        mc_text = str(main_characters) if main_characters else ""
+
+    # 构造 system 提示
+    system_prompt = f"""[Role]
+你是对话回复辅助生成器，需基于上下文设定与历史对话，生成 6 条玩家视角的回复示例。所有内容必须贴合世界观、核心人物特征，且紧密承接上轮对话，强化剧情连贯性与代入感。
+
+[Output Requirements]
+1. 请使用提供的generate_reply_suggestions工具来生成6条回复示例。
+2. 每条回复必须对应不同的情节延续方向（如 "主动追问""动作回应""情绪流露" 等，避免方向重复）。
+3. 以玩家扮演的身份或者"你"为主语，镜头聚焦玩家动作与情绪。
+4. 必须承接上轮对话，自然推进情节；避免重复历史台词。
+5. 每句可由动作描写+神态刻画+对话组成，可含简短内心闪念。
+6. 简洁自然，20-80字，中文，贴合世界观与角色身份。
+7. 严格按照工具定义的参数格式输出，不要有任何额外的解释或说明。
+
+[Core Context]
+世界观：{data.get("worldview") or "无特殊设定"}
+核心人物设定：{data.get("master_sitting") or "无特定人物关系"}
+其余关系人物信息：{mc_text}
+玩家背景：{data.get("background") or "无特定场景"}
+
+[Current Conversation History]
+{json.dumps(history, ensure_ascii=False) if history else "无历史对话"}
+"""
+
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": "现在我需要你生成6条回复示例"}
+    ]
+
+def generate_suggestions(data):
+    """调用大模型生成回复建议，返回与 /api/chat/suggestions 相同结构的字典"""
+    messages = build_suggestion_messages(data)
+
+    # 创建function call响应
+    response = hedged_completion(
+        client, "chat_suggestions",
+        messages=messages,
+        tools=SUGGESTION_TOOLS,
+        tool_choice="auto",
+        temperature=0.7,
+        max_tokens=1000
+    )
+
+    # 获取function call结果
+    function_call_result = response.choices[0].message.tool_calls[0] if response.choices[0].message.tool_calls else None
+    if function_call_result:
+        # 直接返回原始的function call调用信息
+        return {
+            'id': function_call_result.id,
+            'type': function_call_result.type,
+            'function': {
+                'name': function_call_result.function.name,
+                'arguments': function_call_result.function.arguments
+            }
+        }
+
+    # 如果没有返回function call，降级处理
+    return fallback_suggestions()
+
+def fallback_suggestions():
+    """模型未返回function call时的降级处理"""
+    fallback_messages = [
+        {"role": "system", "content": "你是对话回复辅助生成器，请直接生成6条回复示例。"},
+        {"role": "user", "content": "现在我需要你生成6条回复示例"}
+    ]
+
+    fallback_response = hedged_completion(
+        client, "chat_suggestions",
+        messages=fallback_messages,
+        temperature=0.7,
+        max_tokens=600
+    )
+
+    return {"fallback_content": fallback_response.choices[0].message.content}
+
+def stream_suggestions(data, on_field=None, should_stop=None):
+    """流式生成回复建议：每条建议在参数中闭合后立即回调 on_field(name, value)
+
+    should_stop() 返回 True 时提前结束并返回 None；正常结束时返回与 generate_suggestions 相同的结构。
+    """
+    messages = build_suggestion_messages(data)
+
+    stream = hedged_stream(
+        client, "chat_suggestions",
+        messages=messages,
+        tools=SUGGESTION_TOOLS,
+        tool_choice="auto",
+        temperature=0.7,
+        max_tokens=1000
+    )
+
+    accumulator = ToolCallAccumulator()
+    for chunk in stream:
+        if should_stop and should_stop():
+            close = getattr(stream, 'close', None)
+            if close:
+                close()
+            return None
+        for name, value in accumulator.feed_chunk(chunk):
+            if on_field:
+                on_field(name, value)
+
+    function_call_data = accumulator.result()
+    if function_call_data:
+        return function_call_data
+    return fallback_suggestions()
+
+
+class _PrefetchTask:
+    """单个章节状态下的预取任务"""
+
+    def __init__(self, chapter_id, message_id):
+        self.chapter_id = chapter_id
+        self.message_id = message_id
+        self.cancelled = threading.Event()
+        self.done = threading.Event()
+        self.future = None
+
+
+class SuggestionPrefetcher:
+    """在AI回复落库后，以低优先级预先生成回复建议，并按 (chapter_id, message_id) 缓存结果
+
+    - 每个章节同时只保留一个预取任务，新的章节状态或用户抢先回复都会取消旧任务
+    - 使用独立的小线程池，避免与聊天主流程争抢工作线程
+    """
+
+    def __init__(self, max_workers=2, ttl=600, max_entries=512):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='suggestion-prefetch')
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()  # (chapter_id, message_id) -> (expires_at, payload)
+        self._pending = {}  # chapter_id -> _PrefetchTask
+
+    def schedule(self, chapter_id, message_id, data, on_ready=None):
+        """提交预取任务；on_ready(payload) 在结果生成后回调（用于 Socket.IO 推送）"""
+        task = _PrefetchTask(chapter_id, message_id)
+        with self._lock:
+            previous = self._pending.get(chapter_id)
+            if previous:
+                self._cancel_task(previous)
+            self._pending[chapter_id] = task
+        # 预取代用户调用大模型，token 用量计入触发请求的限流身份
+        task.future = self._executor.submit(bind_identity(self._run), task, data, on_ready)
+        return task
+
+    def cancel(self, chapter_id):
+        """用户抢先回复时取消该章节尚未完成的预取"""
+        with self._lock:
+            task = self._pending.pop(chapter_id, None)
+            if task:
+                self._cancel_task(task)
+        return task is not None
+
+    def get(self, chapter_id, message_id, wait=0):
+        """读取缓存；若同一状态的预取仍在进行，最多等待 wait 秒"""
+        payload = self._lookup(chapter_id, message_id)
+        if payload is not None or wait <= 0:
+            return payload
+
+        with self._lock:
+            task = self._pending.get(chapter_id)
+        if task and task.message_id == message_id and not task.cancelled.is_set():
+            task.done.wait(wait)
+            return self._lookup(chapter_id, message_id)
+        return None
+
+    def _lookup(self, chapter_id, message_id):
+        key = (chapter_id, message_id)
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            expires_at, payload = entry
+            if expires_at < time.monotonic():
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+            return payload
+
+    def _store(self, chapter_id, message_id, payload):
+        with self._lock:
+            self._cache[(chapter_id, message_id)] = (time.monotonic() + self.ttl, payload)
+            self._cache.move_to_end((chapter_id, message_id))
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def _cancel_task(self, task):
+        task.cancelled.set()
+        task.done.set()
+        if task.future:
+            task.future.cancel()
+
+    def _run(self, task, data, on_ready):
+        try:
+            if task.cancelled.is_set():
+                return
+            # 流式生成，用户抢先回复时可在中途结束
+            payload = stream_suggestions(data, should_stop=task.cancelled.is_set)
+            # 生成期间用户已经回复，则丢弃结果
+            if payload is None or task.cancelled.is_set():
+                logger.info(f"回复建议预取已取消 - chapter_id: {task.chapter_id}, message_id: {task.message_id}")
+                return
+            self._store(task.chapter_id, task.message_id, payload)
+            logger.info(f"回复建议预取完成 - chapter_id: {task.chapter_id}, message_id: {task.message_id}")
+            if on_ready:
+                on_ready(payload)
+        except Exception as e:
+            logger.error(f"回复建议预取失败: {str(e)}")
+        finally:
+            task.done.set()
+            with self._lock:
+                if self._pending.get(task.chapter_id) is task:
+                    del self._pending[task.chapter_id]
+
+
+prefetcher = SuggestionPrefetcher(
+    max_workers=Config.SUGGESTION_PREFETCH_WORKERS,
+    ttl=Config.SUGGESTION_PREFETCH_TTL
+)
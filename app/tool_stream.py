@@ -0,0 +1,144 @@
+import json
+
+
+class PartialJSONObjectParser:
+    """增量解析流式到达的JSON对象（function call 的 arguments）
+
+    每次 feed 一段文本，返回本次新闭合的顶层字段 [(key, value), ...]。
+    字符串/数组/对象字段在其结束符到达时立即返回，数字、布尔等原始值在其后的 ',' 或 '}' 到达时返回。
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._state = 'start'  # start / key / colon / value / comma / done
+        self._key_start = None
+        self._key = None
+        self._value_start = None
+
+    def feed(self, text):
+        if not text:
+            return []
+        self.buffer += text
+        fields = []
+        buf = self.buffer
+        for i in range(self._pos, len(buf)):
+            c = buf[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == '\\':
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        if self._state == 'key' and self._key_start is not None:
+                            self._key = json.loads(buf[self._key_start:i + 1])
+                            self._key_start = None
+                            self._state = 'colon'
+                        elif self._state == 'value' and self._value_start is not None:
+                            self._emit(fields, buf[self._value_start:i + 1])
+                continue
+
+            if self._state == 'done':
+                break
+            if c == '"':
+                self._in_string = True
+                if self._depth == 1:
+                    if self._state == 'key':
+                        self._key_start = i
+                    elif self._state == 'value' and self._value_start is None:
+                        self._value_start = i
+            elif c in '{[':
+                self._depth += 1
+                if self._depth == 1:
+                    self._state = 'key'
+                elif self._depth == 2 and self._state == 'value' and self._value_start is None:
+                    self._value_start = i
+            elif c in '}]':
+                self._depth -= 1
+                if self._depth == 1 and self._state == 'value' and self._value_start is not None:
+                    self._emit(fields, buf[self._value_start:i + 1])
+                elif self._depth == 0:
+                    if self._state == 'value' and self._value_start is not None:
+                        self._emit(fields, buf[self._value_start:i])
+                    self._state = 'done'
+            elif self._depth == 1:
+                if c == ':' and self._state == 'colon':
+                    self._state = 'value'
+                    self._value_start = None
+                elif c == ',':
+                    if self._state == 'value' and self._value_start is not None:
+                        self._emit(fields, buf[self._value_start:i])
+                    self._state = 'key'
+                elif self._state == 'value' and self._value_start is None and not c.isspace():
+                    self._value_start = i
+        self._pos = len(buf)
+        return fields
+
+    def _emit(self, fields, raw):
+        try:
+            fields.append((self._key, json.loads(raw.strip())))
+        except ValueError:
+            # 字段内容不是合法JSON时跳过，最终仍以完整 arguments 为准
+            pass
+        self._key = None
+        self._value_start = None
+        self._state = 'comma'
+
+
+class ToolCallAccumulator:
+    """累积流式响应中的第一个 tool call，并在参数字段闭合时返回新字段"""
+
+    def __init__(self):
+        self.id = None
+        self.type = None
+        self.name = None
+        self.arguments = ""
+        self.content = ""
+        self.parser = PartialJSONObjectParser()
+
+    def feed_chunk(self, chunk):
+        if not chunk.choices:
+            return []
+        delta = chunk.choices[0].delta
+        if getattr(delta, 'content', None):
+            self.content += delta.content
+
+        fields = []
+        for tool_call in getattr(delta, 'tool_calls', None) or []:
+            # 与非流式逻辑保持一致，只处理第一个 tool call
+            if (getattr(tool_call, 'index', 0) or 0) != 0:
+                continue
+            if getattr(tool_call, 'id', None):
+                self.id = tool_call.id
+            if getattr(tool_call, 'type', None):
+                self.type = tool_call.type
+            function = getattr(tool_call, 'function', None)
+            if function is None:
+                continue
+            if getattr(function, 'name', None):
+                self.name = function.name
+            fragment = getattr(function, 'arguments', None)
+            if fragment:
+                if not isinstance(fragment, str):
+                    fragment = json.dumps(fragment, ensure_ascii=False)
+                self.arguments += fragment
+                fields.extend(self.parser.feed(fragment))
+        return fields
+
+    def result(self):
+        """返回与非流式接口相同结构的 function call 数据；没有 tool call 时返回 None"""
+        if self.name is None:
+            return None
+        return {
+            'id': self.id,
+            'type': self.type or 'function',
+            'function': {
+                'name': self.name,
+                'arguments': self.arguments
+            }
+        }
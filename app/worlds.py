@@ -0,0 +1,312 @@
+from app.models import db, World, WorldCharacter, Chapter, UserWorld
+from app.stats import refresh_worlds
+from sqlalchemy import insert, select, literal
+from sqlalchemy.orm import aliased
+from datetime import datetime
+import json
+
+# 世界观创建的function call工具定义
+WORLD_SETTING_TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "create_world_setting",
+            "description": "创建详细的世界观设定，包括世界背景、角色信息和初始剧情",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "world_name": {
+                        "type": "string",
+                        "description": "世界的名称"
+                    },
+                    "world_description": {
+                        "type": "string",
+                        "description": "世界观的详细描述，包括地理环境、历史背景、文化特色、社会结构等"
+                    },
+                    "character_name": {
+                        "type": "string",
+                        "description": "AI主要扮演角色的名字，非用户角色"
+                    },
+                    "appearance": {
+                        "type": "string",
+                        "description": "AI主要扮演角色的外貌特征描述"
+                    },
+                    "clothing_style": {
+                        "type": "string",
+                        "description": "AI主要扮演角色的服饰风格描述"
+                    },
+                    "character_background": {
+                        "type": "string",
+                        "description": "AI主要扮演角色的背景故事描述"
+                    },
+                    "personality_traits": {
+                        "type": "string",
+                        "description": "AI主要扮演角色的性格特征描述"
+                    },
+                    "language_style": {
+                        "type": "string",
+                        "description": "AI主要扮演角色的语言风格描述"
+                    },
+                    "behavior_logic": {
+                        "type": "string",
+                        "description": "AI主要扮演角色的行为逻辑描述"
+                    },
+                    "psychological_traits": {
+                        "type": "string",
+                        "description": "AI主要扮演角色的心理特质描述"
+                    },
+                    "chapter_name": {
+                        "type": "string",
+                        "description": "章节的名称"
+                    },
+                    "opening_line": {
+                        "type": "string",
+                        "description": "章节的开场白，需为引导故事情节开始的动态场景描写，包含时间、角色互动、背景回顾、日常细节、情感铺垫和动作描写，让用户能快速代入剧情，自然开启故事"
+                    },
+                    "user_role": {
+                        "type": "string",
+                        "description": "用户在故事中的角色，需包含详细的身份背景、职业/生活状态、人际关系、性格特质、核心矛盾或坚持，内容具体且有画面感，避免简单笼统的描述"
+                    },
+                    "other_character_names": {
+                        "type": "array",
+                        "description": "其余人物的名字列表",
+                        "items": {
+                            "type": "string",
+                            "description": "人物名字"
+                        }
+                    },
+                    "other_character_backgrounds": {
+                        "type": "array",
+                        "description": "其余人物的背景故事列表，与名字列表一一对应",
+                        "items": {
+                            "type": "string",
+                            "description": "人物背景故事"
+                        }
+                    }
+                },
+                "required": ["world_name", "world_description", "character_name", "appearance", 
+                            "clothing_style", "character_background", "personality_traits", 
+                            "language_style", "behavior_logic", "psychological_traits", 
+                            "chapter_name", "opening_line", "user_role", "other_character_names", "other_character_backgrounds"]
+            }
+        }
+    }
+]
+
+
+# master_setting 中核心人物各字段的标签
+MASTER_SETTING_LABELS = [
+    ("character_name", "角色名"),
+    ("appearance", "外貌特征"),
+    ("clothing_style", "服饰风格"),
+    ("character_background", "背景故事"),
+    ("personality_traits", "性格特征"),
+    ("language_style", "语言风格"),
+    ("behavior_logic", "行为逻辑"),
+    ("psychological_traits", "心理特质"),
+]
+
+_JSON_TYPES = {
+    "string": str,
+    "array": list,
+}
+
+def validate_world_setting(arguments):
+    """按 create_world_setting 的参数定义校验 function call 参数，返回解析后的字典
+
+    校验失败时抛出 ValueError。
+    """
+    if isinstance(arguments, str):
+        try:
+            arguments = json.loads(arguments)
+        except ValueError as e:
+            raise ValueError(f"参数不是合法的JSON: {str(e)}")
+    if not isinstance(arguments, dict):
+        raise ValueError("参数必须是JSON对象")
+
+    schema = WORLD_SETTING_TOOLS[0]["function"]["parameters"]
+    for field in schema["required"]:
+        if field not in arguments:
+            raise ValueError(f"缺少{field}参数")
+
+    for field, spec in schema["properties"].items():
+        if field not in arguments:
+            continue
+        value = arguments[field]
+        if not isinstance(value, _JSON_TYPES[spec["type"]]):
+            raise ValueError(f"{field}类型错误，应为{spec['type']}")
+        if spec["type"] == "array":
+            item_type = _JSON_TYPES[spec["items"]["type"]]
+            if not all(isinstance(item, item_type) for item in value):
+                raise ValueError(f"{field}中的元素类型错误，应为{spec['items']['type']}")
+
+    if len(arguments["other_character_names"]) != len(arguments["other_character_backgrounds"]):
+        raise ValueError("other_character_names与other_character_backgrounds长度不一致")
+
+    return arguments
+
+def build_master_setting(arguments):
+    """将核心人物的各项设定拼接为 World.master_setting 文本"""
+    return "\n".join(
+        f"{label}：{arguments[field]}" for field, label in MASTER_SETTING_LABELS if arguments.get(field)
+    )
+
+def materialize_world_setting(arguments, user_id):
+    """在一个事务内落库 World、全部 WorldCharacter、默认 Chapter 与创建者 UserWorld
+
+    返回新建记录的ID；任何一步失败都会整体回滚。
+    """
+    arguments = validate_world_setting(arguments)
+    user_id = int(user_id)
+    now = datetime.utcnow()
+
+    try:
+        world = World(
+            user_id=user_id,
+            name=arguments["world_name"],
+            is_public=False,
+            worldview=arguments["world_description"],
+            master_setting=build_master_setting(arguments),
+            create_time=now,
+            popularity=0
+        )
+        db.session.add(world)
+        db.session.flush()
+
+        # 角色批量插入
+        character_rows = [
+            {"world_id": world.id, "name": name, "background": background}
+            for name, background in zip(arguments["other_character_names"], arguments["other_character_backgrounds"])
+        ]
+        character_ids = []
+        if character_rows:
+            character_ids = list(db.session.scalars(
+                insert(WorldCharacter).returning(WorldCharacter.id, sort_by_parameter_order=True),
+                character_rows
+            ))
+
+        chapter = Chapter(
+            world_id=world.id,
+            creator_user_id=user_id,
+            name=arguments["chapter_name"],
+            opening=arguments["opening_line"],
+            background=arguments["user_role"],
+            is_default=True,
+            create_time=now
+        )
+        user_world = UserWorld(
+            user_id=user_id,
+            world_id=world.id,
+            role='creator',
+            create_time=now
+        )
+        db.session.add_all([chapter, user_world])
+        db.session.flush()
+        refresh_worlds([world.id])
+
+        result = {
+            "world_id": world.id,
+            "chapter_id": chapter.id,
+            "user_world_id": user_world.id,
+            "character_ids": character_ids
+        }
+        db.session.commit()
+        return result
+    except Exception:
+        db.session.rollback()
+        raise
+
+def fork_world(source_id, user_id, name=None, is_public=False):
+    """服务端克隆世界：World、全部 WorldCharacter 与默认 Chapter 用 INSERT ... SELECT 在一个事务内复制
+
+    新世界的 origin_world_id 指向源世界，复制的章节 origin_chapter_id 指向源章节。
+    返回新建记录的ID；任何一步失败都会整体回滚。
+    """
+    user_id = int(user_id)
+    now = datetime.utcnow()
+
+    try:
+        world_id = db.session.execute(
+            insert(World).from_select(
+                ['user_id', 'name', 'tags', 'is_public', 'worldview', 'master_setting',
+                 'origin_world_id', 'create_time', 'popularity'],
+                select(
+                    literal(user_id), literal(name) if name else World.name, World.tags, literal(bool(is_public)),
+                    World.worldview, World.master_setting, World.id, literal(now), literal(0)
+                ).where(World.id == source_id)
+            ).returning(World.id)
+        ).scalar_one()
+
+        character_ids = list(db.session.scalars(
+            insert(WorldCharacter).from_select(
+                ['world_id', 'name', 'background'],
+                select(literal(world_id), WorldCharacter.name, WorldCharacter.background)
+                .where(WorldCharacter.world_id == source_id).order_by(WorldCharacter.id)
+            ).returning(WorldCharacter.id)
+        ))
+
+        chapter_rows = db.session.execute(
+            insert(Chapter).from_select(
+                ['world_id', 'creator_user_id', 'name', 'opening', 'background', 'is_default',
+                 'origin_chapter_id', 'create_time'],
+                select(
+                    literal(world_id), literal(user_id), Chapter.name, Chapter.opening, Chapter.background,
+                    Chapter.is_default, Chapter.id, literal(now)
+                ).where(Chapter.world_id == source_id, Chapter.is_default.is_(True)).order_by(Chapter.id)
+            ).returning(Chapter.id, Chapter.origin_chapter_id)
+        ).all()
+
+        user_world = UserWorld(user_id=user_id, world_id=world_id, role='creator', create_time=now)
+        db.session.add(user_world)
+        db.session.flush()
+        refresh_worlds([world_id])
+
+        result = {
+            "world_id": world_id,
+            "origin_world_id": source_id,
+            "character_ids": sorted(character_ids),
+            "chapters": sorted(
+                ({"chapter_id": chapter_id, "origin_chapter_id": origin_id} for chapter_id, origin_id in chapter_rows),
+                key=lambda item: item["chapter_id"]
+            ),
+            "user_world_id": user_world.id
+        }
+        db.session.commit()
+        return result
+    except Exception:
+        db.session.rollback()
+        raise
+
+# 世界谱系查询的最大深度，防止异常数据形成环
+MAX_LINEAGE_DEPTH = 64
+
+def world_lineage(world_id, limit=100):
+    """世界谱系：ancestors 为来源链（由近及远），derived 为全部派生世界（按层级，最多 limit 个）
+
+    两个方向都用递归 CTE 一次查出，向下查找走 origin_world_id 上的索引。
+    """
+    columns = (World.id, World.name, World.user_id, World.is_public, World.origin_world_id)
+
+    up = select(*columns, literal(0).label('depth')).where(World.id == world_id).cte('ancestors', recursive=True)
+    parent = aliased(World)
+    up = up.union_all(
+        select(parent.id, parent.name, parent.user_id, parent.is_public, parent.origin_world_id, up.c.depth + 1)
+        .join(up, parent.id == up.c.origin_world_id)
+        .where(up.c.depth < MAX_LINEAGE_DEPTH)
+    )
+
+    down = select(*columns, literal(1).label('depth')).where(World.origin_world_id == world_id) \
+        .cte('derived', recursive=True)
+    child = aliased(World)
+    down = down.union_all(
+        select(child.id, child.name, child.user_id, child.is_public, child.origin_world_id, down.c.depth + 1)
+        .join(down, child.origin_world_id == down.c.id)
+        .where(down.c.depth < MAX_LINEAGE_DEPTH)
+    )
+
+    def rows(statement):
+        return [dict(row._mapping) for row in db.session.execute(statement)]
+
+    ancestors = rows(select(up).where(up.c.depth > 0).order_by(up.c.depth))
+    derived = rows(select(down).order_by(down.c.depth, down.c.id).limit(limit))
+    return {"world_id": world_id, "ancestors": ancestors, "derived": derived}
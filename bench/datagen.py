@@ -0,0 +1,294 @@
+"""按 app/models.py 的表结构生成可复现的合成数据集
+
+规模档位（--tier）：
+    tiny    100 个世界 / 1 千章节 / 5 万消息，用于本地调试
+    small   1 千个世界 / 1 万章节 / 50 万消息
+    medium  1 万个世界 / 10 万章节 / 500 万消息
+    full    10 万个世界 / 100 万章节 / 5000 万消息
+--scale 可在档位基础上再缩放。相同的 --seed 与档位生成完全相同的数据。
+
+示例：
+    DATABASE_URL=postgresql://... python bench/datagen.py --tier small --seed 42 --truncate
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+TIERS = {
+    "tiny": {"users": 50, "worlds": 100, "chapters": 1_000, "messages": 50_000, "novels": 500},
+    "small": {"users": 500, "worlds": 1_000, "chapters": 10_000, "messages": 500_000, "novels": 5_000},
+    "medium": {"users": 5_000, "worlds": 10_000, "chapters": 100_000, "messages": 5_000_000, "novels": 50_000},
+    "full": {"users": 50_000, "worlds": 100_000, "chapters": 1_000_000, "messages": 50_000_000, "novels": 500_000},
+}
+
+TAG_POOL = ["修仙", "武侠", "奇幻", "科幻", "悬疑", "都市", "历史", "末日", "蒸汽朋克", "校园", "宫廷", "江湖", "星际", "克苏鲁"]
+SURNAMES = "沈林苏顾陆叶萧江谢白温楚慕容"
+GIVEN_NAMES = ["清霜", "长风", "若雪", "子衿", "无忧", "听澜", "寒舟", "月白", "星河", "青禾", "知秋", "念安"]
+PHRASES = [
+    "夜色如墨，檐角的风铃被晚风拨出细碎的声响。",
+    "她抬眼望向你，指尖轻轻摩挲着茶盏的边沿。",
+    "远处传来钟声，山门前的石阶覆着一层薄雪。",
+    "他沉默片刻，终于低声开口：“你真的决定要去了吗？”",
+    "烛火在她眸中跳动，映出一丝难以察觉的担忧。",
+    "街巷里人声鼎沸，卖糖画的老人抬头冲你笑了笑。",
+    "风从断崖下卷上来，吹得衣袂猎猎作响。",
+    "我上前一步，拱手道：在下初来乍到，还请指点。",
+]
+
+# 数据时间范围：过去一年
+EPOCH = datetime(2025, 1, 1)
+SPAN_SECONDS = 365 * 24 * 3600
+
+
+class Generator:
+    def __init__(self, seed, counts):
+        self.random = random.Random(seed)
+        self.counts = counts
+        self.world_owners = []
+        self.chapter_info = []
+
+    def text(self, min_len, max_len):
+        target = self.random.randint(min_len, max_len)
+        parts = []
+        size = 0
+        while size < target:
+            phrase = self.random.choice(PHRASES)
+            parts.append(phrase)
+            size += len(phrase)
+        return "".join(parts)[:target]
+
+    def name(self):
+        return self.random.choice(SURNAMES) + self.random.choice(GIVEN_NAMES)
+
+    def moment(self, after=None):
+        if after is None:
+            return EPOCH + timedelta(seconds=self.random.randrange(SPAN_SECONDS))
+        return after + timedelta(seconds=self.random.randint(5, 600))
+
+    def skewed_counts(self, total, buckets):
+        """把 total 按长尾分布分到 buckets 个桶（少数章节消息很多，多数章节消息较少）"""
+        weights = [self.random.paretovariate(1.3) for _ in range(buckets)]
+        scale = total / sum(weights)
+        counts = [int(w * scale) for w in weights]
+        for i in self.random.sample(range(buckets), total - sum(counts)):
+            counts[i] += 1
+        return counts
+
+    def users(self):
+        # 密码统一使用同一个预先计算好的哈希，避免生成时逐个计算
+        from werkzeug.security import generate_password_hash
+        password = generate_password_hash("bench-password")
+        for user_id in range(1, self.counts["users"] + 1):
+            yield {"id": user_id, "username": f"bench_user_{user_id}", "password": password,
+                   "create_time": self.moment()}
+
+    def worlds(self):
+        users = self.counts["users"]
+        for world_id in range(1, self.counts["worlds"] + 1):
+            owner = self.random.randint(1, users)
+            self.world_owners.append(owner)
+            origin = self.random.randrange(1, world_id) if world_id > 1 and self.random.random() < 0.05 else None
+            yield {
+                "id": world_id,
+                "user_id": owner,
+                "name": f"{self.random.choice(TAG_POOL)}之境·{world_id}",
+                "tags": self.random.sample(TAG_POOL, self.random.randint(1, 4)),
+                "is_public": self.random.random() < 0.6,
+                "worldview": self.text(200, 800),
+                "master_setting": self.text(100, 400),
+                "origin_world_id": origin,
+                "create_time": self.moment(),
+                "popularity": int(self.random.paretovariate(1.2) * 10),
+            }
+
+    def characters(self):
+        character_id = 0
+        for world_id in range(1, self.counts["worlds"] + 1):
+            for _ in range(self.random.randint(1, 5)):
+                character_id += 1
+                yield {"id": character_id, "world_id": world_id, "name": self.name(), "background": self.text(50, 200)}
+
+    def chapters(self):
+        """返回章节行，同时记录每个章节的 (world_id, creator, create_time) 供消息与小说使用"""
+        worlds = self.counts["worlds"]
+        users = self.counts["users"]
+        for chapter_id in range(1, self.counts["chapters"] + 1):
+            # 前 worlds 个章节为各世界的默认章节，由世界创建者创建
+            if chapter_id <= worlds:
+                world_id = chapter_id
+                creator = self.world_owners[world_id - 1]
+            else:
+                world_id = self.random.randint(1, worlds)
+                creator = self.random.randint(1, users)
+            created = self.moment()
+            self.chapter_info.append((world_id, creator, created))
+            yield {
+                "id": chapter_id,
+                "world_id": world_id,
+                "creator_user_id": creator,
+                "name": "默认章节" if chapter_id <= worlds else f"第{chapter_id}章",
+                "opening": self.text(50, 200),
+                "background": self.text(30, 120),
+                "is_default": chapter_id <= worlds,
+                "origin_chapter_id": None,
+                "create_time": created,
+            }
+
+    def user_worlds(self):
+        users = self.counts["users"]
+        row_id = 0
+        for world_id in range(1, self.counts["worlds"] + 1):
+            members = {self.world_owners[world_id - 1]: "creator"}
+            for _ in range(self.random.randint(0, 3)):
+                members.setdefault(self.random.randint(1, users), self.random.choice(("participant", "viewer")))
+            for user_id, role in members.items():
+                row_id += 1
+                yield {"id": row_id, "user_id": user_id, "world_id": world_id, "role": role, "create_time": self.moment()}
+
+    def messages(self):
+        per_chapter = self.skewed_counts(self.counts["messages"], self.counts["chapters"])
+        message_id = 0
+        for chapter_index, count in enumerate(per_chapter):
+            _, creator, created = self.chapter_info[chapter_index]
+            moment = created
+            for turn in range(count):
+                message_id += 1
+                moment = self.moment(moment)
+                is_user = turn % 2 == 1
+                yield {
+                    "id": message_id,
+                    "chapter_id": chapter_index + 1,
+                    "user_id": creator,
+                    "role": "user" if is_user else "ai",
+                    # AI 正文的“正文：”前缀存为 flags 标记位
+                    "content": self.text(10, 60) if is_user else self.text(30, 100),
+                    "flags": 0 if is_user else 1,
+                    "create_time": moment,
+                }
+
+    def novels(self):
+        chapters = self.counts["chapters"]
+        for novel_id in range(1, self.counts["novels"] + 1):
+            chapter_id = self.random.randint(1, chapters)
+            _, creator, created = self.chapter_info[chapter_id - 1]
+            yield {
+                "id": novel_id,
+                "chapter_id": chapter_id,
+                "user_id": creator,
+                "title": f"{self.name()}的故事",
+                "content": "# 标题\n\n" + self.text(1000, 4000),
+                "create_time": self.moment(created),
+                "popularity": int(self.random.paretovariate(1.2) * 5),
+            }
+
+
+def _insert(model, rows, batch_size):
+    from sqlalchemy import insert
+    from app.models import db
+
+    table = model.__table__
+    started = time.perf_counter()
+    total = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            db.session.execute(insert(table), batch)
+            db.session.commit()
+            total += len(batch)
+            batch = []
+    if batch:
+        db.session.execute(insert(table), batch)
+        db.session.commit()
+        total += len(batch)
+    elapsed = time.perf_counter() - started
+    print(f"{table.name:<24}{total:>12} 行 {elapsed:>8.1f}s", flush=True)
+    return total
+
+
+def _reset_sequences(tables):
+    """PostgreSQL：显式写入主键后把序列推进到当前最大值"""
+    from sqlalchemy import text
+    from app.models import db
+
+    if db.engine.dialect.name != "postgresql":
+        return
+    for table in tables:
+        db.session.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), COALESCE((SELECT MAX(id) FROM {table.name}), 1))"
+        ))
+    db.session.commit()
+
+
+def _truncate(tables):
+    from sqlalchemy import text
+    from app.models import db
+
+    if db.engine.dialect.name == "postgresql":
+        db.session.execute(text("TRUNCATE " + ", ".join(t.name for t in tables) + " RESTART IDENTITY CASCADE"))
+    else:
+        for table in reversed(tables):
+            db.session.execute(table.delete())
+    db.session.commit()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="生成合成数据集")
+    parser.add_argument("--tier", choices=sorted(TIERS), default="tiny")
+    parser.add_argument("--scale", type=float, default=1.0, help="在档位基础上的缩放系数")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--batch-size", type=int, default=5_000)
+    parser.add_argument("--truncate", action="store_true", help="生成前清空全部业务表（不可恢复）")
+    return parser.parse_args(argv)
+
+
+def tier_counts(tier, scale):
+    counts = {name: max(1, int(count * scale)) for name, count in TIERS[tier].items()}
+    counts["chapters"] = max(counts["chapters"], counts["worlds"])  # 每个世界至少有默认章节
+    return counts
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    counts = tier_counts(args.tier, args.scale)
+    print(f"档位 {args.tier} x{args.scale}，种子 {args.seed}: {counts}")
+
+    from app import create_app
+    from app.models import (
+        db, User, World, WorldCharacter, Chapter, UserWorld, ConversationMessage, NovelRecord, ChapterStats, WorldStats
+    )
+    from app.stats import rebuild_stats
+
+    models = [User, World, WorldCharacter, Chapter, UserWorld, ConversationMessage, NovelRecord, ChapterStats, WorldStats]
+    tables = [model.__table__ for model in models]
+    generator = Generator(args.seed, counts)
+
+    app = create_app()
+    with app.app_context():
+        if args.truncate:
+            _truncate(tables)
+        elif db.session.query(World.id).first() is not None:
+            raise SystemExit("数据库中已有数据，使用 --truncate 清空后再生成")
+
+        started = time.perf_counter()
+        _insert(User, generator.users(), args.batch_size)
+        # 世界的 origin_world_id 只引用更小的 id，按 id 顺序插入即可满足外键
+        _insert(World, generator.worlds(), args.batch_size)
+        _insert(WorldCharacter, generator.characters(), args.batch_size)
+        _insert(Chapter, generator.chapters(), args.batch_size)
+        _insert(UserWorld, generator.user_worlds(), args.batch_size)
+        _insert(ConversationMessage, generator.messages(), args.batch_size)
+        _insert(NovelRecord, generator.novels(), args.batch_size)
+        _reset_sequences([table for table in tables if "id" in table.c])
+        # 统计表按生成的数据整体重建
+        rebuild_stats()
+        print(f"完成，总耗时 {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+"""/api/db 接口基准测试
+
+对 bench/datagen.py 生成的数据集逐个调用 /api/db 接口，记录耗时（p50/p95）、SQL 语句数、
+扫描行数（仅 PostgreSQL，基于 EXPLAIN ANALYZE）与响应体积，结果追加到 bench/results/db_bench.jsonl
+（--output 可指定其他路径，该目录不纳入版本控制），并与同一标签的上一次结果对比，便于跨提交追踪。
+
+示例：
+    DATABASE_URL=postgresql://... python bench/db_bench.py --label small
+    python bench/db_bench.py --label small --writes        # 同时测试写接口（会修改数据）
+    python bench/db_bench.py --label small --only worlds,chapter_messages_hot
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+RESULTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results", "db_bench.jsonl")
+
+_SCAN_NODES = ("Seq Scan", "Index Scan", "Index Only Scan", "Bitmap Heap Scan")
+
+
+class StatementCapture:
+    """统计请求期间执行的语句，可选保存语句与参数用于 EXPLAIN"""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.active = False
+        self.keep = False
+        self.count = 0
+        self.statements = []
+        event.listen(engine, "before_cursor_execute", self._before)
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        if not self.active:
+            return
+        self.count += 1
+        if self.keep and not executemany and statement.lstrip().upper().startswith("SELECT"):
+            self.statements.append((statement, parameters))
+
+    def start(self, keep=False):
+        self.active, self.keep, self.count, self.statements = True, keep, 0, []
+
+    def stop(self):
+        self.active = False
+
+
+def _rows_scanned(plan):
+    """累加计划树中扫描节点读取的行数（含被过滤掉的行）"""
+    total = 0
+    if plan.get("Node Type") in _SCAN_NODES:
+        loops = plan.get("Actual Loops", 1)
+        total += (plan.get("Actual Rows", 0) + plan.get("Rows Removed by Filter", 0)) * loops
+    for child in plan.get("Plans") or []:
+        total += _rows_scanned(child)
+    return total
+
+
+def explain_rows(db, statements):
+    if db.engine.dialect.name != "postgresql":
+        return None
+    total = 0
+    with db.engine.connect() as conn:
+        for statement, parameters in statements:
+            result = conn.exec_driver_sql("EXPLAIN (ANALYZE, FORMAT JSON) " + statement, parameters)
+            plan = result.scalar()
+            plan = json.loads(plan) if isinstance(plan, str) else plan
+            total += _rows_scanned(plan[0]["Plan"])
+        conn.rollback()
+    return total
+
+
+def pick_samples(db):
+    """选取有代表性的数据：消息最多的章节（热点）与中位章节、章节最多的世界、小说最多的用户与章节"""
+    from sqlalchemy import func
+    from app.models import World, Chapter, ConversationMessage, NovelRecord, UserWorld
+
+    hot_chapter = db.session.query(ConversationMessage.chapter_id).group_by(ConversationMessage.chapter_id).order_by(
+        func.count().desc()).limit(1).scalar()
+    chapter_count = db.session.query(func.count(Chapter.id)).scalar() or 0
+    typical_chapter = db.session.query(Chapter.id).order_by(Chapter.id).offset(chapter_count // 2).limit(1).scalar()
+    hot_world = db.session.query(Chapter.world_id).group_by(Chapter.world_id).order_by(
+        func.count().desc()).limit(1).scalar()
+    world_creator = db.session.query(Chapter.creator_user_id).filter(Chapter.world_id == hot_world).limit(1).scalar()
+    novel_user = db.session.query(NovelRecord.user_id).group_by(NovelRecord.user_id).order_by(
+        func.count().desc()).limit(1).scalar()
+    novel_chapter = db.session.query(NovelRecord.chapter_id).group_by(NovelRecord.chapter_id).order_by(
+        func.count().desc()).limit(1).scalar()
+    member_user = db.session.query(UserWorld.user_id).filter(UserWorld.role == 'participant').group_by(
+        UserWorld.user_id).order_by(func.count().desc()).limit(1).scalar()
+    novel_id = db.session.query(func.max(NovelRecord.id)).scalar()
+    # 写测试中被删除的世界：取 id 最大的若干个非热点世界
+    victims = [row[0] for row in db.session.query(World.id).filter(World.id != hot_world).order_by(
+        World.id.desc()).limit(50)]
+    return {
+        "hot_chapter": hot_chapter, "typical_chapter": typical_chapter, "hot_world": hot_world,
+        "world_creator": world_creator, "novel_user": novel_user, "novel_chapter": novel_chapter,
+        "member_user": member_user,
+        "novel_id": novel_id, "victim_worlds": victims,
+    }
+
+
+def build_cases(samples, writes):
+    """(名称, 方法, 路径或生成路径的函数, 请求体或生成函数)；函数接收第 i 次执行的序号"""
+    s = samples
+    cases = [
+        ("worlds", "GET", "/api/db/worlds", None),
+        ("world_detail", "GET", f"/api/db/worlds/{s['hot_world']}", None),
+        ("world_chapters", "GET", f"/api/db/worlds/{s['hot_world']}/chapters", None),
+        ("world_chapters_by_creator", "GET",
+         f"/api/db/worlds/{s['hot_world']}/chapters?creator_user_id={s['world_creator']}", None),
+        ("chapter_detail", "GET", f"/api/db/chapters/{s['hot_chapter']}", None),
+        ("chapter_messages_hot", "GET", f"/api/db/chapters/{s['hot_chapter']}/messages", None),
+        ("chapter_messages_typical", "GET", f"/api/db/chapters/{s['typical_chapter']}/messages", None),
+        ("novels", "GET", "/api/db/novels", None),
+        ("novels_by_user", "GET", f"/api/db/novels?user_id={s['novel_user']}&sort_by=popularity", None),
+        ("chapter_novels", "GET", f"/api/db/chapters/{s['novel_chapter']}/novels", None),
+        ("user_worlds", "GET", f"/api/db/user-worlds?user_id={s['member_user']}&role=participant", None),
+        ("worlds_summary", "GET", "/api/db/worlds?fields=id,name,tags,popularity,main_characters.name", None),
+        ("user_dashboard", "GET", f"/api/db/users/{s['world_creator']}/dashboard", None),
+        ("worlds_by_activity", "GET", "/api/db/worlds?fields=id,name&sort_by=last_active&stats=true", None),
+        ("world_chapters_by_messages", "GET",
+         f"/api/db/worlds/{s['hot_world']}/chapters?fields=id,name&sort_by=message_count&stats=true", None),
+    ]
+    if not writes:
+        return cases
+
+    chapter = s["typical_chapter"]
+    user = s["world_creator"]
+    cases += [
+        ("auth_login", "POST", "/api/db/auth", {"username": "bench_user_1", "password": "bench-password"}),
+        ("create_world", "POST", "/api/db/worlds", lambda i: {
+            "user_id": user, "name": f"基准世界{i}", "tags": ["基准"], "is_public": False,
+            "worldview": "基准测试", "master_setting": "基准测试",
+            "characters": [{"name": "甲", "background": "乙"}]
+        }),
+        ("create_chapter", "POST", "/api/db/chapters", lambda i: {
+            "world_id": s["hot_world"], "creator_user_id": user, "name": f"基准章节{i}"
+        }),
+        ("create_message", "POST", f"/api/db/chapters/{chapter}/messages", lambda i: {
+            "user_id": user, "role": "ai", "content": f"正文：基准消息{i}"
+        }),
+        ("create_novel", "POST", f"/api/db/chapters/{chapter}/novels", lambda i: {
+            "user_id": user, "title": f"基准小说{i}", "content": "# 基准\n\n内容"
+        }),
+        ("world_popularity", "POST", f"/api/db/worlds/{s['hot_world']}/increase-popularity", None),
+        ("novel_popularity", "POST", f"/api/db/novels/{s['novel_id']}/increase-popularity", None),
+        ("delete_messages", "DELETE", lambda i: f"/api/db/chapters/{chapter}/messages?id={10 ** 12}", None),
+        ("delete_world", "DELETE", lambda i: f"/api/db/worlds/{s['victim_worlds'][i % len(s['victim_worlds'])]}", None),
+    ]
+    return cases
+
+
+def run_case(client, db, capture, case, repeat, warmup, explain):
+    name, method, path, body = case
+    latencies, sizes, statements = [], [], []
+    rows = None
+    for i in range(warmup + repeat):
+        url = path(i) if callable(path) else path
+        payload = body(i) if callable(body) else body
+        measured = i >= warmup
+        capture.start(keep=explain and i == warmup)
+        started = time.perf_counter()
+        response = client.open(url, method=method, json=payload)
+        elapsed = time.perf_counter() - started
+        capture.stop()
+        if response.status_code >= 500:
+            raise RuntimeError(f"{name} 返回 {response.status_code}: {response.get_data(as_text=True)[:200]}")
+        if not measured:
+            continue
+        latencies.append(elapsed * 1000)
+        sizes.append(len(response.get_data()))
+        statements.append(capture.count)
+        if explain and i == warmup and method == "GET":
+            rows = explain_rows(db, capture.statements)
+    ordered = sorted(latencies)
+    return {
+        "p50_ms": round(statistics.median(ordered), 2),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 2),
+        "statements": int(statistics.median(statements)),
+        "rows_scanned": rows,
+        "response_bytes": int(statistics.median(sizes)),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except Exception:
+        return None
+
+
+def previous_result(path, label):
+    if not os.path.exists(path):
+        return None
+    previous = None
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            if record.get("label") == label:
+                previous = record
+    return previous
+
+
+def _delta(current, before):
+    if before in (None, 0) or current is None:
+        return ""
+    return f"{(current - before) / before * 100:+.0f}%"
+
+
+def report(results, previous):
+    base = (previous or {}).get("results", {})
+    header = f"{'endpoint':<28}{'p50(ms)':>10}{'Δ':>7}{'p95(ms)':>10}{'sql':>6}{'rows':>10}{'bytes':>12}{'Δ':>7}"
+    print(header)
+    print("-" * len(header))
+    for name, result in results.items():
+        before = base.get(name, {})
+        rows = "-" if result["rows_scanned"] is None else result["rows_scanned"]
+        print(f"{name:<28}{result['p50_ms']:>10.2f}{_delta(result['p50_ms'], before.get('p50_ms')):>7}"
+              f"{result['p95_ms']:>10.2f}{result['statements']:>6}{rows:>10}{result['response_bytes']:>12}"
+              f"{_delta(result['response_bytes'], before.get('response_bytes')):>7}")
+    if previous:
+        print(f"对比基准：{previous.get('revision')} @ {previous.get('timestamp')}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="/api/db 接口基准测试")
+    parser.add_argument("--label", default="default", help="结果标签，通常为数据集档位")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--only", default=None, help="逗号分隔，只运行指定接口")
+    parser.add_argument("--writes", action="store_true", help="同时测试写接口（会修改、删除数据）")
+    parser.add_argument("--no-explain", action="store_true", help="不统计扫描行数")
+    parser.add_argument("--no-save", action="store_true", help="不写入结果文件")
+    parser.add_argument("--output", default=RESULTS_FILE, help="结果文件（JSONL，追加写入）")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.environ.setdefault("ZHIPU_API_KEY", "offline")
+    os.environ.setdefault("LLM_PROVIDER", "fake")
+    # 首页聚合默认按用户缓存，基准中关闭以测量实际查询
+    os.environ.setdefault("DASHBOARD_CACHE_TTL", "0")
+
+    from app import create_app
+    from app.models import db
+
+    app = create_app()
+    with app.app_context():
+        capture = StatementCapture(db.engine)
+        samples = pick_samples(db)
+        if samples["hot_chapter"] is None:
+            raise SystemExit("数据库中没有数据，请先运行 bench/datagen.py")
+        cases = build_cases(samples, args.writes)
+        if args.only:
+            wanted = {name.strip() for name in args.only.split(",")}
+            cases = [case for case in cases if case[0] in wanted]
+
+        client = app.test_client()
+        results = {}
+        for case in cases:
+            results[case[0]] = run_case(client, db, capture, case, args.repeat, args.warmup, not args.no_explain)
+
+    previous = previous_result(args.output, args.label)
+    report(results, previous)
+    if not args.no_save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "a", encoding="utf-8") as f:
+            f.write(json.dumps({
+                "label": args.label, "revision": git_revision(),
+                "timestamp": datetime.now().isoformat(timespec="seconds"),
+                "samples": {k: v for k, v in samples.items() if k != "victim_worlds"},
+                "results": results,
+            }, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+"""大模型相关接口的压测脚本
+
+默认在进程内运行（Flask test_client + SocketIO test_client），并将大模型切换为
+离线假实现（LLM_PROVIDER=fake），无需网络；也可通过 --base-url 压测已启动的服务。
+
+示例：
+    python bench/loadtest.py --users 20 --duration 30
+    python bench/loadtest.py --scenarios chat_stream,suggestions --fake-ttft 0.5 --fake-tps 60
+    python bench/loadtest.py --base-url http://localhost:4000 --users 10 --iterations 5
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+ALL_SCENARIOS = ("chat", "suggestions", "analyze", "novel", "chat_stream", "world_creator")
+SOCKET_SCENARIOS = {"chat_stream", "world_creator"}
+
+SAMPLE_CONTEXT = {
+    "worldview": "大陆被群山分割，修仙宗门与凡俗王朝并立，灵气日渐稀薄。",
+    "master_sitting": "沈清霜，青云宗外门弟子，外冷内热，说话简短，擅长剑术。",
+    "background": "你是一名初入宗门的散修，身世成谜。",
+    "main_characters": ["沈清霜", "林长老", "小师弟阿竹"],
+}
+SAMPLE_MESSAGES = [
+    {"role": "ai", "content": "开场白：山门前的石阶覆着薄雪，沈清霜抱剑而立，目光落在你身上。"},
+    {"role": "user", "content": "我上前一步，拱手道：在下初来乍到，还请师姐指点。"},
+    {"role": "ai", "content": "正文：她微微颔首，转身向山道走去：“跟上，别掉队。”"},
+    {"role": "user", "content": "我快步跟上，问她宗门里可有什么规矩。"},
+]
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(p / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class Recorder:
+    """线程安全地收集每个场景的耗时与成功/失败次数"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, scenario, elapsed, ok):
+        with self._lock:
+            if ok:
+                self.latencies.setdefault(scenario, []).append(elapsed)
+            else:
+                self.errors[scenario] = self.errors.get(scenario, 0) + 1
+
+    def report(self, wall_time):
+        names = sorted(set(self.latencies) | set(self.errors))
+        header = f"{'scenario':<16}{'ok':>7}{'err':>6}{'rps':>9}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'max(ms)':>10}"
+        lines = [header, "-" * len(header)]
+        total_ok = total_err = 0
+        for name in names:
+            values = self.latencies.get(name, [])
+            errors = self.errors.get(name, 0)
+            total_ok += len(values)
+            total_err += errors
+            lines.append(
+                f"{name:<16}{len(values):>7}{errors:>6}{len(values) / wall_time:>9.2f}"
+                f"{percentile(values, 50) * 1000:>10.1f}{percentile(values, 95) * 1000:>10.1f}"
+                f"{percentile(values, 99) * 1000:>10.1f}{(max(values) if values else 0) * 1000:>10.1f}"
+            )
+        lines.append("-" * len(header))
+        lines.append(f"总计 {total_ok} 成功 / {total_err} 失败，耗时 {wall_time:.1f}s，吞吐 {total_ok / wall_time:.2f} req/s")
+        return "\n".join(lines)
+
+
+def _payload(user_index):
+    return dict(SAMPLE_CONTEXT, messages=list(SAMPLE_MESSAGES), userId=user_index + 1)
+
+
+class InProcessTransport:
+    """进程内驱动：直接调用 Flask 应用与 SocketIO 处理器"""
+
+    def __init__(self):
+        from app import create_app
+        from app.routes.websocket import socketio
+        self.app = create_app()
+        self.socketio = socketio
+
+    def user(self):
+        return _InProcessUser(self)
+
+
+class _InProcessUser:
+    def __init__(self, transport):
+        self.http = transport.app.test_client()
+        self.socket = None
+        self._transport = transport
+
+    def post(self, path, body):
+        response = self.http.post(path, json=body)
+        return response.status_code, response.get_json(silent=True)
+
+    def get(self, path):
+        response = self.http.get(path)
+        return response.status_code, response.get_json(silent=True)
+
+    def socket_call(self, event, body, end_events, error_events):
+        if self.socket is None:
+            self.socket = self._transport.socketio.test_client(self._transport.app, flask_test_client=self.http)
+            self.socket.get_received()
+        # threading 模式下 test_client 的 emit 同步执行处理器，返回时事件已全部收到
+        self.socket.emit(event, body)
+        received = [item["name"] for item in self.socket.get_received()]
+        if any(name in error_events for name in received):
+            return False
+        return any(name in end_events for name in received)
+
+    def close(self):
+        if self.socket is not None and self.socket.is_connected():
+            self.socket.disconnect()
+
+
+class HTTPTransport:
+    """压测已启动的服务：REST 使用 urllib，Socket.IO 需要安装 python-socketio 客户端依赖"""
+
+    def __init__(self, base_url, timeout):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def user(self):
+        return _HTTPUser(self)
+
+
+class _HTTPUser:
+    def __init__(self, transport):
+        self._transport = transport
+        self.socket = None
+
+    def _request(self, method, path, body=None):
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        request = urllib.request.Request(
+            self._transport.base_url + path, data=data, method=method,
+            headers={"Content-Type": "application/json"}
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self._transport.timeout) as response:
+                return response.status, json.loads(response.read() or b"null")
+        except urllib.error.HTTPError as e:
+            return e.code, None
+
+    def post(self, path, body):
+        return self._request("POST", path, body)
+
+    def get(self, path):
+        return self._request("GET", path)
+
+    def socket_call(self, event, body, end_events, error_events):
+        if self.socket is None:
+            import socketio  # python-socketio 客户端，需要 requests / websocket-client
+            self.socket = socketio.Client()
+            self._outcome = {}
+            self._finished = threading.Event()
+            for name in end_events | error_events:
+                self.socket.on(name, self._make_handler(name in error_events))
+            self.socket.connect(self._transport.base_url, wait_timeout=self._transport.timeout)
+        self._outcome.clear()
+        self._finished.clear()
+        self.socket.emit(event, body)
+        if not self._finished.wait(self._transport.timeout):
+            return False
+        return self._outcome.get("ok", False)
+
+    def _make_handler(self, is_error):
+        def handler(*args):
+            self._outcome["ok"] = not is_error
+            self._finished.set()
+        return handler
+
+    def close(self):
+        if self.socket is not None:
+            self.socket.disconnect()
+
+
+def run_scenario(user, scenario, user_index, novel_timeout):
+    """执行一次场景，返回是否成功"""
+    body = _payload(user_index)
+    if scenario == "chat":
+        status, data = user.post("/api/chat", body)
+        return status == 200 and data is not None and "error" not in data
+    if scenario == "suggestions":
+        status, data = user.post("/api/chat/suggestions", body)
+        return status == 200 and data is not None and "error" not in data
+    if scenario == "analyze":
+        status, data = user.post("/api/chat/analyze", body)
+        return status == 200 and data is not None and "error" not in data
+    if scenario == "novel":
+        body["prompt"] = "以沈清霜的视角，写一段她第一次带新弟子巡山的故事。"
+        status, data = user.post("/api/novel", body)
+        if status != 200 or not data or "task_id" not in data:
+            return False
+        deadline = time.monotonic() + novel_timeout
+        while time.monotonic() < deadline:
+            status, task = user.get(f"/api/novel/status/{data['task_id']}")
+            if status == 200 and task and task.get("status") in ("completed", "failed"):
+                return task["status"] == "completed"
+            time.sleep(0.05)
+        return False
+    if scenario == "chat_stream":
+        return user.socket_call("chat_stream", body, {"chat_stream_end"}, {"chat_stream_error"})
+    if scenario == "world_creator":
+        return user.socket_call(
+            "world-creator",
+            {"message": "一个蒸汽与魔法并存的浮空群岛世界", "userId": user_index + 1},
+            {"world_creator_end"}, {"world_creator_error"}
+        )
+    raise ValueError(f"未知场景: {scenario}")
+
+
+def worker(transport, user_index, scenarios, recorder, stop_at, iterations, novel_timeout, seed):
+    rng = random.Random(seed + user_index)
+    user = transport.user()
+    count = 0
+    try:
+        while (iterations is None or count < iterations) and (stop_at is None or time.monotonic() < stop_at):
+            scenario = rng.choice(scenarios)
+            started = time.perf_counter()
+            try:
+                ok = run_scenario(user, scenario, user_index, novel_timeout)
+            except Exception as e:
+                print(f"[user {user_index}] {scenario} 异常: {e}", file=sys.stderr)
+                ok = False
+            recorder.record(scenario, time.perf_counter() - started, ok)
+            count += 1
+    finally:
+        try:
+            user.close()
+        except Exception:
+            pass
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="大模型接口压测（默认进程内 + 离线假模型）")
+    parser.add_argument("--users", type=int, default=10, help="并发模拟用户数")
+    parser.add_argument("--duration", type=float, default=20.0, help="压测时长（秒），与 --iterations 二选一")
+    parser.add_argument("--iterations", type=int, default=None, help="每个用户执行的请求数")
+    parser.add_argument("--scenarios", default=",".join(ALL_SCENARIOS), help="逗号分隔的场景列表")
+    parser.add_argument("--base-url", default=None, help="压测已启动的服务，例如 http://localhost:4000")
+    parser.add_argument("--timeout", type=float, default=120.0, help="单次请求超时（秒）")
+    parser.add_argument("--novel-timeout", type=float, default=300.0, help="小说任务轮询超时（秒）")
+    parser.add_argument("--seed", type=int, default=0, help="场景选择与假模型的随机种子")
+    parser.add_argument("--fake-ttft", type=float, default=None, help="假模型首 token 延迟（秒）")
+    parser.add_argument("--fake-tps", type=float, default=None, help="假模型输出速率（token/秒）")
+    parser.add_argument("--fake-error-rate", type=float, default=None, help="假模型错误率（0~1）")
+    parser.add_argument("--real-llm", action="store_true", help="进程内模式下仍使用真实大模型")
+    return parser.parse_args(argv)
+
+
+def configure_environment(args):
+    """进程内模式：在导入应用前设置环境变量（Config 在导入时读取）"""
+    if not args.real_llm:
+        os.environ["LLM_PROVIDER"] = "fake"
+        os.environ.setdefault("FAKE_LLM_SEED", str(args.seed))
+    for name, value in (("FAKE_LLM_TTFT", args.fake_ttft), ("FAKE_LLM_TOKENS_PER_SEC", args.fake_tps),
+                        ("FAKE_LLM_ERROR_RATE", args.fake_error_rate)):
+        if value is not None:
+            os.environ[name] = str(value)
+    # 压测关注处理能力，默认关闭限流与回复建议预取
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+    os.environ.setdefault("SUGGESTION_PREFETCH_ENABLED", "false")
+    os.environ.setdefault("ZHIPU_API_KEY", "offline")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(ALL_SCENARIOS)
+    if unknown:
+        raise SystemExit(f"未知场景: {', '.join(sorted(unknown))}")
+
+    if args.base_url:
+        transport = HTTPTransport(args.base_url, args.timeout)
+        try:
+            import socketio  # noqa: F401
+        except ImportError:
+            skipped = [s for s in scenarios if s in SOCKET_SCENARIOS]
+            if skipped:
+                print(f"未安装 python-socketio 客户端，跳过场景: {', '.join(skipped)}", file=sys.stderr)
+            scenarios = [s for s in scenarios if s not in SOCKET_SCENARIOS]
+    else:
+        configure_environment(args)
+        transport = InProcessTransport()
+    if not scenarios:
+        raise SystemExit("没有可执行的场景")
+
+    recorder = Recorder()
+    stop_at = None if args.iterations else time.monotonic() + args.duration
+    threads = [
+        threading.Thread(
+            target=worker,
+            args=(transport, i, scenarios, recorder, stop_at, args.iterations, args.novel_timeout, args.seed),
+            daemon=True
+        )
+        for i in range(args.users)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print(recorder.report(time.perf_counter() - started))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""大模型调用录制与回放的端到端回归测试
+
+录制（需要 ZHIPU_API_KEY，调用真实模型；--upstream fake 录制离线假模型，无需网络）：
+    python bench/replay.py record --cassette bench/cassettes/handlers.jsonl
+
+回放（无网络），与基线对比耗时与响应体积，超出容忍度时以非零状态退出：
+    python bench/replay.py replay --cassette bench/cassettes/handlers.jsonl --baseline bench/cassettes/handlers.baseline.json
+    python bench/replay.py replay --cassette ... --baseline ... --update-baseline
+
+不等待录制的延迟、只比较响应体积（用于 pytest，耗时对比交给上面的完整回放）：
+    python bench/replay.py replay --cassette ... --baseline ... --speed 0 --size-only
+
+场景经过真实的处理器：handle_chat_stream、chat_suggestions、handle_world_creator、generate_novel_async
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from loadtest import SAMPLE_CONTEXT, SAMPLE_MESSAGES
+
+SCENARIOS = ("chat_stream", "chat_suggestions", "world_creator", "novel")
+
+WORLD_CREATOR_MESSAGE = "一个蒸汽与魔法并存的浮空群岛世界"
+NOVEL_PROMPT = "以沈清霜的视角，写一段她第一次带新弟子巡山的故事。"
+
+
+def _size(payload):
+    return len(json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+
+
+class HandlerRunner:
+    """在进程内通过 Flask / SocketIO 测试客户端调用真实处理器"""
+
+    def __init__(self, novel_timeout):
+        from app import create_app
+        from app.routes.websocket import socketio
+        self.app = create_app()
+        self.http = self.app.test_client()
+        self.socket = socketio.test_client(self.app, flask_test_client=self.http)
+        self.socket.get_received()
+        self.novel_timeout = novel_timeout
+
+    def _socket(self, event, body, end_event):
+        self.socket.emit(event, body)
+        received = self.socket.get_received()
+        names = [item["name"] for item in received]
+        if end_event not in names:
+            raise RuntimeError(f"{event} 未正常结束，收到事件: {names}")
+        return sum(_size(item["args"]) for item in received)
+
+    def chat_stream(self):
+        body = dict(SAMPLE_CONTEXT, messages=list(SAMPLE_MESSAGES))
+        return self._socket("chat_stream", body, "chat_stream_end")
+
+    def chat_suggestions(self):
+        body = dict(SAMPLE_CONTEXT, messages=list(SAMPLE_MESSAGES))
+        response = self.http.post("/api/chat/suggestions", json=body)
+        if response.status_code != 200:
+            raise RuntimeError(f"chat_suggestions 返回 {response.status_code}: {response.get_data(as_text=True)}")
+        return len(response.get_data())
+
+    def world_creator(self):
+        return self._socket("world-creator", {"message": WORLD_CREATOR_MESSAGE}, "world_creator_end")
+
+    def novel(self):
+        body = dict(SAMPLE_CONTEXT, prompt=NOVEL_PROMPT)
+        response = self.http.post("/api/novel", json=body)
+        task_id = response.get_json()["task_id"]
+        deadline = time.monotonic() + self.novel_timeout
+        while time.monotonic() < deadline:
+            task = self.http.get(f"/api/novel/status/{task_id}").get_json()
+            if task.get("status") == "completed":
+                return _size(task.get("result"))
+            if task.get("status") == "failed":
+                raise RuntimeError(f"小说生成失败: {task.get('error')}")
+            time.sleep(0.01)
+        raise RuntimeError("小说生成超时")
+
+
+def run(runner, scenarios, repeat):
+    results = {}
+    for name in scenarios:
+        latencies, sizes = [], []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            sizes.append(getattr(runner, name)())
+            latencies.append((time.perf_counter() - started) * 1000)
+        results[name] = {
+            "latency_ms": round(statistics.median(latencies), 1),
+            "response_bytes": int(statistics.median(sizes)),
+        }
+    return results
+
+
+def compare(results, baseline, tolerance, slack_ms, check_latency=True):
+    """返回超出容忍度的回归项；check_latency=False 时只比较响应体积"""
+    regressions = []
+    for name, current in results.items():
+        expected = baseline.get(name)
+        if not expected:
+            continue
+        limit = expected["latency_ms"] * (1 + tolerance) + slack_ms
+        if check_latency and current["latency_ms"] > limit:
+            regressions.append(f"{name}: 耗时 {current['latency_ms']}ms 超过基线 {expected['latency_ms']}ms")
+        if abs(current["response_bytes"] - expected["response_bytes"]) > expected["response_bytes"] * tolerance:
+            regressions.append(
+                f"{name}: 响应体积 {current['response_bytes']}B 与基线 {expected['response_bytes']}B 偏差过大"
+            )
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="大模型调用录制/回放回归测试")
+    parser.add_argument("mode", choices=("record", "replay"))
+    parser.add_argument("--cassette", default="bench/cassettes/handlers.jsonl")
+    parser.add_argument("--upstream", choices=("zhipu", "fake"), default="zhipu",
+                        help="录制时调用的模型：zhipu 为真实模型，fake 为离线假模型（FAKE_LLM_* 配置）")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="逗号分隔的场景列表")
+    parser.add_argument("--repeat", type=int, default=3, help="每个场景执行次数（取中位数）")
+    parser.add_argument("--speed", type=float, default=1.0, help="回放速度倍数，0 表示不等待")
+    parser.add_argument("--loose", action="store_true", help="请求未精确命中时按同类请求回放")
+    parser.add_argument("--baseline", default=None, help="基线文件（JSON）")
+    parser.add_argument("--update-baseline", action="store_true", help="用本次结果覆盖基线")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允许的相对偏差")
+    parser.add_argument("--slack-ms", type=float, default=50.0, help="耗时比较的绝对余量（毫秒）")
+    parser.add_argument("--size-only", action="store_true", help="只比较响应体积，不比较耗时")
+    parser.add_argument("--novel-timeout", type=float, default=300.0)
+    return parser.parse_args(argv)
+
+
+def configure_environment(args):
+    """在导入应用前设置环境变量（Config 在导入时读取）"""
+    os.environ["LLM_PROVIDER"] = args.mode
+    os.environ["LLM_CASSETTE"] = args.cassette
+    os.environ["LLM_REPLAY_SPEED"] = str(args.speed)
+    os.environ["LLM_REPLAY_STRICT"] = "false" if args.loose else "true"
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+    os.environ.setdefault("SUGGESTION_PREFETCH_ENABLED", "false")
+    os.environ["LLM_RECORD_UPSTREAM"] = args.upstream
+    if args.mode == "replay" or args.upstream == "fake":
+        os.environ.setdefault("ZHIPU_API_KEY", "offline")
+    elif os.path.exists(args.cassette):
+        os.remove(args.cassette)  # 重新录制时覆盖旧文件
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"未知场景: {', '.join(sorted(unknown))}")
+    if args.mode == "record":
+        args.repeat = 1  # 每个请求录制一次，回放时循环使用
+
+    configure_environment(args)
+    results = run(HandlerRunner(args.novel_timeout), scenarios, args.repeat)
+    for name, result in results.items():
+        print(f"{name:<18}{result['latency_ms']:>10.1f}ms{result['response_bytes']:>10}B")
+
+    if args.mode == "record":
+        print(f"已录制到 {args.cassette}")
+        return
+    if not args.baseline:
+        return
+    if args.update_baseline or not os.path.exists(args.baseline):
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2, sort_keys=True)
+        print(f"基线已写入 {args.baseline}")
+        return
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance, args.slack_ms, check_latency=not args.size_only)
+    for line in regressions:
+        print(f"回归: {line}", file=sys.stderr)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+import itertools
+import os
+import sys
+import tempfile
+
+import pytest
+
+# 配置在导入 app 时读取：测试使用临时 SQLite 库与离线假模型，不访问网络
+_DB_DIR = tempfile.mkdtemp(prefix='ai-fantasy-tests-')
+os.environ.update({
+    'DATABASE_URL': f"sqlite:///{os.path.join(_DB_DIR, 'test.db')}",
+    'ZHIPU_API_KEY': 'test',
+    'LLM_PROVIDER': 'fake',
+    'FAKE_LLM_TTFT': '0',
+    'FAKE_LLM_TOKENS_PER_SEC': '0',
+    'RATE_LIMIT_ENABLED': 'false',
+    'SUGGESTION_PREFETCH_ENABLED': 'false',
+    'ANALYSIS_AUTO_ENABLED': 'false',
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app  # noqa: E402
+from app.models import db  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def app():
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+_usernames = itertools.count(1)
+
+
+@pytest.fixture
+def make_user(client):
+    """注册一个新用户，返回其 id"""
+    def make(prefix='user'):
+        response = client.post('/api/db/auth', json={'username': f'{prefix}-{next(_usernames)}', 'password': 'secret'})
+        return response.get_json()['user_id']
+    return make
@@ -0,0 +1,41 @@
+from app.analysis import save_analysis, latest_analysis
+from app.models import db
+
+
+def _chapter_with_messages(client, user_id, count):
+    world = client.post('/api/db/worlds', json={'user_id': user_id, 'name': '分析世界'}).get_json()
+    chapter = client.post('/api/db/chapters', json={
+        'world_id': world['id'], 'creator_user_id': user_id, 'name': '第一章'
+    }).get_json()
+    ids = [
+        client.post(f"/api/db/chapters/{chapter['id']}/messages",
+                    json={'user_id': user_id, 'role': 'user', 'content': f'消息{i}'}).get_json()['id']
+        for i in range(count)
+    ]
+    return chapter['id'], ids
+
+
+def test_rewind_discards_analysis_of_deleted_messages(app, client, make_user):
+    user_id = make_user()
+    chapter_id, ids = _chapter_with_messages(client, user_id, 5)
+    with app.app_context():
+        save_analysis(chapter_id, '到第五条为止的分析', ids[4], 5, 15)
+        db.session.commit()
+    assert client.get(f'/api/db/chapters/{chapter_id}/analysis').get_json()['analysis'] == '到第五条为止的分析'
+
+    # 回溯到第二条之后再继续对话，被删除分支上的分析不能再返回
+    assert client.delete(f'/api/db/chapters/{chapter_id}/messages?id={ids[2]}').status_code == 200
+    client.post(f'/api/db/chapters/{chapter_id}/messages', json={'user_id': user_id, 'role': 'user', 'content': '新的消息'})
+    assert client.get(f'/api/db/chapters/{chapter_id}/analysis').status_code == 404
+    with app.app_context():
+        assert latest_analysis(chapter_id) is None
+
+
+def test_rewind_after_analysed_point_keeps_analysis(app, client, make_user):
+    user_id = make_user()
+    chapter_id, ids = _chapter_with_messages(client, user_id, 5)
+    with app.app_context():
+        save_analysis(chapter_id, '到第三条为止的分析', ids[2], 3, 9)
+        db.session.commit()
+    client.delete(f'/api/db/chapters/{chapter_id}/messages?id={ids[3]}')
+    assert client.get(f'/api/db/chapters/{chapter_id}/analysis').get_json()['analysis'] == '到第三条为止的分析'
@@ -0,0 +1,87 @@
+import pytest
+from sqlalchemy import func, select
+
+from app import archive
+from app.archive import archive_chapter, thaw_chapters
+from app.models import db, ArchivedChapter, ConversationMessage
+
+
+def _chapter(client, user_id, count=4):
+    world = client.post('/api/db/worlds', json={'user_id': user_id, 'name': '归档世界'}).get_json()
+    chapter = client.post('/api/db/chapters', json={
+        'world_id': world['id'], 'creator_user_id': user_id, 'name': '第一章'
+    }).get_json()
+    for i in range(count):
+        role = 'user' if i % 2 == 0 else 'ai'
+        content = f'消息{i}' if role == 'user' else f'正文：回复{i}'
+        client.post(f"/api/db/chapters/{chapter['id']}/messages", json={'user_id': user_id, 'role': role, 'content': content})
+    return chapter['id']
+
+
+def _hot_rows(chapter_id):
+    return db.session.execute(
+        select(ConversationMessage.id, ConversationMessage.user_id, ConversationMessage.role,
+               ConversationMessage.content, ConversationMessage.flags, ConversationMessage.create_time)
+        .where(ConversationMessage.chapter_id == chapter_id).order_by(ConversationMessage.id)
+    ).all()
+
+
+@pytest.mark.parametrize('codec', ['zstd', 'zlib'])
+def test_archive_then_thaw_restores_identical_rows(app, client, make_user, monkeypatch, codec):
+    if codec == 'zlib':
+        monkeypatch.setattr(archive, 'zstandard', None)
+    elif archive.zstandard is None:
+        pytest.skip('未安装 zstandard')
+    chapter_id = _chapter(client, make_user())
+    before_api = client.get(f'/api/db/chapters/{chapter_id}/messages').get_json()
+    with app.app_context():
+        before = _hot_rows(chapter_id)
+        assert archive_chapter(chapter_id) == 4
+        db.session.commit()
+        assert _hot_rows(chapter_id) == []
+        stored = db.session.get(ArchivedChapter, chapter_id)
+        assert (stored.codec, stored.message_count, stored.last_message_id) == (codec, 4, before[-1][0])
+
+    # 归档期间读取透明回退到冷数据
+    assert client.get(f'/api/db/chapters/{chapter_id}/messages').get_json() == before_api
+
+    with app.app_context():
+        assert thaw_chapters([chapter_id]) == 4
+        db.session.commit()
+        assert _hot_rows(chapter_id) == before
+        assert db.session.get(ArchivedChapter, chapter_id) is None
+    assert client.get(f'/api/db/chapters/{chapter_id}/messages').get_json() == before_api
+
+
+def test_messages_added_after_archiving_are_merged_on_the_next_run(app, client, make_user):
+    user_id = make_user()
+    chapter_id = _chapter(client, user_id, count=2)
+    with app.app_context():
+        archive_chapter(chapter_id)
+        db.session.commit()
+    client.post(f'/api/db/chapters/{chapter_id}/messages', json={'user_id': user_id, 'role': 'user', 'content': '归档后的消息'})
+    contents = [m['content'] for m in client.get(f'/api/db/chapters/{chapter_id}/messages').get_json()]
+    assert contents == ['消息0', '正文：回复1', '归档后的消息']
+
+    with app.app_context():
+        assert archive_chapter(chapter_id) == 1
+        db.session.commit()
+        assert db.session.get(ArchivedChapter, chapter_id).message_count == 3
+    assert [m['content'] for m in client.get(f'/api/db/chapters/{chapter_id}/messages').get_json()] == contents
+
+
+def test_rewind_thaws_archived_history_before_deleting(app, client, make_user):
+    chapter_id = _chapter(client, make_user())
+    ids = [m['id'] for m in client.get(f'/api/db/chapters/{chapter_id}/messages').get_json()]
+    with app.app_context():
+        archive_chapter(chapter_id)
+        db.session.commit()
+        # 回溯点早于归档中的最后一条消息，才需要解冻
+        assert thaw_chapters([chapter_id], from_message_id=ids[-1] + 1) == 0
+
+    assert client.delete(f'/api/db/chapters/{chapter_id}/messages?id={ids[2]}').status_code == 200
+    assert [m['id'] for m in client.get(f'/api/db/chapters/{chapter_id}/messages').get_json()] == ids[:2]
+    with app.app_context():
+        assert db.session.get(ArchivedChapter, chapter_id) is None
+        count = db.session.scalar(select(func.count()).where(ConversationMessage.chapter_id == chapter_id))
+        assert count == 2
@@ -0,0 +1,54 @@
+import json
+
+from app.models import db
+
+
+def _batch(client, requests):
+    response = client.post('/api/db/batch', json={'requests': requests})
+    return response.status_code, json.loads(response.data)
+
+
+def test_batch_returns_sub_responses_in_order(client, make_user):
+    user_id = make_user()
+    world = client.post('/api/db/worlds', json={'user_id': user_id, 'name': '批量世界'}).get_json()
+
+    status, body = _batch(client, [
+        f"worlds/{world['id']}?fields=name",
+        f"/api/db/worlds/{world['id']}/chapters",
+        '/worlds/999999999',
+        f"worlds/{world['id']}?fields=name",
+    ])
+    assert status == 200
+    responses = body['responses']
+    assert [(item['index'], item['status']) for item in responses] == [(0, 200), (1, 200), (2, 404), (3, 200)]
+    assert responses[0]['path'] == f"/api/db/worlds/{world['id']}?fields=name"
+    assert responses[0]['body'] == {'id': world['id'], 'name': '批量世界'}
+    assert responses[1]['body'] == []
+    assert responses[3]['body'] == responses[0]['body']
+
+
+def test_batch_rejects_bad_requests(client):
+    assert _batch(client, [])[0] == 400
+    assert _batch(client, [{'path': 'worlds', 'method': 'POST'}])[0] == 400
+    assert _batch(client, ['worlds'] * 21)[0] == 400
+
+    # 子请求不能嵌套批量请求
+    status, body = _batch(client, ['/api/db/batch'])
+    assert status == 200
+    assert body['responses'][0]['status'] == 400
+
+
+def test_failed_sub_request_rolls_back_shared_session(app, client, monkeypatch):
+    rollbacks = []
+    original = db.session.rollback
+    monkeypatch.setattr(db.session, 'rollback', lambda: (rollbacks.append(True), original()))
+
+    def broken(world_id):
+        raise RuntimeError('statement timeout')
+    monkeypatch.setitem(app.view_functions, 'db.get_world_detail', broken)
+
+    status, body = _batch(client, ['worlds/1', 'worlds'])
+    assert status == 200
+    assert [item['status'] for item in body['responses']] == [500, 200]
+    assert body['responses'][0]['body'] == {'error': 'statement timeout'}
+    assert rollbacks
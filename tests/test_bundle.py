@@ -0,0 +1,125 @@
+import io
+import zipfile
+
+import pytest
+from sqlalchemy import select
+
+from app.archive import archive_chapter
+from app.models import db, UserWorld
+
+
+def _messages(client, chapter_id):
+    return [message['content'] for message in client.get(f'/api/db/chapters/{chapter_id}/messages').get_json()]
+
+
+def _world_with_forks(client, user_id):
+    """G 有 5 条消息；P 在 G 的第 3 条处分支并有自己的消息；F 在 P 继承的第 2 条处分支（孙分支）"""
+    world = client.post('/api/db/worlds', json={'user_id': user_id, 'name': '分支世界'}).get_json()
+    grand = client.post('/api/db/chapters', json={
+        'world_id': world['id'], 'creator_user_id': user_id, 'name': 'G'
+    }).get_json()
+    ids = []
+    for i in range(5):
+        role = 'user' if i % 2 == 0 else 'ai'
+        content = f'消息{i}' if role == 'user' else f'正文：消息{i}'
+        message = client.post(f"/api/db/chapters/{grand['id']}/messages",
+                              json={'user_id': user_id, 'role': role, 'content': content}).get_json()
+        ids.append(message['id'])
+    parent = client.post(f"/api/db/chapters/{grand['id']}/fork",
+                         json={'creator_user_id': user_id, 'message_id': ids[2], 'name': 'P'}).get_json()
+    client.post(f"/api/db/chapters/{parent['id']}/messages", json={'user_id': user_id, 'role': 'user', 'content': 'P自己的消息'})
+    child = client.post(f"/api/db/chapters/{parent['id']}/fork",
+                        json={'creator_user_id': user_id, 'message_id': ids[1], 'name': 'F'}).get_json()
+    client.post(f"/api/db/chapters/{child['id']}/messages", json={'user_id': user_id, 'role': 'user', 'content': 'F自己的消息'})
+    return world, {'G': grand['id'], 'P': parent['id'], 'F': child['id']}
+
+
+def _chapters_by_name(client, world_id):
+    return {chapter['name']: chapter for chapter in client.get(f'/api/db/worlds/{world_id}/chapters?stats=true').get_json()}
+
+
+@pytest.mark.parametrize('archived', [False, True])
+def test_bundle_round_trip_keeps_fork_history(app, client, make_user, archived):
+    user_id = make_user()
+    world, chapters = _world_with_forks(client, user_id)
+    if archived:
+        # 祖先章节已冷归档时，分支点落在冷数据中
+        with app.app_context():
+            archive_chapter(chapters['G'])
+            db.session.commit()
+    before = {name: _messages(client, chapter_id) for name, chapter_id in chapters.items()}
+    assert before['F'] == ['消息0', '正文：消息1', 'F自己的消息']
+    assert before['P'] == ['消息0', '正文：消息1', '消息2', 'P自己的消息']
+
+    bundle = client.get(f"/api/db/worlds/{world['id']}/bundle").data
+    response = client.post(f'/api/db/worlds/import?user_id={user_id}', data=bundle, content_type='application/zip')
+    assert response.status_code == 201, response.get_json()
+    imported = _chapters_by_name(client, response.get_json()['world']['id'])
+
+    for name in ('G', 'P', 'F'):
+        assert _messages(client, imported[name]['id']) == before[name]
+    assert imported['F']['origin_chapter_id'] == imported['P']['id']
+    assert imported['P']['origin_chapter_id'] == imported['G']['id']
+    original = _chapters_by_name(client, world['id'])
+    for name in ('G', 'P', 'F'):
+        assert imported[name]['stats']['message_count'] == original[name]['stats']['message_count']
+
+
+def test_bundle_import_rejects_truncated_bundle(client, make_user):
+    user_id = make_user()
+    world, _ = _world_with_forks(client, user_id)
+    source = zipfile.ZipFile(io.BytesIO(client.get(f"/api/db/worlds/{world['id']}/bundle").data))
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as bundle:
+        for name in source.namelist():
+            data = source.read(name)
+            if name == 'messages.ndjson':
+                data = b'\n'.join(data.splitlines()[:-1]) + b'\n'
+            bundle.writestr(name, data)
+    response = client.post(f'/api/db/worlds/import?user_id={user_id}', data=buffer.getvalue(),
+                           content_type='application/zip')
+    assert response.status_code == 400
+
+
+def test_bundle_round_trip_keeps_characters_novels_and_members(app, client, make_user):
+    owner, member, importer = make_user(), make_user(), make_user()
+    world = client.post('/api/db/worlds', json={
+        'user_id': owner, 'name': '成员世界', 'worldview': '群岛',
+        'characters': [{'name': '阿青', 'background': '铁匠之女'}, {'name': '老周', 'background': '退役镖师'}]
+    }).get_json()
+    client.post('/api/db/user-worlds', json={'user_id': owner, 'world_id': world['id'], 'role': 'creator'})
+    client.post('/api/db/user-worlds', json={'user_id': member, 'world_id': world['id'], 'role': 'participant'})
+    chapter = client.post('/api/db/chapters', json={
+        'world_id': world['id'], 'creator_user_id': member, 'name': '第一章'
+    }).get_json()
+    client.post(f"/api/db/chapters/{chapter['id']}/messages", json={'user_id': member, 'role': 'user', 'content': '你好'})
+    client.post(f"/api/db/chapters/{chapter['id']}/novels", json={'user_id': member, 'title': '短篇', 'content': '小说正文'})
+
+    bundle = client.get(f"/api/db/worlds/{world['id']}/bundle").data
+    response = client.post(f'/api/db/worlds/import?user_id={importer}', data=bundle, content_type='application/zip')
+    assert response.status_code == 201, response.get_json()
+    imported = response.get_json()['world']
+
+    assert imported['id'] != world['id'] and imported['user_id'] == importer
+    assert imported['worldview'] == '群岛'
+    assert [c['name'] for c in imported['main_characters']] == ['阿青', '老周']
+    with app.app_context():
+        members = db.session.execute(
+            select(UserWorld.user_id, UserWorld.role).where(UserWorld.world_id == imported['id'])
+        ).all()
+    assert sorted(members) == sorted([(importer, 'creator'), (member, 'participant')])
+    [new_chapter] = _chapters_by_name(client, imported['id']).values()
+    # 用户按用户名对应到目标库中的同一用户
+    assert new_chapter['creator_user_id'] == member
+    novels = client.get(f"/api/db/chapters/{new_chapter['id']}/novels").get_json()
+    assert [(n['title'], n['content'], n['user_id']) for n in novels] == [('短篇', '小说正文', member)]
+
+
+def test_bundle_import_rejects_unknown_format(client, make_user):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as bundle:
+        bundle.writestr('manifest.json', '{"format": "other", "version": 1}')
+    response = client.post(f'/api/db/worlds/import?user_id={make_user()}', data=buffer.getvalue(),
+                           content_type='application/zip')
+    assert response.status_code == 400
+    assert '不支持的世界包格式' in response.get_json()['error']
@@ -0,0 +1,69 @@
+import random
+
+import pytest
+
+from app.content import ContentCodec, ZSTD_MAGIC, message_text, split_body, train_dictionary
+
+zstandard = pytest.importorskip('zstandard')
+
+TEXT = '夜色如墨，檐角的风铃被晚风拨出细碎的声响。她抬眼望向你，低声开口：“你真的决定要去了吗？”' * 20
+
+
+def _dictionary(seed):
+    words = ['风铃', '夜色', '茶盏', '烛火', '城门', '镖师', '客栈', '长剑', '细雨', '月光', '渡口', '铁匠']
+    rng = random.Random(seed)
+    samples = ['，'.join(rng.choice(words) for _ in range(60)) + f'。第{i}段' for i in range(2000)]
+    return train_dictionary(samples, dict_size=4096)
+
+
+@pytest.fixture(scope='module')
+def dict_paths(tmp_path_factory):
+    paths = []
+    for seed in (1, 2):
+        path = tmp_path_factory.mktemp('dicts') / f'content-{seed}.dict'
+        path.write_bytes(_dictionary(seed))
+        paths.append(str(path))
+    return paths
+
+
+def test_body_prefix_is_stored_as_a_flag():
+    content, flags = split_body('正文：她笑了', 'ai')
+    assert (content, flags) == ('她笑了', 1)
+    assert message_text(content, flags) == '正文：她笑了'
+    assert split_body('正文：玩家的话', 'user') == ('正文：玩家的话', 0)
+
+
+def test_legacy_and_short_values_are_plain_utf8():
+    codec = ContentCodec(enabled=True, min_bytes=64)
+    # 迁移前的旧数据与过短的正文以 UTF-8 原文存储
+    assert codec.decompress('旧数据'.encode('utf-8')) == '旧数据'
+    assert codec.decompress(memoryview('旧数据'.encode('utf-8'))) == '旧数据'
+    assert codec.compress('短') == '短'.encode('utf-8')
+    assert not codec.is_compressed('短'.encode('utf-8'))
+
+
+def test_long_text_round_trips_compressed():
+    codec = ContentCodec(enabled=True)
+    data = codec.compress(TEXT)
+    assert data[:4] == ZSTD_MAGIC and codec.is_compressed(data)
+    assert len(data) < len(TEXT.encode('utf-8'))
+    assert codec.decompress(data) == TEXT
+    # 关闭压缩后仍能读取已压缩的数据
+    assert ContentCodec(enabled=False).decompress(data) == TEXT
+
+
+def test_frames_keep_their_dictionary_id_across_rotation(dict_paths):
+    old_dict, new_dict = dict_paths
+    old_codec = ContentCodec(enabled=True, dict_paths=[old_dict])
+    old_data = old_codec.compress(TEXT)
+    old_id = zstandard.get_frame_parameters(old_data).dict_id
+    assert old_id == old_codec.dicts[0].dict_id() != 0
+
+    # 新字典放在首位用于压缩，旧字典保留用于解压
+    rotated = ContentCodec(enabled=True, dict_paths=[new_dict, old_dict])
+    new_data = rotated.compress(TEXT)
+    assert zstandard.get_frame_parameters(new_data).dict_id == rotated.dicts[0].dict_id() != old_id
+    assert rotated.decompress(old_data) == rotated.decompress(new_data) == TEXT
+
+    with pytest.raises(ValueError, match=str(old_id)):
+        ContentCodec(enabled=True, dict_paths=[new_dict]).decompress(old_data)
@@ -0,0 +1,62 @@
+def _dashboard_world_ids(client, user_id):
+    response = client.get(f'/api/db/users/{user_id}/dashboard')
+    worlds = response.get_json()['worlds']
+    return {world['id'] for role in worlds.values() for world in role}
+
+
+def _shared_world(client, make_user):
+    creator, participant = make_user(), make_user()
+    world = client.post('/api/db/worlds', json={'user_id': creator, 'name': '共享世界'}).get_json()
+    client.post('/api/db/user-worlds', json={'user_id': creator, 'world_id': world['id'], 'role': 'creator'})
+    client.post('/api/db/user-worlds', json={'user_id': participant, 'world_id': world['id'], 'role': 'participant'})
+    return world['id'], creator, participant
+
+
+def test_delete_world_invalidates_all_members(client, make_user):
+    world_id, creator, participant = _shared_world(client, make_user)
+    # 预热缓存
+    assert world_id in _dashboard_world_ids(client, creator)
+    assert world_id in _dashboard_world_ids(client, participant)
+
+    # 删除请求不带 user_id
+    assert client.delete(f'/api/db/worlds/{world_id}').status_code == 200
+    assert world_id not in _dashboard_world_ids(client, creator)
+    assert world_id not in _dashboard_world_ids(client, participant)
+
+
+def test_chapter_write_invalidates_other_members(client, make_user):
+    world_id, creator, participant = _shared_world(client, make_user)
+    _dashboard_world_ids(client, participant)
+    chapter = client.post('/api/db/chapters', json={
+        'world_id': world_id, 'creator_user_id': creator, 'name': '新章节'
+    }).get_json()
+    worlds = client.get(f'/api/db/users/{participant}/dashboard').get_json()['worlds']['participant']
+    assert chapter['id'] in [item['id'] for world in worlds for item in world['chapters']]
+
+    assert client.delete(f"/api/db/chapters/{chapter['id']}").status_code == 200
+    worlds = client.get(f'/api/db/users/{participant}/dashboard').get_json()['worlds']['participant']
+    assert chapter['id'] not in [item['id'] for world in worlds for item in world['chapters']]
+
+
+def test_dashboard_aggregates_worlds_chapters_and_novels(client, make_user):
+    world_id, creator, participant = _shared_world(client, make_user)
+    chapter = client.post('/api/db/chapters', json={
+        'world_id': world_id, 'creator_user_id': creator, 'name': '第一章', 'opening': '很长的开场白'
+    }).get_json()
+    client.post(f"/api/db/chapters/{chapter['id']}/novels", json={'user_id': creator, 'title': '短篇', 'content': '小说正文'})
+
+    response = client.get(f'/api/db/users/{creator}/dashboard')
+    assert response.headers['X-Cache'] == 'MISS'
+    dashboard = response.get_json()
+    [world] = dashboard['worlds']['creator']
+    assert dashboard['worlds']['participant'] == dashboard['worlds']['viewer'] == []
+    assert world['id'] == world_id and world['main_characters'] == []
+    # 章节与小说只返回摘要字段
+    assert [(item['id'], 'opening' in item) for item in world['chapters']] == [(chapter['id'], False)]
+    [novel] = dashboard['recent_novels']
+    assert (novel['title'], novel['chapter_name'], novel['world_id'], 'content' in novel) == ('短篇', '第一章', world_id, False)
+    assert client.get(f'/api/db/users/{creator}/dashboard').headers['X-Cache'] == 'HIT'
+
+    # 投影的参数组合单独缓存
+    world = client.get(f'/api/db/users/{creator}/dashboard?fields=name').get_json()['worlds']['creator'][0]
+    assert world == {'id': world_id, 'name': '共享世界'}
@@ -0,0 +1,16 @@
+from app import create_app
+from app.config import Config
+
+
+def test_query_headers_follow_debug_mode_set_after_create_app(monkeypatch):
+    monkeypatch.setattr(Config, 'DB_QUERY_PROFILING', True)
+    monkeypatch.setattr(Config, 'DB_QUERY_HEADERS', False)
+    app = create_app()
+    client = app.test_client()
+
+    assert 'X-DB-Queries' not in client.get('/api/db/worlds').headers
+    # run.py 在 create_app 之后才经 socketio.run(debug=True) 开启调试模式
+    app.debug = True
+    response = client.get('/api/db/worlds')
+    assert int(response.headers['X-DB-Queries']) >= 1
+    assert float(response.headers['X-DB-Time']) >= 0
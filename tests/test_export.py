@@ -0,0 +1,76 @@
+import gzip
+import json
+
+from app.archive import archive_chapter
+from app.models import db
+
+
+def _records(response):
+    return [json.loads(line) for line in response.data.decode('utf-8').splitlines()]
+
+
+def _world(client, user_id):
+    world = client.post('/api/db/worlds', json={
+        'user_id': user_id, 'name': '导出世界', 'characters': [{'name': '阿青', 'background': '铁匠之女'}]
+    }).get_json()
+    chapters = []
+    for name in ('第一章', '第二章'):
+        chapter = client.post('/api/db/chapters', json={
+            'world_id': world['id'], 'creator_user_id': user_id, 'name': name
+        }).get_json()
+        for i in range(3):
+            client.post(f"/api/db/chapters/{chapter['id']}/messages",
+                        json={'user_id': user_id, 'role': 'user', 'content': f'{name}消息{i}'})
+        chapters.append(chapter['id'])
+    client.post(f'/api/db/chapters/{chapters[0]}/novels', json={'user_id': user_id, 'title': '短篇', 'content': '小说正文'})
+    return world['id'], chapters
+
+
+def test_world_export_streams_every_record_in_order(client, make_user):
+    world_id, chapters = _world(client, make_user())
+    response = client.get(f'/api/db/worlds/{world_id}/export')
+
+    assert response.mimetype == 'application/x-ndjson'
+    assert f'world-{world_id}.ndjson' in response.headers['Content-Disposition']
+    records = _records(response)
+    assert [record['type'] for record in records] == ['world', 'chapter', 'chapter'] + ['message'] * 6 + ['novel']
+    assert records[0]['main_characters'] == [{'name': '阿青', 'background': '铁匠之女'}]
+    assert [record['content'] for record in records if record['type'] == 'message'] == [
+        f'{name}消息{i}' for name in ('第一章', '第二章') for i in range(3)
+    ]
+
+
+def test_gzip_export_decompresses_to_the_same_records(client, make_user):
+    world_id, _ = _world(client, make_user())
+    plain = client.get(f'/api/db/worlds/{world_id}/export').data
+    compressed = client.get(f'/api/db/worlds/{world_id}/export?gzip=true')
+
+    assert compressed.mimetype == 'application/gzip'
+    assert gzip.decompress(compressed.data) == plain
+
+
+def test_world_export_merges_archived_chapters(app, client, make_user):
+    world_id, chapters = _world(client, make_user())
+    before = _records(client.get(f'/api/db/worlds/{world_id}/export'))
+    with app.app_context():
+        archive_chapter(chapters[0])
+        db.session.commit()
+
+    assert _records(client.get(f'/api/db/worlds/{world_id}/export')) == before
+
+
+def test_chapter_export_includes_inherited_fork_messages(client, make_user):
+    user_id = make_user()
+    _, chapters = _world(client, user_id)
+    messages = client.get(f'/api/db/chapters/{chapters[0]}/messages').get_json()
+    fork = client.post(f'/api/db/chapters/{chapters[0]}/fork',
+                       json={'creator_user_id': user_id, 'message_id': messages[1]['id'], 'name': '分支'}).get_json()
+    client.post(f"/api/db/chapters/{fork['id']}/messages", json={'user_id': user_id, 'role': 'user', 'content': '分支消息'})
+
+    records = _records(client.get(f"/api/db/chapters/{fork['id']}/export"))
+    assert records[0]['type'] == 'chapter' and records[0]['id'] == fork['id']
+    assert [record['content'] for record in records[1:]] == ['第一章消息0', '第一章消息1', '分支消息']
+
+
+def test_novel_export_requires_user(client):
+    assert client.get('/api/db/novels/export').status_code == 400
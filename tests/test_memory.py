@@ -0,0 +1,58 @@
+from app import memory as memory_module
+from app.memory import LongTermMemory, recall_context
+from app.models import db, ChapterStats
+
+
+def _chapter(client, user_id, contents):
+    world = client.post('/api/db/worlds', json={'user_id': user_id, 'name': '记忆世界'}).get_json()
+    chapter = client.post('/api/db/chapters', json={
+        'world_id': world['id'], 'creator_user_id': user_id, 'name': '第一章'
+    }).get_json()
+    ids = [
+        client.post(f"/api/db/chapters/{chapter['id']}/messages",
+                    json={'user_id': user_id, 'role': 'user', 'content': content}).get_json()['id']
+        for content in contents
+    ]
+    return chapter['id'], ids
+
+
+def test_stats_drift_rebuilds_once_not_every_turn(app, client, make_user, monkeypatch):
+    user_id = make_user()
+    chapter_id, ids = _chapter(client, user_id, ['青铜钥匙藏在井底', '今天天气不错', '去集市买酒'])
+    with app.app_context():
+        # 模拟 chapter_stats 与实际消息数不一致（旧数据未重建统计）
+        db.session.get(ChapterStats, chapter_id).message_count += 5
+        db.session.commit()
+
+    memory = LongTermMemory()
+    builds = []
+    original = memory._build
+    monkeypatch.setattr(memory, '_build', lambda index: (builds.append(index.chapter_id), original(index)))
+
+    with app.app_context():
+        memory.index(chapter_id)
+        memory.index(chapter_id)
+    assert len(builds) == 1
+
+    client.post(f'/api/db/chapters/{chapter_id}/messages', json={'user_id': user_id, 'role': 'user', 'content': '新消息'})
+    with app.app_context():
+        assert len(memory.index(chapter_id).order) == 4
+    assert len(builds) == 1
+
+    # 回溯改变了历史，需要重建
+    client.delete(f'/api/db/chapters/{chapter_id}/messages?id={ids[1]}')
+    with app.app_context():
+        assert len(memory.index(chapter_id).order) == 1
+    assert len(builds) == 2
+
+
+def test_recall_failure_rolls_back_session(app, monkeypatch):
+    def fail(*args, **kwargs):
+        raise RuntimeError('statement timeout')
+
+    rollbacks = []
+    monkeypatch.setattr(memory_module.memory, 'recall', fail)
+    with app.app_context():
+        monkeypatch.setattr(db.session, 'rollback', lambda: rollbacks.append(True))
+        assert recall_context(1, [{'role': 'user', 'content': '你好'}]) == []
+    assert rollbacks == [True]
@@ -0,0 +1,45 @@
+from app.metrics import Counter, Gauge, Histogram, Registry, observe_llm_call, LLM_COMPLETION_TOKENS
+from app.routing import LLMCallStats
+
+
+def test_registry_renders_prometheus_text_format():
+    registry = Registry()
+    requests = registry.register(Counter('requests_total', '请求数', ('path',)))
+    connections = registry.register(Gauge('connections', '连接数'))
+    latency = registry.register(Histogram('latency_seconds', '耗时', ('path',), buckets=(0.1, 1)))
+
+    requests.inc(path='/a"b')
+    requests.inc(2, path='/a"b')
+    connections.inc()
+    connections.inc()
+    connections.dec()
+    for value in (0.05, 0.5, 3):
+        latency.observe(value, path='/x')
+
+    lines = registry.render().splitlines()
+    assert lines[:3] == ['# HELP requests_total 请求数', '# TYPE requests_total counter', 'requests_total{path="/a\\"b"} 3']
+    assert 'connections 1' in lines
+    assert [line for line in lines if line.startswith('latency_seconds')] == [
+        'latency_seconds_bucket{path="/x",le="0.1"} 1',
+        'latency_seconds_bucket{path="/x",le="1"} 2',
+        'latency_seconds_bucket{path="/x",le="+Inf"} 3',
+        'latency_seconds_sum{path="/x"} 3.55',
+        'latency_seconds_count{path="/x"} 3',
+    ]
+
+
+def test_gauge_function_is_evaluated_at_scrape_time():
+    depth = [0]
+    gauge = Gauge('queue_depth', '队列长度')
+    gauge.set_function(lambda: depth[0])
+    depth[0] = 4
+    assert gauge.render()[-1] == 'queue_depth 4'
+
+
+def test_llm_calls_are_recorded_and_exposed(client):
+    observe_llm_call(LLMCallStats('chat', 'metrics-test-model', 10, 25, duration=1.5, ttft=0.5))
+    assert LLM_COMPLETION_TOKENS._values[('chat', 'metrics-test-model')] >= 25
+
+    body = client.get('/metrics').get_data(as_text=True)
+    assert 'llm_completion_tokens_total{endpoint="chat",model="metrics-test-model"}' in body
+    assert 'llm_tokens_per_second_count{model="metrics-test-model"}' in body
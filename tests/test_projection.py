@@ -0,0 +1,63 @@
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from app.models import db
+
+
+def _world(client, user_id):
+    world = client.post('/api/db/worlds', json={
+        'user_id': user_id, 'name': '投影世界', 'worldview': '很长的世界观' * 50, 'characters': [
+            {'name': '阿青', 'background': '铁匠之女'}, {'name': '老周', 'background': '退役镖师'}
+        ]
+    }).get_json()
+    return world['id']
+
+
+@contextmanager
+def _statements(app):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+
+def test_fields_limit_output_and_selected_columns(app, client, make_user):
+    world_id = _world(client, make_user())
+    with _statements(app) as statements:
+        world = client.get(f'/api/db/worlds/{world_id}?fields=name').get_json()
+
+    assert world == {'id': world_id, 'name': '投影世界'}
+    assert statements
+    assert not any('worldview' in statement or 'world_characters' in statement for statement in statements)
+
+
+def test_nested_fields_and_exclude(app, client, make_user):
+    world_id = _world(client, make_user())
+
+    world = client.get(f'/api/db/worlds/{world_id}?fields=name,main_characters.name').get_json()
+    assert world == {'id': world_id, 'name': '投影世界', 'main_characters': [{'name': '阿青'}, {'name': '老周'}]}
+
+    world = client.get(f'/api/db/worlds/{world_id}?exclude=worldview,main_characters.background').get_json()
+    assert 'worldview' not in world and world['master_setting'] is None
+    assert world['main_characters'] == [{'name': '阿青'}, {'name': '老周'}]
+
+
+def test_unknown_field_is_rejected(client):
+    response = client.get('/api/db/worlds?fields=name,password')
+    assert response.status_code == 400
+    assert 'password' in response.get_json()['error']
+
+
+def test_unrestricted_request_returns_every_field(client, make_user):
+    world_id = _world(client, make_user())
+    world = client.get(f'/api/db/worlds/{world_id}').get_json()
+    assert world['worldview'].startswith('很长的世界观')
+    assert len(world['main_characters']) == 2
@@ -0,0 +1,54 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from app import rate_limit
+from app.rate_limit import ChapterWorldCache, MemoryBucketBackend, RateLimiter, bind_identity, _current_identity, _charge_usage
+
+
+def test_chapter_world_cache_does_not_remember_missing_chapters(app, client, make_user):
+    user_id = make_user()
+    world = client.post('/api/db/worlds', json={'user_id': user_id, 'name': '限流世界'}).get_json()
+    cache = ChapterWorldCache()
+    with app.app_context():
+        assert cache.get(10 ** 9) is None
+        chapter = client.post('/api/db/chapters', json={
+            'world_id': world['id'], 'creator_user_id': user_id, 'name': '新章节'
+        }).get_json()
+        assert cache.get(chapter['id']) == world['id']
+        assert cache._entries and 10 ** 9 not in cache._entries
+
+
+def test_background_calls_are_charged_to_submitting_identity(monkeypatch):
+    limiter = RateLimiter(MemoryBucketBackend())
+    monkeypatch.setattr(rate_limit, 'limiter', limiter)
+    charged = []
+    monkeypatch.setattr(limiter, 'charge', lambda identity, tokens: charged.append((identity, tokens)))
+
+    class Stats:
+        prompt_tokens = 30
+        completion_tokens = 12
+
+    identity = ('ip:127.0.0.1', 'user:7', 'world:3')
+    token = _current_identity.set(identity)
+    try:
+        job = bind_identity(lambda: _charge_usage(Stats()))
+    finally:
+        _current_identity.reset(token)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        executor.submit(job).result()
+    assert charged == [(identity, 42)]
+
+
+def test_spoofed_user_ids_share_the_client_ip_bucket(app):
+    limiter = RateLimiter(MemoryBucketBackend())
+    limiter.request_limits['ip'] = (2, 0)
+    with app.test_request_context(environ_base={'REMOTE_ADDR': '10.0.0.1'}):
+        identities = [rate_limit._identify({'userId': n}) for n in range(3)]
+    assert [limiter.admit(identity).allowed for identity in identities] == [True, True, False]
+
+
+def test_world_denial_does_not_spend_user_quota():
+    limiter = RateLimiter(MemoryBucketBackend())
+    limiter.request_limits['user'] = (1, 0)
+    limiter.request_limits['world'] = (0, 0)
+    assert not limiter.admit(('ip:1', 'user:7', 'world:3')).allowed
+    assert limiter.admit(('ip:1', 'user:7', None)).allowed
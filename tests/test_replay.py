@@ -0,0 +1,39 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CASSETTE = os.path.join('bench', 'cassettes', 'handlers.jsonl')
+BASELINE = os.path.join('bench', 'cassettes', 'handlers.baseline.json')
+
+sys.path.insert(0, os.path.join(ROOT, 'bench'))
+
+from replay import SCENARIOS, compare  # noqa: E402
+
+
+def test_replay_handlers_against_baseline(tmp_path):
+    """回放已提交的 cassette，经四个真实处理器执行，响应体积超出基线容忍度时失败
+
+    回放在子进程中进行：LLM_PROVIDER 等配置在导入应用时读取，不能与本进程的假模型配置共用。
+    以 LLM_REPLAY_SPEED=0 回放、不比较耗时，避免受机器负载影响；耗时对比由 bench/replay.py 单独运行。
+    """
+    env = {key: value for key, value in os.environ.items() if not key.startswith(('LLM_', 'FAKE_LLM_'))}
+    env['DATABASE_URL'] = f"sqlite:///{tmp_path / 'replay.db'}"
+    result = subprocess.run(
+        [sys.executable, os.path.join('bench', 'replay.py'), 'replay',
+         '--cassette', CASSETTE, '--baseline', BASELINE, '--repeat', '1', '--speed', '0', '--size-only'],
+        cwd=ROOT, env=env, capture_output=True, text=True, timeout=300
+    )
+    assert result.returncode == 0, result.stdout[-2000:] + result.stderr[-4000:]
+    # 每个场景都正常结束并输出一行结果
+    reported = [line.split()[0] for line in result.stdout.splitlines() if line.strip()]
+    assert reported == list(SCENARIOS)
+
+
+def test_compare_reports_latency_and_size_regressions():
+    baseline = {'chat_stream': {'latency_ms': 100.0, 'response_bytes': 1000}}
+    assert compare({'chat_stream': {'latency_ms': 160.0, 'response_bytes': 1100}}, baseline, 0.2, 50) == []
+    regressions = compare({'chat_stream': {'latency_ms': 400.0, 'response_bytes': 2000}}, baseline, 0.2, 50)
+    assert len(regressions) == 2
+    assert len(compare({'chat_stream': {'latency_ms': 400.0, 'response_bytes': 1100}}, baseline, 0.2, 50,
+                       check_latency=False)) == 0
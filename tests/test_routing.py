@@ -0,0 +1,84 @@
+import time
+from concurrent.futures import ALL_COMPLETED, wait
+
+import pytest
+
+from app import routing
+from app.config import Config
+from app.fake_llm import FakeLLMClient, FakeLLMError, _Obj
+
+POLICY = {'primary': {'model': 'primary'}, 'fallback': {'model': 'fallback'}, 'hedge_after': 0.05}
+
+
+class RoutedClient:
+    """按 model 把请求分发给不同的假客户端，模拟主模型与备用模型"""
+
+    def __init__(self, **clients):
+        self.clients = clients
+        self.streams = {}
+        self.chat = _Obj(completions=_Obj(create=self.create))
+
+    def create(self, model=None, **kwargs):
+        client = self.clients[model]
+        if isinstance(client, Exception):
+            time.sleep(0.1)
+            raise client
+        response = client.chat.completions.create(model=model, **kwargs)
+        if kwargs.get('stream'):
+            self.streams[model] = response
+        return response
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    monkeypatch.setattr(Config, 'LLM_ROUTING', {'chat': POLICY, 'chat_stream': POLICY})
+    reported = []
+    monkeypatch.setattr(routing, '_call_listeners', [reported.append])
+    return reported
+
+
+def _text(chunks):
+    return ''.join(chunk.choices[0].delta.content or '' for chunk in chunks if chunk.choices)
+
+
+def test_stream_hedge_winner_is_the_first_to_produce_a_token(calls):
+    slow = FakeLLMClient(ttft=1.0, tokens_per_sec=0, completion_tokens=40)
+    fast = FakeLLMClient(ttft=0, tokens_per_sec=0, completion_tokens=20)
+    client = RoutedClient(primary=slow, fallback=fast)
+
+    chunks = list(routing.hedged_stream(client, 'chat_stream', messages=[{'role': 'user', 'content': '你好'}]))
+
+    assert len(_text(chunks)) == 20
+    assert client.streams['primary']._closed  # 落败的一路被立即关闭
+    assert [(stats.model, stats.completion_tokens) for stats in calls] == [('fallback', 20)]
+
+
+def test_stream_primary_wins_without_hedging_when_fast(calls):
+    client = RoutedClient(primary=FakeLLMClient(ttft=0, tokens_per_sec=0, completion_tokens=20),
+                          fallback=FakeLLMClient(ttft=0, tokens_per_sec=0))
+
+    chunks = list(routing.hedged_stream(client, 'chat_stream', messages=[]))
+
+    assert len(_text(chunks)) == 20
+    assert 'fallback' not in client.streams
+    assert [stats.model for stats in calls] == ['primary']
+
+
+def test_completion_prefers_success_when_both_finish_together(calls, monkeypatch):
+    # 对冲后等待两路都结束，使失败与成功的结果落在同一个 done 集合中
+    monkeypatch.setattr(routing, 'wait', lambda fs, timeout=None, return_when=None: wait(
+        fs, timeout=timeout, return_when=ALL_COMPLETED if len(fs) > 1 else return_when))
+    client = RoutedClient(primary=FakeLLMError('主模型失败'),
+                          fallback=FakeLLMClient(ttft=0.1, tokens_per_sec=0, completion_tokens=10))
+
+    response = routing.hedged_completion(client, 'chat', messages=[])
+
+    assert len(response.choices[0].message.content) == 10
+    assert [stats.model for stats in calls] == ['fallback']
+
+
+def test_completion_raises_only_when_every_route_failed(calls):
+    client = RoutedClient(primary=FakeLLMError('主模型失败'), fallback=FakeLLMError('备用模型失败'))
+    with pytest.raises(FakeLLMError):
+        routing.hedged_completion(client, 'chat', messages=[])
+    assert calls == []
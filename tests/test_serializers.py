@@ -0,0 +1,54 @@
+import json
+from datetime import datetime
+
+from app import serializers
+from app.models import db, World
+from app.serializers import CHAPTER, MESSAGE, WORLD, dumps
+
+
+def _world(client, user_id):
+    world = client.post('/api/db/worlds', json={
+        'user_id': user_id, 'name': '序列化世界', 'worldview': '群岛', 'characters': [
+            {'name': '阿青', 'background': '铁匠之女'}
+        ]
+    }).get_json()
+    chapter = client.post('/api/db/chapters', json={
+        'world_id': world['id'], 'creator_user_id': user_id, 'name': '第一章'
+    }).get_json()
+    return world['id'], chapter['id']
+
+
+def test_row_and_object_serialization_agree(app, client, make_user):
+    user_id = make_user()
+    world_id, _ = _world(client, user_id)
+    with app.app_context():
+        row = db.session.execute(WORLD.select().where(World.id == world_id)).one()
+        from_row = WORLD.from_rows([row])[0]
+        assert from_row == WORLD.from_object(db.session.get(World, world_id))
+        assert list(from_row) == list(WORLD.field_names)
+        assert isinstance(from_row['create_time'], str)
+
+
+def test_only_compiles_the_requested_columns():
+    columns = CHAPTER.columns(('id', 'name'))
+    assert [column.key for column in columns] == ['id', 'name']
+    # 多列字段（content 依赖 flags 解码）会带出它依赖的全部列
+    assert [column.key for column in MESSAGE.columns(('id', 'content'))] == ['id', 'content', 'flags']
+    assert CHAPTER.compile(('id', 'name')) is CHAPTER.compile(('id', 'name'))
+
+
+def test_message_content_is_decoded_through_flags(app, client, make_user):
+    user_id = make_user()
+    _, chapter_id = _world(client, user_id)
+    long_text = '长文本' * 2000
+    client.post(f'/api/db/chapters/{chapter_id}/messages', json={'user_id': user_id, 'role': 'ai', 'content': long_text})
+
+    messages = client.get(f'/api/db/chapters/{chapter_id}/messages').get_json()
+    assert messages[-1]['content'] == long_text
+
+
+def test_dumps_matches_stdlib_when_orjson_is_missing(monkeypatch):
+    data = {'name': '世界', 'ids': [1, 2], 'ok': True, 'time': datetime(2024, 1, 2).isoformat()}
+    with_orjson = dumps(data)
+    monkeypatch.setattr(serializers, 'orjson', None)
+    assert json.loads(dumps(data)) == json.loads(with_orjson) == data
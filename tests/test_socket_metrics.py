@@ -0,0 +1,25 @@
+from app import rate_limit
+from app.config import Config
+from app.metrics import SOCKETIO_EVENT_DURATION
+from app.rate_limit import MemoryBucketBackend, RateLimiter
+from app.routes.websocket import socketio
+
+
+def _handled(event):
+    state = SOCKETIO_EVENT_DURATION._values.get(SOCKETIO_EVENT_DURATION._key({'event': event}))
+    return state['count'] if state else 0
+
+
+def test_rate_limited_socket_events_are_not_tracked(app, monkeypatch):
+    monkeypatch.setattr(Config, 'RATE_LIMIT_ENABLED', True)
+    limiter = RateLimiter(MemoryBucketBackend())
+    limiter.request_limits = {'ip': (0, 0), 'user': (0, 0), 'world': (0, 0)}  # 所有请求都被拒绝
+    monkeypatch.setattr(rate_limit, 'limiter', limiter)
+
+    client = socketio.test_client(app)
+    client.get_received()
+    before = _handled('chat_suggestions_stream')
+    client.emit('chat_suggestions_stream', {'userId': 1, 'messages': [{'role': 'user', 'content': '你好'}]})
+    received = client.get_received()
+    assert [item['name'] for item in received] == ['chat_suggestions_error']
+    assert _handled('chat_suggestions_stream') == before
@@ -0,0 +1,34 @@
+def _post(client, chapter_id, user_id, count):
+    return [
+        client.post(f'/api/db/chapters/{chapter_id}/messages',
+                    json={'user_id': user_id, 'role': 'user', 'content': f'消息{i}'}).get_json()['id']
+        for i in range(count)
+    ]
+
+
+def _world_stats(client, world_id):
+    worlds = client.get('/api/db/worlds?stats=true&fields=id').get_json()
+    return next(world['stats'] for world in worlds if world['id'] == world_id)
+
+
+def test_world_totals_count_stored_messages_only(client, make_user):
+    user_id = make_user()
+    world = client.post('/api/db/worlds', json={'user_id': user_id, 'name': '统计世界'}).get_json()
+    chapter = client.post('/api/db/chapters', json={
+        'world_id': world['id'], 'creator_user_id': user_id, 'name': '主线'
+    }).get_json()
+    ids = _post(client, chapter['id'], user_id, 5)
+    fork = client.post(f"/api/db/chapters/{chapter['id']}/fork",
+                       json={'creator_user_id': user_id, 'message_id': ids[-1]}).get_json()
+    _post(client, fork['id'], user_id, 2)
+
+    chapters = {item['id']: item['stats'] for item in
+                client.get(f"/api/db/worlds/{world['id']}/chapters?stats=true&fields=id").get_json()}
+    assert chapters[fork['id']]['message_count'] == 7
+    stats = _world_stats(client, world['id'])
+    assert stats['message_count'] == 7
+    assert stats['total_chars'] == 7 * len('消息0')
+
+    # 父章节回溯前分支被物化（复制继承的 5 条），之后主线剩 3 条、分支存储 7 条
+    client.delete(f"/api/db/chapters/{chapter['id']}/messages?id={ids[3]}")
+    assert _world_stats(client, world['id'])['message_count'] == 3 + 7
@@ -0,0 +1,93 @@
+import threading
+
+from app import suggestions
+from app.config import Config
+from app.routes import websocket
+from app.routes.websocket import socketio
+from app.suggestions import SuggestionPrefetcher
+
+
+def _chapter(client, user_id, contents):
+    world = client.post('/api/db/worlds', json={'user_id': user_id, 'name': '建议世界'}).get_json()
+    chapter = client.post('/api/db/chapters', json={
+        'world_id': world['id'], 'creator_user_id': user_id, 'name': '第一章'
+    }).get_json()
+    for content in contents:
+        client.post(f"/api/db/chapters/{chapter['id']}/messages",
+                    json={'user_id': user_id, 'role': 'user', 'content': content})
+    return chapter['id']
+
+
+def test_prefetch_uses_history_loaded_from_database(app, client, make_user, monkeypatch):
+    monkeypatch.setattr(Config, 'SUGGESTION_PREFETCH_ENABLED', True)
+    scheduled = []
+    monkeypatch.setattr(websocket.prefetcher, 'schedule',
+                        lambda chapter_id, message_id, data, on_ready=None: scheduled.append((chapter_id, data)))
+    user_id = make_user()
+    chapter_id = _chapter(client, user_id, ['推开客栈的门', '向掌柜打听消息'])
+
+    sio = socketio.test_client(app)
+    sio.emit('chat_stream', {'chapterId': chapter_id, 'userId': user_id})
+    names = [item['name'] for item in sio.get_received()]
+    assert 'chat_stream_end' in names
+
+    [(scheduled_chapter, data)] = scheduled
+    assert scheduled_chapter == chapter_id
+    # 前端未传 messages：预取上下文为数据库中的历史加上本轮AI回复
+    assert [m['content'] for m in data['messages'][:2]] == ['推开客栈的门', '向掌柜打听消息']
+    assert data['messages'][-1]['role'] == 'ai' and data['messages'][-1]['content']
+
+
+def _blocking_generator(monkeypatch, release):
+    """替换 stream_suggestions：等待 release 后返回结果，期间响应取消"""
+    def fake_stream(data, on_field=None, should_stop=None):
+        while not release.wait(0.01):
+            if should_stop and should_stop():
+                return None
+        return {'suggestion_1': data['messages'][-1]['content']}
+    monkeypatch.setattr(suggestions, 'stream_suggestions', fake_stream)
+
+
+def test_get_waits_for_in_flight_prefetch(monkeypatch):
+    release = threading.Event()
+    _blocking_generator(monkeypatch, release)
+    prefetcher = SuggestionPrefetcher(max_workers=1)
+    ready = []
+    prefetcher.schedule(1, 10, {'messages': [{'role': 'ai', 'content': '回复'}]}, on_ready=ready.append)
+
+    assert prefetcher.get(1, 10) is None
+    threading.Timer(0.05, release.set).start()
+    assert prefetcher.get(1, 10, wait=5) == {'suggestion_1': '回复'}
+    assert ready == [{'suggestion_1': '回复'}]
+    # 其他章节状态不会命中缓存
+    assert prefetcher.get(1, 11) is None
+
+
+def test_cancel_discards_prefetch_result(monkeypatch):
+    release = threading.Event()
+    _blocking_generator(monkeypatch, release)
+    prefetcher = SuggestionPrefetcher(max_workers=1)
+    ready = []
+    task = prefetcher.schedule(2, 20, {'messages': [{'role': 'ai', 'content': '回复'}]}, on_ready=ready.append)
+
+    assert prefetcher.cancel(2)
+    release.set()
+    if not task.future.cancelled():
+        task.future.result(timeout=5)
+    assert prefetcher.get(2, 20, wait=0.1) is None
+    assert ready == []
+    assert not prefetcher.cancel(2)
+
+
+def test_new_state_replaces_previous_prefetch(monkeypatch):
+    release = threading.Event()
+    _blocking_generator(monkeypatch, release)
+    prefetcher = SuggestionPrefetcher(max_workers=2)
+    first = prefetcher.schedule(3, 30, {'messages': [{'role': 'ai', 'content': '旧回复'}]})
+    second = prefetcher.schedule(3, 31, {'messages': [{'role': 'ai', 'content': '新回复'}]})
+    release.set()
+    second.future.result(timeout=5)
+
+    assert first.cancelled.is_set()
+    assert prefetcher.get(3, 30) is None
+    assert prefetcher.get(3, 31) == {'suggestion_1': '新回复'}
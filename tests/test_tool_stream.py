@@ -0,0 +1,56 @@
+import json
+
+from app.fake_llm import FakeLLMClient
+from app.suggestions import SUGGESTION_TOOLS
+from app.tool_stream import PartialJSONObjectParser, ToolCallAccumulator
+
+DOCUMENT = json.dumps({
+    'suggestion_1': '她说：“别走。”',
+    'quote': 'say \"hi\", then \\ leave {not an object}',
+    'unicode': '你好',
+    'tags': ['剑', {'nested': '[1, 2]'}],
+    'detail': {'level': 2, 'note': 'a,b}'},
+    'count': 12,
+    'ratio': -0.5,
+    'enabled': True,
+    'missing': None,
+}, ensure_ascii=False)
+
+
+def _feed(pieces):
+    parser = PartialJSONObjectParser()
+    fields = []
+    for piece in pieces:
+        fields.extend(parser.feed(piece))
+    return fields
+
+
+def test_fields_match_full_parse_when_fed_one_char_at_a_time():
+    assert _feed(DOCUMENT) == list(json.loads(DOCUMENT).items())
+
+
+def test_fields_match_full_parse_at_every_split_point():
+    expected = list(json.loads(DOCUMENT).items())
+    for split in range(1, len(DOCUMENT)):
+        assert _feed([DOCUMENT[:split], DOCUMENT[split:]]) == expected, split
+
+
+def test_string_field_is_returned_as_soon_as_it_closes():
+    parser = PartialJSONObjectParser()
+    assert parser.feed('{"a": "x\\"y"') == [('a', 'x"y')]
+    # 原始值要等到分隔符到达才能确定结束
+    assert parser.feed(', "b": 1') == []
+    assert parser.feed('0}') == [('b', 10)]
+    assert parser.feed(' trailing') == []
+
+
+def test_accumulator_streams_fake_tool_call_fields():
+    client = FakeLLMClient(ttft=0, tokens_per_sec=0, chunk_tokens=3)
+    stream = client.chat.completions.create(model='fake', messages=[], stream=True, tools=SUGGESTION_TOOLS)
+    accumulator = ToolCallAccumulator()
+    fields = [field for chunk in stream for field in accumulator.feed_chunk(chunk)]
+
+    result = accumulator.result()
+    assert result['function']['name'] == 'generate_reply_suggestions'
+    assert fields == list(json.loads(result['function']['arguments']).items())
+    assert [name for name, _ in fields] == [f'suggestion_{n}' for n in range(1, 7)]
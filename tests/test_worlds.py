@@ -0,0 +1,80 @@
+import pytest
+from sqlalchemy import func, select
+
+from app import worlds
+from app.models import db, Chapter, UserWorld, World, WorldCharacter
+from app.routes.websocket import socketio
+from app.worlds import materialize_world_setting
+
+
+def _arguments(**overrides):
+    arguments = {field: f'{field}示例' for field in worlds.WORLD_SETTING_TOOLS[0]['function']['parameters']['required']}
+    arguments.update(other_character_names=['阿青', '老周'], other_character_backgrounds=['铁匠之女', '退役镖师'])
+    arguments.update(overrides)
+    return arguments
+
+
+def _world_count():
+    return db.session.scalar(select(func.count()).select_from(World))
+
+
+def test_materialize_creates_world_characters_chapter_and_membership(app, make_user):
+    user_id = make_user()
+    with app.app_context():
+        result = materialize_world_setting(_arguments(world_name='雾港'), user_id)
+
+        world = db.session.get(World, result['world_id'])
+        assert world.name == '雾港' and world.user_id == user_id
+        assert '角色名：character_name示例' in world.master_setting
+        characters = db.session.scalars(select(WorldCharacter).where(WorldCharacter.world_id == world.id)
+                                        .order_by(WorldCharacter.id)).all()
+        assert [c.id for c in characters] == result['character_ids']
+        assert [(c.name, c.background) for c in characters] == [('阿青', '铁匠之女'), ('老周', '退役镖师')]
+        chapter = db.session.get(Chapter, result['chapter_id'])
+        assert chapter.is_default and chapter.opening == 'opening_line示例'
+        assert db.session.get(UserWorld, result['user_world_id']).role == 'creator'
+
+
+@pytest.mark.parametrize('arguments, message', [
+    ('{not json', '不是合法的JSON'),
+    (_arguments(world_name=None), 'world_name类型错误'),
+    (_arguments(other_character_names=['阿青']), '长度不一致'),
+    ({'world_name': '缺字段'}, '缺少'),
+])
+def test_invalid_arguments_are_rejected_without_writing(app, make_user, arguments, message):
+    user_id = make_user()
+    with app.app_context():
+        before = _world_count()
+        with pytest.raises(ValueError, match=message):
+            materialize_world_setting(arguments, user_id)
+        assert _world_count() == before
+
+
+def test_failure_midway_rolls_back_every_row(app, make_user, monkeypatch):
+    user_id = make_user()
+
+    def broken(world_ids):
+        raise RuntimeError('统计刷新失败')
+    monkeypatch.setattr(worlds, 'refresh_worlds', broken)
+    with app.app_context():
+        before = _world_count()
+        with pytest.raises(RuntimeError):
+            materialize_world_setting(_arguments(), user_id)
+        assert _world_count() == before
+        assert db.session.scalar(select(func.count()).select_from(UserWorld).where(UserWorld.user_id == user_id)) == 0
+
+
+def test_world_creator_event_materializes_fake_tool_call(app, make_user):
+    user_id = make_user()
+    sio = socketio.test_client(app)
+    sio.get_received()
+    sio.emit('world-creator', {'message': '一个蒸汽朋克港口', 'userId': user_id, 'stream': True, 'materialize': True})
+    received = sio.get_received()
+
+    names = [item['name'] for item in received]
+    assert 'world_creator_field' in names
+    [end] = [item['args'][0] for item in received if item['name'] == 'world_creator_end']
+    assert 'materialize_error' not in end
+    with app.app_context():
+        assert db.session.get(World, end['world_id']).user_id == user_id
+        assert db.session.get(Chapter, end['chapter_id']).world_id == end['world_id']